@@ -0,0 +1,214 @@
+""" Read-only JSON API over livestatus, run by Apache's mod_wsgi.
+
+    GET /nagios-api/services   services, see FILTERS for the parameters
+    GET /nagios-api/hosts      hosts
+    GET /nagios-api/summary    host and service counts by state
+
+    e.g. /nagios-api/services?state=critical,warning&hostgroup=mysql
+
+    Responses are cached for NAGIOS_API_TTL seconds, so any number of
+    dashboards polling the same view cost livestatus one query per TTL.
+    Requests that miss the cache for the same view together wait for the
+    one thread refreshing it rather than each querying livestatus.
+    The socket and TTL come from the request environment, set with SetEnv
+    by the Apache configuration the charm writes.
+
+    This file is juju managed. """
+
+import json
+import re
+import threading
+import time
+
+try:
+    from urllib.parse import parse_qs
+except ImportError:
+    from urlparse import parse_qs
+
+from nagios_livestatus import DEFAULT_SOCKET, LivestatusClient, \
+    LivestatusError, Query
+
+DEFAULT_TTL = 10
+STATES = {
+    'hosts': {'up': 0, 'down': 1, 'unreachable': 2},
+    'services': {'ok': 0, 'warning': 1, 'critical': 2, 'unknown': 3},
+}
+DEFAULT_COLUMNS = {
+    'hosts': ['name', 'state', 'last_state_change', 'plugin_output'],
+    'services': ['host_name', 'description', 'state', 'last_state_change',
+                 'plugin_output'],
+}
+COLUMN_RE = re.compile(r'^[a-z_]+$')
+# parameter: (livestatus column, operator) for each table
+FILTERS = {
+    'hosts': {'host': ('name', '='), 'hostgroup': ('groups', '>=')},
+    'services': {'host': ('host_name', '='),
+                 'hostgroup': ('host_groups', '>='),
+                 'service': ('description', '='),
+                 'servicegroup': ('groups', '>=')},
+}
+
+_clients = {}
+_cache = {}
+# key: the lock held by the thread refreshing that view
+_refreshing = {}
+_lock = threading.Lock()
+
+
+class BadRequest(Exception):
+    pass
+
+
+def client(path):
+    with _lock:
+        if path not in _clients:
+            _clients[path] = LivestatusClient(path)
+        return _clients[path]
+
+
+def _alternatives(column, operator, values):
+    """ Filter lines matching any of values. """
+    lines = ['%s %s %s' % (column, operator, value) for value in values]
+    if len(values) > 1:
+        lines.append('Or: %d' % len(values))
+    return lines
+
+
+def build_query(table, params):
+    """ The livestatus Query for a hosts or services request. """
+    columns = DEFAULT_COLUMNS[table]
+    if params.get('columns'):
+        columns = params['columns'][0].split(',')
+        bad = [c for c in columns if not COLUMN_RE.match(c)]
+        if bad:
+            raise BadRequest('Bad column names: %s' % ', '.join(bad))
+    filters = []
+    if params.get('state'):
+        states = []
+        for state in params['state'][0].split(','):
+            state = state.strip().lower()
+            if state.isdigit():
+                states.append(int(state))
+            elif state in STATES[table]:
+                states.append(STATES[table][state])
+            else:
+                raise BadRequest('Unknown %s state %s' % (table[:-1], state))
+        filters.extend(_alternatives('state', '=', states))
+    for param, (column, operator) in sorted(FILTERS[table].items()):
+        if params.get(param):
+            filters.extend(_alternatives(column, operator,
+                                         params[param][0].split(',')))
+    limit = None
+    if params.get('limit'):
+        try:
+            limit = int(params['limit'][0])
+        except ValueError:
+            raise BadRequest('limit must be an integer')
+    try:
+        return Query(table, columns, filters, limit)
+    except LivestatusError as e:
+        raise BadRequest(str(e))
+
+
+def summary(livestatus):
+    """ Hosts and services per state, in one round trip. """
+    queries = [Query(table, stats=['state = %d' % number
+                                   for _, number in sorted(
+                                       states.items(), key=lambda s: s[1])])
+               for table, states in sorted(STATES.items())]
+    result = {}
+    for (table, states), rows in zip(sorted(STATES.items()),
+                                     livestatus.batch(queries)):
+        counts = rows[0] if rows else {}
+        result[table] = dict(
+            (name, counts.get('stats_%d' % number, 0))
+            for name, number in states.items())
+    return result
+
+
+def render(path, params, livestatus):
+    if path == '/summary':
+        return summary(livestatus)
+    table = path.strip('/')
+    if table not in STATES:
+        return None
+    query = build_query(table, params)
+    return list(livestatus.batch([query])[0])
+
+
+def _fresh(key, now):
+    with _lock:
+        entry = _cache.get(key)
+    if entry and entry[0] > (now or time.time()):
+        return entry
+    return None
+
+
+def cached(key, ttl, compute, now=None):
+    """ The body for key, computed at most once per ttl seconds by a single
+        thread, the others asking for key meanwhile waiting for it. """
+    entry = _fresh(key, now)
+    if entry:
+        return entry[1]
+    with _lock:
+        refresh = _refreshing.setdefault(key, threading.Lock())
+    with refresh:
+        # whoever held the lock before us may have refreshed it already
+        entry = _fresh(key, now)
+        if entry:
+            return entry[1]
+        now = now or time.time()
+        body = compute()
+        with _lock:
+            _cache[key] = (now + ttl, body)
+            # drop whatever has expired, the cache only holds recent views
+            for stale in [k for k, (expires, _) in _cache.items()
+                          if expires <= now]:
+                del _cache[stale]
+                if not _refreshing[stale].locked():
+                    del _refreshing[stale]
+    return body
+
+
+def _respond(start_response, status, body, ttl=0):
+    headers = [('Content-Type', 'application/json'),
+               ('Content-Length', str(len(body)))]
+    if ttl:
+        headers.append(('Cache-Control', 'max-age=%d' % ttl))
+    start_response(status, headers)
+    return [body]
+
+
+def _error(start_response, status, message):
+    return _respond(start_response, status,
+                    json.dumps({'error': message}).encode('utf-8'))
+
+
+def application(environ, start_response):
+    if environ.get('REQUEST_METHOD', 'GET') not in ('GET', 'HEAD'):
+        return _error(start_response, '405 Method Not Allowed',
+                      'Only GET is supported')
+    path = environ.get('PATH_INFO') or '/'
+    query_string = environ.get('QUERY_STRING', '')
+    params = parse_qs(query_string)
+    ttl = int(environ.get('NAGIOS_API_TTL', DEFAULT_TTL))
+    livestatus = client(environ.get('LIVESTATUS_PATH', DEFAULT_SOCKET))
+    key = (path, tuple(sorted((k, tuple(v)) for k, v in params.items())))
+
+    def compute():
+        result = render(path, params, livestatus)
+        if result is None:
+            return None
+        return json.dumps(result, separators=(',', ':')).encode('utf-8')
+
+    try:
+        body = cached(key, ttl, compute)
+    except BadRequest as e:
+        return _error(start_response, '400 Bad Request', str(e))
+    except (LivestatusError, EnvironmentError) as e:
+        return _error(start_response, '502 Bad Gateway',
+                      'Livestatus unavailable: %s' % e)
+    if body is None:
+        return _error(start_response, '404 Not Found',
+                      'Unknown resource %s' % path)
+    return _respond(start_response, '200 OK', body, ttl)
@@ -0,0 +1,267 @@
+""" Client for the MK Livestatus socket of the charm's Nagios.
+
+    Connections are kept open with "KeepAlive: on" and reused from a small
+    pool, several queries can be sent down one connection in a single
+    write, and responses are parsed row by row as they arrive rather than
+    read whole and decoded in one go.
+
+        client = LivestatusClient('/var/lib/nagios3/livestatus/socket')
+        for row in client.query('services', ['host_name', 'state'],
+                                ['state = 2']):
+            print(row['host_name'])
+
+    This file is juju managed. """
+
+import codecs
+import json
+import socket
+import threading
+
+from collections import deque
+
+DEFAULT_SOCKET = '/var/lib/nagios3/livestatus/socket'
+# "200          1234\n": status code and length of the response body
+HEADER_LENGTH = 16
+READ_SIZE = 64 * 1024
+COMBINATORS = ('And:', 'Or:', 'Negate:')
+
+
+class LivestatusError(Exception):
+    pass
+
+
+class ConnectionClosed(LivestatusError):
+    pass
+
+
+class Query(object):
+    """ A GET request for a livestatus table.
+
+        columns  the columns to return, all of them if empty
+        filters  livestatus filter expressions, e.g. "state = 2", ANDed
+                 unless combined by "Or: 2" and the like
+        stats    Stats: expressions, each adding a count column """
+
+    def __init__(self, table, columns=(), filters=(), limit=None, stats=()):
+        self.table = table
+        self.columns = list(columns)
+        self.filters = list(filters)
+        self.limit = limit
+        self.stats = list(stats)
+        for expression in self.filters + self.stats:
+            if '\n' in expression:
+                raise LivestatusError('Newline in livestatus expression %r' %
+                                      expression)
+
+    def names(self):
+        """ The names of the columns in each row, None if only the first
+            row of the response can tell. """
+        if not self.columns and not self.stats:
+            return None
+        return self.columns + ['stats_%d' % i for i in range(len(self.stats))]
+
+    def text(self):
+        lines = ['GET %s' % self.table]
+        if self.columns:
+            lines.append('Columns: %s' % ' '.join(self.columns))
+        lines.extend(expression if expression.startswith(COMBINATORS)
+                     else 'Filter: %s' % expression
+                     for expression in self.filters)
+        lines.extend('Stats: %s' % expression for expression in self.stats)
+        if self.limit:
+            lines.append('Limit: %d' % self.limit)
+        lines.extend((
+            'ColumnHeaders: %s' % ('off' if self.names() else 'on'),
+            'OutputFormat: json',
+            'KeepAlive: on',
+            'ResponseHeader: fixed16',
+        ))
+        return '\n'.join(lines) + '\n\n'
+
+
+class RowDecoder(object):
+    """ Incremental decoder of a JSON list of rows arriving in chunks. """
+
+    def __init__(self):
+        self.text = codecs.getincrementaldecoder('utf-8')('replace')
+        self.json = json.JSONDecoder()
+        self.buffer = ''
+        self.started = False
+
+    def feed(self, chunk):
+        """ Return the rows completed by chunk. """
+        self.buffer += self.text.decode(chunk)
+        rows = []
+        pos = 0
+        end = len(self.buffer)
+        while True:
+            while pos < end and self.buffer[pos] in ' \t\r\n,]':
+                pos += 1
+            if pos == end:
+                break
+            if not self.started:
+                if self.buffer[pos] != '[':
+                    raise LivestatusError('Unexpected livestatus output %r' %
+                                          self.buffer[pos:pos + 80])
+                self.started = True
+                pos += 1
+                continue
+            try:
+                row, pos = self.json.raw_decode(self.buffer, pos)
+            except ValueError:
+                # the rest of the row is still to come
+                break
+            rows.append(row)
+        self.buffer = self.buffer[pos:]
+        return rows
+
+    def close(self):
+        """ Check nothing but whitespace was left over. """
+        rest = (self.buffer + self.text.decode(b'', True)).strip()
+        if rest or not self.started:
+            raise LivestatusError('Truncated livestatus output %r' %
+                                  rest[:80])
+
+
+class Connection(object):
+
+    def __init__(self, path, timeout=10):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        try:
+            self.sock.connect(path)
+        except socket.error:
+            self.sock.close()
+            raise
+
+    def send(self, queries):
+        self.sock.sendall(''.join(q.text() for q in queries).encode('utf-8'))
+
+    def _recv(self, size):
+        chunk = self.sock.recv(min(size, READ_SIZE))
+        if not chunk:
+            raise ConnectionClosed('Livestatus closed the connection')
+        return chunk
+
+    def response(self):
+        """ Read the header of the next response, returning an iterator
+            over its rows. The rows must be read before the next response. """
+        header = b''
+        while len(header) < HEADER_LENGTH:
+            header += self._recv(HEADER_LENGTH - len(header))
+        header = header.decode('ascii')
+        status, length = int(header[:3]), int(header[4:].strip())
+        if status != 200:
+            body = b''
+            while len(body) < length:
+                body += self._recv(length - len(body))
+            raise LivestatusError('Livestatus error %d: %s' % (
+                status, body.decode('utf-8', 'replace').strip()))
+        return self._rows(length)
+
+    def _rows(self, length):
+        decoder = RowDecoder()
+        while length:
+            chunk = self._recv(length)
+            length -= len(chunk)
+            for row in decoder.feed(chunk):
+                yield row
+        decoder.close()
+
+    def close(self):
+        self.sock.close()
+
+
+class LivestatusClient(object):
+    """ A pool of keep-alive connections to one livestatus socket, safe to
+        share between threads. """
+
+    def __init__(self, path=DEFAULT_SOCKET, pool_size=4, timeout=10):
+        self.path = path
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._idle = deque()
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return Connection(self.path, self.timeout), False
+
+    def _release(self, connection):
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        with self._lock:
+            while self._idle:
+                self._idle.pop().close()
+
+    def _start(self, queries):
+        """ Send queries in one write and read the first response header,
+            retrying once on a fresh connection if a pooled one turns out
+            to have been closed by livestatus. """
+        connection, reused = self._acquire()
+        try:
+            connection.send(queries)
+            return connection, connection.response()
+        except (socket.error, ConnectionClosed):
+            connection.close()
+            if not reused:
+                raise
+        except Exception:
+            connection.close()
+            raise
+        connection = Connection(self.path, self.timeout)
+        try:
+            connection.send(queries)
+            return connection, connection.response()
+        except Exception:
+            connection.close()
+            raise
+
+    def _responses(self, queries):
+        """ Yield (query, rows) for each query in turn. The connection goes
+            back to the pool only once every response has been read. """
+        connection, rows = self._start(queries)
+        finished = False
+        try:
+            for i, query in enumerate(queries):
+                if i:
+                    rows = connection.response()
+                yield query, rows
+                for _ in rows:
+                    # drain whatever the caller left unread
+                    pass
+            finished = True
+        finally:
+            if finished:
+                self._release(connection)
+            else:
+                connection.close()
+
+    @staticmethod
+    def _dicts(query, rows):
+        names = query.names()
+        for row in rows:
+            if names is None:
+                names = row
+                continue
+            yield dict(zip(names, row))
+
+    def query(self, table, columns=(), filters=(), limit=None, stats=()):
+        """ Yield each row of a query as a dict of column to value. """
+        query = Query(table, columns, filters, limit, stats)
+        for query, rows in self._responses([query]):
+            for row in self._dicts(query, rows):
+                yield row
+
+    def batch(self, queries):
+        """ Run several Query objects over one connection, returning the
+            rows of each as a list of dicts. """
+        return [list(self._dicts(query, rows))
+                for query, rows in self._responses(queries)]
@@ -0,0 +1,230 @@
+#!/usr/bin/python
+""" Turn Nagios bulk performance data into a Prometheus text file.
+
+    Nagios appends the perfdata of every check to a spool file, one line
+    per result laid out by the charm's *_perfdata_file_template:
+
+        TIMET <tab> HOSTNAME <tab> SERVICEDESC <tab> PERFDATA
+
+    and runs this every *_perfdata_file_processing_interval seconds as its
+    processing command. Nagios waits for that command, so with --detach it
+    only moves the spool file aside and leaves the rest to a child Nagios
+    does not wait for. The child parses the results since the last run,
+    merges them into the latest value of every metric kept in a state
+    file, and rewrites the metrics file Apache serves. Parsing is
+    proportional to the new results, the state and metrics files hold one
+    entry per metric of the fleet and are rewritten whole, but only by a
+    run that has something new.
+
+    This file is juju managed. """
+
+from __future__ import print_function
+
+import argparse
+import errno
+import fcntl
+import glob
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+
+STATE_FILE = 'exporter-state.json'
+METRICS_FILE = 'metrics'
+# Metrics not refreshed for this long are dropped, their service is gone
+MAX_AGE = 3600
+
+# 'label with spaces'=value[uom];[warn];[crit];[min];[max]
+PERFDATA_RE = re.compile(r"""('(?:[^']|'')+'|[^'=\s]+)=(\S+)""")
+VALUE_RE = re.compile(r'^([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)(.*)$')
+# uom: (metric suffix, scale to base unit)
+UNITS = {
+    '': ('', 1),
+    's': ('_seconds', 1),
+    'ms': ('_seconds', 1e-3),
+    'us': ('_seconds', 1e-6),
+    '%': ('_percent', 1),
+    'B': ('_bytes', 1),
+    'KB': ('_bytes', 1024),
+    'MB': ('_bytes', 1024 ** 2),
+    'GB': ('_bytes', 1024 ** 3),
+    'TB': ('_bytes', 1024 ** 4),
+    'c': ('_total', 1),
+}
+METRIC_PREFIX = 'nagios_perfdata'
+THRESHOLDS = ('warning', 'critical')
+
+
+def parse_unit(label, uom):
+    """ Normalise a perfdata label and unit of measure. """
+    if label.startswith("'"):
+        label = label[1:-1].replace("''", "'")
+    suffix, scale = UNITS.get(uom, UNITS[''])
+    return label, suffix, scale
+
+
+def _number(text, scale):
+    try:
+        return float(text) * scale
+    except ValueError:
+        # empty or a range such as 10:20, which has no single value
+        return None
+
+
+def parse_perfdata(perfdata):
+    """ Yield (label, suffix, value, warning, critical) for each metric in
+        a plugin's performance data, skipping anything malformed. """
+    for label, rest in PERFDATA_RE.findall(perfdata):
+        fields = rest.split(';')
+        match = VALUE_RE.match(fields[0])
+        if not match:
+            continue
+        label, suffix, scale = parse_unit(label, match.group(2))
+        thresholds = [_number(f, scale) for f in (fields[1:3] + ['', ''])[:2]]
+        yield (label, suffix, float(match.group(1)) * scale) + \
+            tuple(thresholds)
+
+
+def merge_spool(path, samples):
+    """ Fold the results in a spool file into samples, keyed by
+        "host\\tservice\\tlabel\\tsuffix", returning the lines read. """
+    count = 0
+    with open(path) as spool:
+        for line in spool:
+            parts = line.rstrip('\n').split('\t', 3)
+            if len(parts) != 4 or not parts[3]:
+                continue
+            timet, host, service, perfdata = parts
+            try:
+                timet = int(timet)
+            except ValueError:
+                continue
+            count += 1
+            for label, suffix, value, warning, critical in \
+                    parse_perfdata(perfdata):
+                key = '\t'.join((host, service, label, suffix))
+                samples[key] = [timet, value, warning, critical]
+    return count
+
+
+def _escape(value):
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def format_value(value):
+    return repr(float(value))
+
+
+def render_metrics(samples):
+    """ The samples in the Prometheus text exposition format. """
+    families = {}
+    for key, (timet, value, warning, critical) in samples.items():
+        host, service, label, suffix = key.split('\t')
+        labels = 'host="%s",service="%s",label="%s"' % (
+            _escape(host), _escape(service), _escape(label))
+        for kind, number in (('', value), ('_warning', warning),
+                             ('_critical', critical)):
+            if number is None:
+                continue
+            name = METRIC_PREFIX + suffix + kind
+            families.setdefault(name, []).append(
+                '%s{%s} %s %d' % (name, labels, format_value(number),
+                                  timet * 1000))
+    lines = []
+    for name in sorted(families):
+        lines.append('# TYPE %s %s' % (
+            name, 'counter' if name.endswith('_total') else 'gauge'))
+        lines.extend(sorted(families[name]))
+    return '\n'.join(lines) + '\n' if lines else ''
+
+
+def _replace(path, content, perms=0o644):
+    with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(path),
+                                     delete=False) as new_file:
+        new_file.write(content)
+        os.fchmod(new_file.fileno(), perms)
+    os.rename(new_file.name, path)
+
+
+def rotate(spool_file):
+    """ Move the file Nagios just closed aside for processing. """
+    try:
+        os.rename(spool_file, '%s.%d.%d' % (spool_file, time.time(),
+                                            os.getpid()))
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+def detach():
+    """ Carry on in a child of init with nothing open Nagios could wait
+        on, letting the processing command return straight away. """
+    if os.fork():
+        os._exit(0)
+    os.setsid()
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(devnull, fd)
+    os.close(devnull)
+
+
+def process(spool_dir, metrics_dir, max_age=MAX_AGE, now=None):
+    """ Merge the rotated spool files in spool_dir into the metrics file
+        until none are left. Returns the number of results processed, None
+        if another run is at it and will pick up what is there. """
+    now = now or time.time()
+    state_path = os.path.join(spool_dir, STATE_FILE)
+    with open(os.path.join(spool_dir, '.lock'), 'w') as lock:
+        # the host and service processing commands may overlap
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as e:
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                return None
+            raise
+        try:
+            with open(state_path) as f:
+                samples = json.load(f)
+        except (IOError, ValueError):
+            samples = {}
+        count = 0
+        while True:
+            rotated = sorted(glob.glob(os.path.join(spool_dir,
+                                                    '*-perfdata.*')))
+            for path in rotated:
+                count += merge_spool(path, samples)
+            expired = [k for k, v in samples.items() if now - v[0] > max_age]
+            for key in expired:
+                del samples[key]
+            if rotated or expired:
+                _replace(os.path.join(metrics_dir, METRICS_FILE),
+                         render_metrics(samples))
+                _replace(state_path, json.dumps(samples), 0o600)
+                for path in rotated:
+                    os.unlink(path)
+            if not rotated:
+                return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--spool-dir', required=True)
+    parser.add_argument('--metrics-dir', required=True)
+    parser.add_argument('--rotate', metavar='SPOOL_FILE',
+                        help='the spool file to move aside first')
+    parser.add_argument('--detach', action='store_true',
+                        help='process in the background once rotated')
+    parser.add_argument('--max-age', type=int, default=MAX_AGE)
+    args = parser.parse_args(argv)
+    if args.rotate:
+        rotate(args.rotate)
+    if args.detach:
+        detach()
+    process(args.spool_dir, args.metrics_dir, args.max_age)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,374 @@
+#!/usr/bin/python
+""" Send queued Nagios notifications to PagerDuty.
+
+    Nagios' notification commands run pagerduty_enqueue, which only writes
+    each event to a file in the queue directory. This long running
+    dispatcher watches the directory with inotify and posts each event to
+    the PagerDuty Nagios API as soon as it appears. The queue files are the
+    ones pagerduty_nagios.pl used, pd_<time>_<pid>.txt with a key=value
+    line per field, so anything it left queued is sent too.
+
+    Events are spread over a bounded number of workers, each with its own
+    keep-alive HTTPS connection, so an outage storm costs a few TLS
+    handshakes rather than one per notification. All events of a host or
+    service go to the same worker, in the order they were queued, so a
+    recovery never overtakes its problem. An event stays on disk until
+    PagerDuty accepts or rejects it, and is retried with exponential
+    backoff while PagerDuty or the network are failing.
+
+    This file is juju managed. """
+
+from __future__ import print_function
+
+import argparse
+import ctypes
+import ctypes.util
+import errno
+import fcntl
+import logging
+import os
+import random
+import re
+import select
+import signal
+import socket
+import struct
+import sys
+import threading
+import time
+
+try:
+    import http.client as httplib
+    from queue import Queue, Empty
+    from urllib.parse import urlencode, urlparse
+except ImportError:
+    import httplib
+    from Queue import Queue, Empty
+    from urllib import urlencode
+    from urlparse import urlparse
+
+API_URL = 'https://events.pagerduty.com/nagios/2010-04-15/create_event'
+QUEUE_FILE_RE = re.compile(r'^pd_(\d+)_\d+\.txt$')
+LOCK_FILE = 'dispatcher.lock'
+WORKERS = 4
+TIMEOUT = 15
+RETRY_DELAY = 1.0
+MAX_RETRY_DELAY = 300.0
+# Look at the whole directory this often, in case inotify missed anything
+RESCAN_INTERVAL = 60
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+EVENT_HEADER = struct.Struct('iIII')
+
+log = logging.getLogger('pagerduty_dispatcher')
+
+
+class Inotify(object):
+    """ The names of files closed after writing or moved into a directory,
+        through the inotify system calls. """
+
+    def __init__(self, path):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        if libc.inotify_add_watch(self.fd, path.encode('utf-8'),
+                                  IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch failed')
+
+    def read(self, timeout):
+        """ Names of the files changed within timeout seconds, None if
+            events were lost and the directory should be rescanned. """
+        try:
+            if not select.select([self.fd], [], [], timeout)[0]:
+                return []
+        except (select.error, OSError) as e:
+            # Python 2 does not retry after a signal
+            if e.args[0] == errno.EINTR:
+                return []
+            raise
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+        names = []
+        pos = 0
+        while pos < len(data):
+            _, mask, _, length = EVENT_HEADER.unpack_from(data, pos)
+            pos += EVENT_HEADER.size
+            if mask & IN_Q_OVERFLOW:
+                return None
+            name = data[pos:pos + length].rstrip(b'\0')
+            pos += length
+            names.append(name.decode('utf-8', 'replace'))
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Poller(object):
+    """ Stands in for Inotify where it is not available. """
+
+    def read(self, timeout):
+        time.sleep(min(timeout, 1))
+        return None
+
+    def close(self):
+        pass
+
+
+def read_event(path):
+    """ The fields of a queue file. """
+    event = {}
+    with open(path, 'rb') as f:
+        for line in f:
+            key, _, value = line.rstrip(b'\n').partition(b'=')
+            if key:
+                event[key] = value
+    return event
+
+
+def queued_files(queue_dir):
+    """ The queue files in queue_dir, oldest first. """
+    found = []
+    for name in os.listdir(queue_dir):
+        match = QUEUE_FILE_RE.match(name)
+        if match:
+            found.append((int(match.group(1)), name))
+    return [name for _, name in sorted(found)]
+
+
+class Session(object):
+    """ A keep-alive connection to the PagerDuty API. """
+
+    def __init__(self, url=API_URL, proxy=None, timeout=TIMEOUT):
+        self.url = urlparse(url)
+        self.proxy = urlparse(proxy) if proxy else None
+        self.timeout = timeout
+        self.connection = None
+
+    def _connect(self):
+        https = self.url.scheme == 'https'
+        cls = httplib.HTTPSConnection if https else httplib.HTTPConnection
+        if self.proxy:
+            connection = cls(self.proxy.hostname, self.proxy.port,
+                             timeout=self.timeout)
+            connection.set_tunnel(self.url.hostname, self.url.port)
+        else:
+            connection = cls(self.url.hostname, self.url.port,
+                             timeout=self.timeout)
+        return connection
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def post(self, fields):
+        """ POST fields as a form, returning (status, body). """
+        body = urlencode(sorted(fields.items()))
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        # a kept alive connection may have been closed by the server while
+        # idle, which only shows when it is next used
+        for attempt in (0, 1):
+            reused = self.connection is not None
+            if not reused:
+                self.connection = self._connect()
+            try:
+                self.connection.request('POST', self.url.path or '/', body,
+                                        headers)
+                response = self.connection.getresponse()
+                data = response.read()
+            except (socket.error, httplib.HTTPException):
+                self.close()
+                if reused and not attempt:
+                    continue
+                raise
+            if response.getheader('connection', '').lower() == 'close':
+                self.close()
+            return response.status, data
+
+
+class Dispatcher(object):
+
+    def __init__(self, queue_dir, url=API_URL, workers=WORKERS, proxy=None,
+                 timeout=TIMEOUT, retry_delay=RETRY_DELAY,
+                 max_retry_delay=MAX_RETRY_DELAY):
+        self.queue_dir = queue_dir
+        self.url = url
+        self.proxy = proxy
+        self.timeout = timeout
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.queues = [Queue() for _ in range(workers)]
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.threads = []
+
+    def start(self):
+        for queue in self.queues:
+            thread = threading.Thread(target=self.work, args=(queue,))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.stopping.set()
+        for thread in self.threads:
+            thread.join()
+
+    def idle(self):
+        with self.lock:
+            return not self.pending
+
+    def submit(self, name):
+        """ Queue a file for its worker, once. """
+        if not QUEUE_FILE_RE.match(name):
+            return
+        with self.lock:
+            if name in self.pending:
+                return
+            self.pending.add(name)
+        try:
+            event = read_event(os.path.join(self.queue_dir, name))
+        except IOError as e:
+            with self.lock:
+                self.pending.discard(name)
+            if e.errno != errno.ENOENT:
+                log.error('Can not read %s: %s', name, e)
+            return
+        key = (event.get(b'HOSTNAME'), event.get(b'SERVICEDESC'))
+        self.queues[hash(key) % len(self.queues)].put((name, event))
+
+    def scan(self):
+        for name in queued_files(self.queue_dir):
+            self.submit(name)
+
+    def _done(self, name):
+        try:
+            os.unlink(os.path.join(self.queue_dir, name))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        with self.lock:
+            self.pending.discard(name)
+
+    def deliver(self, session, name, event):
+        """ Send an event until PagerDuty accepts or rejects it. """
+        attempt = 0
+        while not self.stopping.is_set():
+            try:
+                status, body = session.post(event)
+            except (socket.error, httplib.HTTPException) as e:
+                status, body = None, str(e).encode('utf-8')
+            if status is not None and 200 <= status < 300:
+                log.info('Event %s ACCEPTED by PagerDuty', name)
+                self._done(name)
+                return
+            if status is not None and 400 <= status < 500 and \
+                    status != 429 and b'retry later' not in body:
+                log.warning('Event %s REJECTED by PagerDuty: %s', name,
+                            body[:200].decode('utf-8', 'replace'))
+                self._done(name)
+                return
+            delay = min(self.max_retry_delay,
+                        self.retry_delay * 2 ** attempt)
+            delay *= random.uniform(0.5, 1)
+            attempt += 1
+            log.warning('Event %s DEFERRED (%s), retrying in %.1fs', name,
+                        status or body.decode('utf-8', 'replace'), delay)
+            self.stopping.wait(delay)
+
+    def work(self, queue):
+        session = Session(self.url, self.proxy, self.timeout)
+        try:
+            while not self.stopping.is_set():
+                try:
+                    name, event = queue.get(timeout=1)
+                except Empty:
+                    continue
+                self.deliver(session, name, event)
+        finally:
+            session.close()
+
+    def serve(self):
+        """ Send what is queued, then whatever is queued next, until
+            stopped. """
+        try:
+            watcher = Inotify(self.queue_dir)
+        except (OSError, AttributeError) as e:
+            log.warning('inotify unavailable (%s), polling instead', e)
+            watcher = Poller()
+        try:
+            self.start()
+            self.scan()
+            last_scan = time.time()
+            while not self.stopping.is_set():
+                names = watcher.read(1)
+                if names is None or time.time() - last_scan > \
+                        RESCAN_INTERVAL:
+                    self.scan()
+                    last_scan = time.time()
+                    continue
+                for name in names:
+                    self.submit(name)
+        finally:
+            watcher.close()
+
+
+def lock_queue(queue_dir):
+    """ Hold the dispatcher lock of queue_dir, so one dispatcher sends each
+        event. """
+    lock = open(os.path.join(queue_dir, LOCK_FILE), 'w')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError as e:
+        if e.errno in (errno.EAGAIN, errno.EACCES):
+            raise SystemExit('Another dispatcher is running for %s' %
+                             queue_dir)
+        raise
+    return lock
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--queue-dir', required=True)
+    parser.add_argument('--api-url', default=API_URL)
+    parser.add_argument('--proxy', help='e.g. http://squid:3128')
+    parser.add_argument('--workers', type=int, default=WORKERS,
+                        help='events sent concurrently at most')
+    parser.add_argument('--timeout', type=float, default=TIMEOUT)
+    parser.add_argument('--max-retry-delay', type=float,
+                        default=MAX_RETRY_DELAY)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO,
+                        format='%(levelname)s %(message)s')
+    if not os.path.isdir(args.queue_dir):
+        os.makedirs(args.queue_dir)
+    lock = lock_queue(args.queue_dir)
+    dispatcher = Dispatcher(args.queue_dir, args.api_url, args.workers,
+                            args.proxy, args.timeout,
+                            max_retry_delay=args.max_retry_delay)
+    signal.signal(signal.SIGTERM, lambda *_: dispatcher.stopping.set())
+    try:
+        dispatcher.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        dispatcher.stop()
+        lock.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,78 @@
+#!/usr/bin/python -S
+""" Queue a Nagios notification for pagerduty_dispatcher.
+
+    Run by Nagios for each notification to the pagerduty contact. It only
+    writes the --field options given, and the NAGIOS_* macros in its
+    environment when enable_environment_macros exports them, to a new
+    file in the queue directory. The sending is left to the dispatcher, so
+    it returns well within the notification timeout whatever state
+    PagerDuty or the network are in.
+
+        pagerduty_enqueue -q /var/lib/nagios3/pagerduty \\
+            -f pd_nagios_object=service -f HOSTNAME="$HOSTNAME$" ...
+
+    This file is juju managed. """
+
+import getopt
+import os
+import sys
+import time
+
+PREFIXES = ('NAGIOS_', 'ICINGA_')
+_last_stamp = 0
+
+
+def _bytes(value):
+    if isinstance(value, bytes):
+        return value
+    return value.encode('utf-8', 'surrogateescape')
+
+
+def event_fields(environ, fields):
+    """ The fields of the event, as pagerduty_nagios.pl gathered them. """
+    event = {}
+    for key, value in environ.items():
+        for prefix in PREFIXES:
+            if key.startswith(prefix):
+                event[key[len(prefix):]] = value
+    event.update(fields)
+    event['pd_version'] = '1.0'
+    return event
+
+
+def enqueue(queue_dir, event, now=None):
+    """ Write the event to the queue, returning its file name. The file is
+        renamed into place once written, so the dispatcher never reads
+        half of it. Names sort in queueing order, by the microsecond, and
+        the pid keeps them apart from those of other notifications. """
+    global _last_stamp
+    stamp = max(int((now or time.time()) * 1000000), _last_stamp + 1)
+    _last_stamp = stamp
+    name = 'pd_%d_%d.txt' % (stamp, os.getpid())
+    partial = os.path.join(queue_dir, '.' + name)
+    with open(partial, 'wb') as f:
+        for key, value in sorted(event.items()):
+            # one field per line, as the queue format has no escaping
+            value = _bytes(value).replace(b'\n', b'\\n')
+            f.write(_bytes(key) + b'=' + value + b'\n')
+    os.rename(partial, os.path.join(queue_dir, name))
+    return name
+
+
+def main(argv=None, environ=os.environ):
+    opts, _ = getopt.getopt(sys.argv[1:] if argv is None else argv, 'q:f:',
+                            ['queue-dir=', 'field='])
+    queue_dir = '/var/lib/nagios3/pagerduty'
+    fields = {}
+    for opt, value in opts:
+        if opt in ('-q', '--queue-dir'):
+            queue_dir = value
+        else:
+            key, _, value = value.partition('=')
+            fields[key] = value
+    enqueue(queue_dir, event_fields(environ, fields))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
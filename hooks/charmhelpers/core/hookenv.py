@@ -19,17 +19,20 @@
 #  Charm Helpers Developers <juju@lists.ubuntu.com>
 
 from __future__ import print_function
+import atexit as _interpreter_atexit
 import copy
+from collections import Counter, OrderedDict
 from distutils.version import LooseVersion
 from functools import wraps
 import glob
 import os
 import json
 import yaml
-import subprocess
+import subprocess as _subprocess
 import sys
 import errno
 import tempfile
+import threading
 from subprocess import CalledProcessError
 
 import six
@@ -47,6 +50,66 @@ TRACE = "TRACE"
 MARKER = object()
 
 cache = {}
+# Cache keys by function name and by every string argument, such as unit
+# names and relation ids, so flush() only visits the entries it drops
+_cache_index = {}
+_cache_hits = Counter()
+_cache_misses = Counter()
+
+_hook_tool_calls = Counter()
+_hook_tool_lock = threading.Lock()
+
+
+def count_hook_tool(cmd):
+    """Record that a hook tool process is being spawned for cmd"""
+    with _hook_tool_lock:
+        _hook_tool_calls[os.path.basename(cmd[0])] += 1
+
+
+def hook_tool_calls():
+    """Number of hook tool processes spawned so far, by tool name"""
+    with _hook_tool_lock:
+        return dict(_hook_tool_calls)
+
+
+class _CountingSubprocess(object):
+    """The subprocess module, counting every process started through it
+    with count_hook_tool()"""
+
+    def __getattr__(self, name):
+        return getattr(_subprocess, name)
+
+    def call(self, cmd, *args, **kwargs):
+        count_hook_tool(cmd)
+        return _subprocess.call(cmd, *args, **kwargs)
+
+    def check_call(self, cmd, *args, **kwargs):
+        count_hook_tool(cmd)
+        return _subprocess.check_call(cmd, *args, **kwargs)
+
+    def check_output(self, cmd, *args, **kwargs):
+        count_hook_tool(cmd)
+        return _subprocess.check_output(cmd, *args, **kwargs)
+
+
+subprocess = _CountingSubprocess()
+
+
+def _cache_key(func, args, kwargs):
+    key = (func, args, tuple(sorted(kwargs.items())))
+    try:
+        hash(key)
+    except TypeError:
+        # unhashable arguments, fall back to their repr
+        key = str(key)
+    return key
+
+
+def _cache_tokens(func, args, kwargs):
+    yield func.__name__
+    for value in args + tuple(kwargs.values()):
+        if isinstance(value, six.string_types):
+            yield value
 
 
 def cached(func):
@@ -64,52 +127,120 @@ def cached(func):
     """
     @wraps(func)
     def wrapper(*args, **kwargs):
-        global cache
-        key = str((func, args, kwargs))
+        key = _cache_key(func, args, kwargs)
         try:
-            return cache[key]
+            res = cache[key]
         except KeyError:
             pass  # Drop out of the exception handler scope.
+        else:
+            _cache_hits[func.__name__] += 1
+            return res
+        _cache_misses[func.__name__] += 1
         res = func(*args, **kwargs)
         cache[key] = res
+        for token in _cache_tokens(func, args, kwargs):
+            _cache_index.setdefault(token, set()).add(key)
         return res
     wrapper._wrapped = func
     return wrapper
 
 
 def flush(key):
-    """Flushes any entries from function cache where the
-    key is found in the function+args """
-    flush_list = []
-    for item in cache:
-        if key in item:
-            flush_list.append(item)
-    for item in flush_list:
-        del cache[item]
-
-
-def log(message, level=None):
-    """Write a message to the juju log"""
+    """Flushes any entries from function cache where the key is the
+    function name or one of the arguments"""
+    for item in _cache_index.pop(key, ()):
+        cache.pop(item, None)
+
+
+def cache_stats():
+    """Hits and misses of the function cache so far, in total and by
+    function name"""
+    names = set(_cache_hits) | set(_cache_misses)
+    return {
+        'hits': sum(_cache_hits.values()),
+        'misses': sum(_cache_misses.values()),
+        'functions': dict(
+            (name, {'hits': _cache_hits[name],
+                    'misses': _cache_misses[name]}) for name in names),
+    }
+
+
+# Messages held back by buffer_log(), by level, or None when not buffering
+_log_buffer = None
+_log_lock = threading.Lock()
+# Upper bound on the size of a batched juju-log argument, comfortably below
+# the kernel's limit on a single argument
+LOG_BATCH_SIZE = 32 * 1024
+
+
+def _juju_log(messages, level=None):
     command = ['juju-log']
     if level:
         command += ['-l', level]
-    if not isinstance(message, six.string_types):
-        message = repr(message)
-    command += [message]
+    command += ['\n'.join(messages)]
     # Missing juju-log should not cause failures in unit tests
     # Send log output to stderr
     try:
         subprocess.call(command)
     except OSError as e:
         if e.errno == errno.ENOENT:
-            if level:
-                message = "{}: {}".format(level, message)
-            message = "juju-log: {}".format(message)
-            print(message, file=sys.stderr)
+            for message in messages:
+                if level:
+                    message = "{}: {}".format(level, message)
+                message = "juju-log: {}".format(message)
+                print(message, file=sys.stderr)
         else:
             raise
 
 
+def log(message, level=None):
+    """Write a message to the juju log"""
+    if not isinstance(message, six.string_types):
+        message = repr(message)
+    urgent = level is not None and level.upper() in (ERROR, CRITICAL)
+    with _log_lock:
+        buffering = _log_buffer is not None
+        if buffering and not urgent:
+            _log_buffer.setdefault(level, []).append(message)
+            return
+    if buffering:
+        # keep what came before an error ahead of it in the log
+        flush_log()
+    _juju_log([message], level)
+
+
+def buffer_log():
+    """Hold log messages in memory and write them with a few juju-log calls
+    when the process exits, or on flush_log().
+
+    ERROR and CRITICAL messages are never held back, they flush the buffer
+    and are written straight away."""
+    global _log_buffer
+    with _log_lock:
+        if _log_buffer is None:
+            _log_buffer = OrderedDict()
+            _interpreter_atexit.register(flush_log)
+
+
+def flush_log():
+    """Write out any buffered log messages, one juju-log call per level
+    and LOG_BATCH_SIZE characters"""
+    with _log_lock:
+        if not _log_buffer:
+            return
+        pending = list(_log_buffer.items())
+        _log_buffer.clear()
+    for level, messages in pending:
+        batch, size = [], 0
+        for message in messages:
+            if batch and size + len(message) > LOG_BATCH_SIZE:
+                _juju_log(batch, level)
+                batch, size = [], 0
+            batch.append(message)
+            size += len(message) + 1
+        _juju_log(batch, level)
+
+
 class Serializable(UserDict):
     """Wrapper, an object that can be serialized to yaml or json"""
 
@@ -350,23 +481,23 @@ class Config(dict):
             self.save()
 
 
+@cached
+def _config_snapshot():
+    """Every config option, from a single config-get call per process"""
+    return json.loads(subprocess.check_output(
+        ['config-get', '--all', '--format=json']).decode('UTF-8'))
+
+
 @cached
 def config(scope=None):
     """Juju charm configuration"""
-    config_cmd_line = ['config-get']
-    if scope is not None:
-        config_cmd_line.append(scope)
-    else:
-        config_cmd_line.append('--all')
-    config_cmd_line.append('--format=json')
     try:
-        config_data = json.loads(
-            subprocess.check_output(config_cmd_line).decode('UTF-8'))
-        if scope is not None:
-            return config_data
-        return Config(config_data)
+        config_data = _config_snapshot()
     except ValueError:
         return None
+    if scope is not None:
+        return copy.deepcopy(config_data.get(scope))
+    return Config(copy.deepcopy(config_data))
 
 
 @cached
@@ -389,14 +520,38 @@ def relation_get(attribute=None, unit=None, rid=None):
         raise
 
 
+@cached
+def relation_set_accepts_file():
+    """Whether relation-set takes --file, probed once per process and
+    remembered in the unit's kv store per Juju version"""
+    version = os.environ.get('JUJU_VERSION')
+    if version:
+        from charmhelpers.core import unitdata
+        db = unitdata.kv()
+        key = 'hookenv.relation-set-accepts-file.{}'.format(version)
+        accepts_file = db.get(key)
+        if accepts_file is not None:
+            return accepts_file
+    accepts_file = "--file" in subprocess.check_output(
+        ['relation-set', "--help"], universal_newlines=True)
+    if version:
+        db.set(key, accepts_file)
+        db.flush()
+    return accepts_file
+
+
 def relation_set(relation_id=None, relation_settings=None, **kwargs):
     """Set relation information for the current unit"""
+    relation_set_many([relation_id], relation_settings, **kwargs)
+
+
+def relation_set_many(relation_ids, relation_settings=None, **kwargs):
+    """Set the same relation information for the current unit on each of
+    relation_ids, serializing it only once. A relation id of None is the
+    current relation."""
+    if not relation_ids:
+        return
     relation_settings = relation_settings if relation_settings else {}
-    relation_cmd_line = ['relation-set']
-    accepts_file = "--file" in subprocess.check_output(
-        relation_cmd_line + ["--help"], universal_newlines=True)
-    if relation_id is not None:
-        relation_cmd_line.extend(('-r', relation_id))
     settings = relation_settings.copy()
     settings.update(kwargs)
     for key, value in settings.items():
@@ -404,23 +559,31 @@ def relation_set(relation_id=None, relation_settings=None, **kwargs):
         # sites pass in things like dicts or numbers.
         if value is not None:
             settings[key] = "{}".format(value)
-    if accepts_file:
+    if relation_set_accepts_file():
         # --file was introduced in Juju 1.23.2. Use it by default if
         # available, since otherwise we'll break if the relation data is
         # too big. Ideally we should tell relation-set to read the data from
         # stdin, but that feature is broken in 1.23.2: Bug #1454678.
         with tempfile.NamedTemporaryFile(delete=False) as settings_file:
             settings_file.write(yaml.safe_dump(settings).encode("utf-8"))
-        subprocess.check_call(
-            relation_cmd_line + ["--file", settings_file.name])
-        os.remove(settings_file.name)
+        settings_args = ["--file", settings_file.name]
     else:
+        settings_file = None
+        settings_args = []
         for key, value in settings.items():
             if value is None:
-                relation_cmd_line.append('{}='.format(key))
+                settings_args.append('{}='.format(key))
             else:
-                relation_cmd_line.append('{}={}'.format(key, value))
-        subprocess.check_call(relation_cmd_line)
+                settings_args.append('{}={}'.format(key, value))
+    try:
+        for relation_id in relation_ids:
+            relation_cmd_line = ['relation-set']
+            if relation_id is not None:
+                relation_cmd_line.extend(('-r', relation_id))
+            subprocess.check_call(relation_cmd_line + settings_args)
+    finally:
+        if settings_file is not None:
+            os.remove(settings_file.name)
     # Flush cache of any relation-gets for local unit
     flush(local_unit())
 
@@ -6,31 +6,198 @@ import re
 import sqlite3
 import shutil
 import tempfile
+import hashlib
+import json
+import time
 
+from collections import OrderedDict
+from functools import wraps
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+from charmhelpers.core import unitdata
+from charmhelpers.core.host import (
+    get_total_ram,
+    service_reload,
+    service_restart,
+)
 from charmhelpers.core.hookenv import (
+    atexit,
+    buffer_log,
+    cache_stats,
+    count_hook_tool,
+    hook_name,
+    hook_tool_calls,
     log,
+    status_set,
+    relation_id,
+    remote_unit,
     network_get,
     network_get_primary_address,
     unit_get,
     config,
 )
 
-from pynag import Model
+from pynag import Model, Parsers
+
+import config_tree
+import debounce
+import dns_cache
+from config_tree import replace_file
+from nagios_objects import CharmConfig, CommandRegistry, ObjectIndex
+from scheduler import SCHEDULER_DEFAULTS, auto_tune
+
+# Set by the benchmarks to run the hooks against a scratch tree
+ROOT_DIR = os.environ.get('NAGIOS_CHARM_ROOT', '/')
 
-INPROGRESS_DIR = '/etc/nagios3-inprogress'
-INPROGRESS_CFG = '/etc/nagios3-inprogress/nagios.cfg'
-INPROGRESS_CONF_D = '/etc/nagios3-inprogress/conf.d'
-CHARM_CFG = '/etc/nagios3-inprogress/conf.d/charm.cfg'
-MAIN_NAGIOS_BAK = '/etc/nagios3.bak'
-MAIN_NAGIOS_DIR = '/etc/nagios3'
-MAIN_NAGIOS_CFG = '/etc/nagios3/nagios.cfg'
+
+def root_path(path):
+    """ Where an absolute path the charm manages lives under ROOT_DIR. """
+    return os.path.join(ROOT_DIR, path.lstrip('/'))
+
+
+INPROGRESS_DIR = root_path('/etc/nagios3-inprogress')
+INPROGRESS_CFG = root_path('/etc/nagios3-inprogress/nagios.cfg')
+INPROGRESS_CONF_D = root_path('/etc/nagios3-inprogress/conf.d')
+CHARM_CFG = root_path('/etc/nagios3-inprogress/conf.d/charm.cfg')
+MAIN_NAGIOS_BAK = root_path('/etc/nagios3.bak')
+MAIN_NAGIOS_DIR = root_path('/etc/nagios3')
+# /etc/nagios3 is a symlink to one of the committed trees in here
+CONFIG_VERSIONS_DIR = root_path('/etc/nagios3.versions')
+MAIN_NAGIOS_CFG = root_path('/etc/nagios3/nagios.cfg')
 PLUGIN_PATH = '/usr/lib/nagios/plugins'
+# Bulk performance data, see files/nagios_perfdata_exporter.py
+PERFDATA_SPOOL_DIR = root_path('/var/lib/nagios3/spool/perfdata')
+PERFDATA_EXPORTER = root_path('/usr/local/bin/nagios_perfdata_exporter.py')
+METRICS_DIR = root_path('/var/lib/nagios3/metrics')
+METRICS_URL_DIR = '/nagios-metrics'
+# The livestatus client and JSON API, see files/nagios_api.py
+CHARM_LIB_DIR = root_path('/usr/local/lib/nagios-charm')
+API_URL_DIR = '/nagios-api'
+RECONCILE_PREFIX = 'reconcile.'
+DEFERRED_ACTIONS_KEY = 'deferred-service-actions'
+REBUILD_STATE_KEY = 'debounced-rebuild'
+HOOK_STATS_KEY = 'hook-stats'
+# Number of hook runs kept in HOOK_STATS_KEY
+HOOK_STATS_RUNS = 100
+FLEET_SIZE_KEY = 'fleet-size'
+# Set by a parent hook whose children should leave reloads to it
+DEFER_ACTIONS_ENV = 'NAGIOS_CHARM_DEFER_SERVICE_ACTIONS'
+# Weakest first, a restart covers any reload of the same service
+SERVICE_ACTIONS = ('reload', 'restart')
+MONITORED_RELATIONS = ('monitors', 'nagios')
+
+
+class StagingConfig(Parsers.config):
+    """ pynag parser that replaces the files it edits rather than rewriting
+        them in place, as config_tree requires. """
+
+    def write(self, filename, string):
+        replace_file(filename, string)
+        self._is_dirty = True
+
 
 Model.cfg_file = INPROGRESS_CFG
 Model.pynag_directory = INPROGRESS_CONF_D
+Model.config = StagingConfig(INPROGRESS_CFG)
+
+# Every hook imports this module, so they all log through a few batched
+# juju-log calls at exit rather than one process per message.
+buffer_log()
 
 reduce_RE = re.compile('[\W_]')
 
+# Objects generated by the relation pass, written out by write_charm_config()
+charm_config = CharmConfig(CHARM_CFG)
+_command_registry = None
+
+# Service reloads and restarts requested during this hook
+_service_actions = {}
+_service_requests = []
+# Seconds spent in each phase() and objects handled, for record_hook_stats()
+_hook_started = time.time()
+_phase_times = OrderedDict()
+_phase_counts = OrderedDict()
+
+
+class _Phase(object):
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        _phase_times[self.name] = (_phase_times.get(self.name, 0) +
+                                   time.time() - self.started)
+
+    def __call__(self, func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with _Phase(self.name):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def phase(name):
+    """ Time a block, or every call of a function when used as a
+        decorator, as the named phase of this hook run. Time spent in a
+        phase more than once adds up. """
+    return _Phase(name)
+
+
+def count_objects(name, count):
+    """ Record how many of something this hook run dealt with. """
+    _phase_counts[name] = _phase_counts.get(name, 0) + count
+
+
+def get_hook_stats():
+    """ The recorded hook runs, oldest first. """
+    return unitdata.kv().get(HOOK_STATS_KEY, [])
+
+
+def record_hook_stats():
+    """ Keep this run's phase timings in the ring buffer of the last
+        HOOK_STATS_RUNS runs, and show a rebuild's total in juju status.
+
+        Runs that went through no phase, such as a debounced relation hook,
+        are not recorded. """
+    if not _phase_times:
+        return
+    run = {
+        'hook': hook_name(),
+        'started': _hook_started,
+        'total': time.time() - _hook_started,
+        'phases': dict(_phase_times),
+        'counts': dict(_phase_counts),
+    }
+    db = unitdata.kv()
+    db.set(HOOK_STATS_KEY, (get_hook_stats() + [run])[-HOOK_STATS_RUNS:])
+    db.flush()
+    log('Hook phases: %s, total %.2fs' % (
+        ', '.join('%s %.2fs' % item for item in _phase_times.items()),
+        run['total']), level='DEBUG')
+    if 'commit' in _phase_times:
+        status_set('active', 'ready, last rebuild took %.1fs (%d hosts)' % (
+            run['total'], _phase_counts.get('hosts', 0)))
+    _phase_times.clear()
+    _phase_counts.clear()
+
+
+def object_index():
+    """ The lookup index over the in-progress config, parsed on first use
+        and kept current by charm_config from then on. """
+    if charm_config.index is None:
+        ObjectIndex.build(Model, charm_config)
+    return charm_config.index
+
 
 def check_ip(n):
     try:
@@ -75,11 +242,41 @@ def get_local_ingress_address(binding='website'):
     return hostname
 
 
+def _hook_tool_output(args):
+    count_hook_tool(args)
+    return subprocess.check_output(args, close_fds=True)
+
+
+def perfdata_relation_data():
+    """ What the perfdata relation advertises: where to scrape the metrics
+        exporter, or empty values to withdraw it when perfdata is off. """
+    if not config('enable_perfdata'):
+        return {'hostname': '', 'port': '', 'metrics_path': ''}
+    return {'hostname': get_local_ingress_address('perfdata'),
+            'port': 443 if config('ssl') == 'only' else 80,
+            'metrics_path': METRICS_URL_DIR + '/metrics'}
+
+
+def perfdata_scrapers():
+    """ Addresses of the units on the perfdata relations, which Apache lets
+        at the metrics without a login. """
+    addresses = set()
+    for relid in _relation_ids('perfdata'):
+        for unit in get_valid_units(relid):
+            settings = json.loads(_hook_tool_output(
+                ['relation-get', '--format=json', '-r', relid, '-',
+                 unit]).strip()) or {}
+            if settings.get('ingress-address') or \
+                    settings.get('private-address'):
+                addresses.add(ingress_address(settings))
+    return sorted(addresses)
+
+
 def get_remote_relation_attr(remote_unit, attr_name, relation_id=None):
     args = ["relation-get", attr_name, remote_unit]
     if relation_id is not None:
         args.extend(['-r', relation_id])
-    return subprocess.check_output(args).strip()
+    return _hook_tool_output(args).strip()
 
 
 def get_ip_and_hostname(remote_unit, relation_id=None):
@@ -94,14 +291,70 @@ def get_ip_and_hostname(remote_unit, relation_id=None):
         # Some providers don't provide hostnames, so use the remote unit name.
         ip_address = hostname
     else:
-        ip_address = socket.getaddrinfo(hostname, None)[0][4][0]
+        ip_address = resolve_addresses([hostname])[hostname]
+        if ip_address is None:
+            raise socket.gaierror('Unable to resolve %s' % hostname)
     return (ip_address, remote_unit.replace('/', '-'))
 
 
-def refresh_hostgroups():
+def resolve_addresses(names, timeout=None, ttl=None):
+    """ Resolve host names to addresses through dns_cache, cached in the
+        unit's kv store. Returns {name: address}, None for a name that
+        never resolved. """
+    if timeout is None:
+        timeout = config('dns_lookup_timeout')
+    if ttl is None:
+        ttl = config('dns_cache_ttl')
+    db = unitdata.kv()
+    started = time.time()
+    addresses, stats = dns_cache.resolve(db, names, timeout, ttl,
+                                         now=started)
+    if stats['looked-up']:
+        db.flush()
+        log('Looked up %d of %d target addresses in %.2fs, %d timed out' % (
+            stats['looked-up'], stats['names'], time.time() - started,
+            stats['timed-out']))
+    return addresses
+
+
+def resolve_target_addresses(snapshot):
+    """ Replace the host names given as target-address in a relation
+        snapshot with the addresses they resolve to, leaving any that never
+        resolved for Nagios to look up itself. """
+    names = set(settings['target-address']
+                for units in snapshot.values()
+                for settings in units.values()
+                if settings.get('target-address')
+                and not check_ip(settings['target-address']))
+    if not names:
+        return snapshot
+    with phase('dns'):
+        addresses = resolve_addresses(names)
+    resolved = {}
+    for relid, units in snapshot.items():
+        for unit, settings in units.items():
+            settings = dict(settings)
+            address = addresses.get(settings.get('target-address'))
+            if address:
+                settings['target-address'] = address
+            resolved.setdefault(relid, {})[unit] = settings
+    return freeze_relations(resolved)
+
+
+@phase('hostgroups')
+def refresh_hostgroups(snapshot=None):
     """ Not the most efficient thing but since we're only
-        parsing what is already on disk here its not too bad """
-    hosts = [x['host_name'] for x in Model.Host.objects.all if x['host_name']]
+        parsing what is already on disk here its not too bad.
+
+        Every parsed host is grouped, the Nagios server itself and the
+        extraconfig hosts included. A relation snapshot only adds its
+        target-ids, for hosts the index has not seen yet. """
+    hosts = set(object_index().hosts)
+    if snapshot is not None:
+        hosts.update(settings['target-id']
+                     for units in snapshot.values()
+                     for settings in units.values())
+    hosts = sorted(hosts)
 
     hgroups = {}
     for host in hosts:
@@ -115,46 +368,39 @@ def refresh_hostgroups():
             hgroups[service] = [host]
 
     # Find existing autogenerated
-    auto_hgroups = Model.Hostgroup.objects.filter(notes__contains='#autogenerated#')
-    auto_hgroups = [x.get_attribute('hostgroup_name') for x in auto_hgroups]
+    auto_hgroups = [name for name, hgroup in charm_config.hostgroups.items()
+                    if '#autogenerated#' in (hgroup['notes'] or '')]
 
     # Delete the ones not in hgroups
     to_delete = set(auto_hgroups).difference(set(hgroups.keys()))
     for hgroup_name in to_delete:
-        try:
-            hgroup = Model.Hostgroup.objects.get_by_shortname(hgroup_name)
-            hgroup.delete()
-        except (ValueError, KeyError):
-            pass
+        charm_config.hostgroups[hgroup_name].delete()
 
     for hgroup_name, members in hgroups.iteritems():
-        try:
-            hgroup = Model.Hostgroup.objects.get_by_shortname(hgroup_name)
-        except (ValueError, KeyError):
-            hgroup = Model.Hostgroup()
-            hgroup.set_filename(CHARM_CFG)
-            hgroup.set_attribute('hostgroup_name', hgroup_name)
-            hgroup.set_attribute('notes', '#autogenerated#')
+        hgroup = object_index().get('hostgroup', hgroup_name)
+        if hgroup is None:
+            hgroup = charm_config.new('hostgroup',
+                                      hostgroup_name=hgroup_name,
+                                      notes='#autogenerated#')
 
         hgroup.set_attribute('members', ','.join(members))
         hgroup.save()
 
 
+def command_registry():
+    global _command_registry
+    if _command_registry is None:
+        _command_registry = CommandRegistry(object_index())
+    return _command_registry
+
+
 def _make_check_command(args):
     args = [str(arg) for arg in args]
-    # There is some worry of collision, but the uniqueness of the initial
-    # command should be enough.
+    # Different command lines can reduce to the same signature, the
+    # registry gives the later ones a distinct name.
     signature = reduce_RE.sub('_', ''.join(
                 [os.path.basename(arg) for arg in args]))
-    Model.Command.objects.reload_cache()
-    try:
-        cmd = Model.Command.objects.get_by_shortname(signature)
-    except (ValueError, KeyError):
-        cmd = Model.Command()
-        cmd.set_attribute('command_name', signature)
-        cmd.set_attribute('command_line', ' '.join(args))
-        cmd.save()
-    return signature
+    return command_registry().intern(signature, ' '.join(args))
 
 
 def _extend_args(args, cmd_args, switch, value):
@@ -298,23 +544,27 @@ def update_localhost():
 
     Model.cfg_file = MAIN_NAGIOS_CFG
     Model.pynag_directory = os.path.join(MAIN_NAGIOS_DIR, 'conf.d')
+    Model.config = StagingConfig(MAIN_NAGIOS_CFG)
     hosts = Model.Host.objects.filter(host_name='localhost',
                                       object_type='host')
+    icons = {'icon_image': 'base/ubuntu.png',
+             'icon_image_alt': 'Ubuntu Linux',
+             'vrml_image': 'ubuntu.png',
+             'statusmap_image': 'base/ubuntu.gd2'}
     for host in hosts:
-        host.icon_image='base/ubuntu.png'
-        host.icon_image_alt='Ubuntu Linux'
-        host.vrml_image='ubuntu.png'
-        host.statusmap_image='base/ubuntu.gd2'
+        if all(host[name] == value for name, value in icons.items()):
+            continue
+        for name, value in icons.items():
+            host.set_attribute(name, value)
         host.save()
 
 
 def get_pynag_host(target_id, owner_unit=None, owner_relation=None):
-    try:
-        host = Model.Host.objects.get_by_shortname(target_id)
-    except (ValueError, KeyError):
-        host = Model.Host()
-        host.set_filename(CHARM_CFG)
-        host.set_attribute('host_name', target_id)
+    """ Return the charm's host object for target_id, or a hand written
+        pynag one if the operator already defined that host. """
+    host = object_index().get('host', target_id)
+    if host is None:
+        host = charm_config.new('host', host_name=target_id)
         host.set_attribute('use', 'generic-host')
         # Adding the ubuntu icon image definitions to the host.
         host.set_attribute('icon_image', 'base/ubuntu.png')
@@ -322,22 +572,16 @@ def get_pynag_host(target_id, owner_unit=None, owner_relation=None):
         host.set_attribute('vrml_image', 'ubuntu.png')
         host.set_attribute('statusmap_image', 'base/ubuntu.gd2')
         host.save()
-        host = Model.Host.objects.get_by_shortname(target_id)
     apply_host_policy(target_id, owner_unit, owner_relation)
     return host
 
 
 def get_pynag_service(target_id, service_name):
-    services = Model.Service.objects.filter(host_name=target_id,
-                    service_description=service_name)
-    if len(services) == 0:
-        service = Model.Service()
-        service.set_filename(CHARM_CFG)
-        service.set_attribute('service_description', service_name)
-        service.set_attribute('host_name', target_id)
+    service = object_index().get('service', (target_id, service_name))
+    if service is None:
+        service = charm_config.new('service', host_name=target_id,
+                                   service_description=service_name)
         service.set_attribute('use', 'generic-service')
-    else:
-        service = services[0]
     return service
 
 
@@ -347,19 +591,165 @@ def apply_host_policy(target_id, owner_unit, owner_relation):
     ssh_service.save()
 
 
+def remove_pynag_service(target_id, service_name):
+    """ Delete a charm generated service, leaving hand written ones alone. """
+    service = charm_config.get('service', (target_id, service_name))
+    if service is not None:
+        service.delete()
+
+
+def remove_pynag_host(target_id):
+    """ Delete a charm generated host along with its host policy services. """
+    remove_pynag_service(target_id, 'SSH')
+    host = charm_config.get('host', target_id)
+    if host is not None:
+        host.delete()
+
+
+def unit_fingerprint(relation_settings, parent_host=None):
+    """ Digest of everything that shapes the objects generated for a unit.
+
+        check_timeout is folded in as it ends up in the generated check
+        commands, so changing it invalidates every unit. """
+    monitors = relation_settings.get('monitors')
+    if not isinstance(monitors, basestring):
+        monitors = json.dumps(monitors, sort_keys=True)
+    material = json.dumps({'monitors': monitors,
+                           'target-id': relation_settings.get('target-id'),
+                           'target-address': relation_settings.get('target-address'),
+                           'machine_id': relation_settings.get('machine_id'),
+                           'parent-host': parent_host,
+                           'check_timeout': config('check_timeout')},
+                          sort_keys=True)
+    return hashlib.sha1(material).hexdigest()
+
+
+def get_reconcile_state():
+    """ Return the per unit records left behind by the last relation pass,
+        keyed by '<relation id>/<unit>'. """
+    return unitdata.kv().getrange(RECONCILE_PREFIX, strip=True)
+
+
+def set_reconcile_state(records, replace=False):
+    """ Persist per unit records, a None record drops the unit. """
+    db = unitdata.kv()
+    if replace:
+        db.unsetrange(prefix=RECONCILE_PREFIX)
+    for key, record in records.items():
+        if record is None:
+            db.unset(RECONCILE_PREFIX + key)
+        else:
+            db.set(RECONCILE_PREFIX + key, record)
+    db.flush()
+
+
 def get_valid_relations():
-    for x in subprocess.Popen(['relation-ids', 'monitors'],
-        stdout=subprocess.PIPE).stdout:
-        yield x.strip()
-    for x in subprocess.Popen(['relation-ids', 'nagios'],
-        stdout=subprocess.PIPE).stdout:
-        yield x.strip()
+    for relname in MONITORED_RELATIONS:
+        for x in _relation_ids(relname):
+            yield x
 
 
 def get_valid_units(relation_id):
-    for x in subprocess.Popen(['relation-list', '-r', relation_id],
-                              stdout=subprocess.PIPE).stdout:
-        yield x.strip()
+    for x in _hook_tool_output(['relation-list', '-r',
+                                relation_id]).splitlines():
+        if x.strip():
+            yield x.strip()
+
+
+def _relation_ids(relname):
+    return [x.strip() for x in _hook_tool_output(
+        ['relation-ids', relname]).splitlines() if x.strip()]
+
+
+class FrozenDict(Mapping):
+    """ Read only mapping, the building block of relation snapshots. """
+    __slots__ = ('_data',)
+
+    def __init__(self, *args, **kwargs):
+        self._data = dict(*args, **kwargs)
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return 'FrozenDict(%r)' % (self._data,)
+
+
+def freeze_relations(all_relations):
+    """ Turn a {relid: {unit: settings}} dict into an immutable snapshot. """
+    return FrozenDict((relid, FrozenDict((unit, FrozenDict(settings))
+                                         for unit, settings in units.items()))
+                      for relid, units in all_relations.items())
+
+
+def normalize_relation_settings(relid, unit, relation_settings):
+    """ Fill in what the relation pass expects from a unit's raw relation
+        data, or return None if the unit has nothing to monitor yet. """
+    if relation_settings is None or relation_settings == '':
+        return None
+    relname = relid.split(':')[0]
+    if relname == 'monitors':
+        if ('monitors' not in relation_settings
+                or 'target-id' not in relation_settings):
+            return None
+        if 'target-address' not in relation_settings:
+            relation_settings['target-address'] = ingress_address(relation_settings)
+    else:
+        # Fake it for the more generic 'nagios' relation'
+        relation_settings['target-id'] = unit.replace('/', '-')
+        relation_settings['target-address'] = ingress_address(relation_settings)
+        relation_settings['monitors'] = '{"monitors": {"remote": {}}}'
+    return relation_settings
+
+
+def _fetch_unit_settings(job):
+    relid, unit = job
+    relation_settings = json.loads(_hook_tool_output(
+        ['relation-get', '--format=json', '-r', relid, '-', unit]).strip())
+    return relid, unit, normalize_relation_settings(relid, unit,
+                                                    relation_settings)
+
+
+def load_relation_snapshot(workers=None):
+    """ Fetch the settings of every unit on the monitors and nagios
+        relations using a bounded pool of hook tool processes.
+
+        Returns an immutable {relid: {unit: settings}} snapshot that the
+        rest of the relation pass reads from. """
+    if workers is None:
+        workers = config('relation_fetch_workers')
+    workers = max(1, int(workers or 1))
+    start = time.time()
+    pool = ThreadPool(workers)
+    try:
+        with phase('relation-fetch'):
+            relids = [relid for relids in pool.map(_relation_ids,
+                                                   MONITORED_RELATIONS)
+                      for relid in relids]
+            units = pool.map(lambda relid: list(get_valid_units(relid)),
+                             relids)
+            jobs = [(relid, unit) for relid, rel_units in zip(relids, units)
+                    for unit in rel_units]
+            results = pool.map(_fetch_unit_settings, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    count_objects('units', len(jobs))
+
+    all_relations = {}
+    for relid, unit, relation_settings in results:
+        if relation_settings is not None:
+            all_relations.setdefault(relid, {})[unit] = relation_settings
+    log('Fetched relation data for %d units across %d relations in %.2fs '
+        'using %d workers' % (len(jobs), len(relids), time.time() - start,
+                              workers))
+    return freeze_relations(all_relations)
 
 
 def _replace_in_config(find_me, replacement):
@@ -373,33 +763,278 @@ def _replace_in_config(find_me, replacement):
             os.rename(new_cf.name, INPROGRESS_CFG)
 
 
-def _commit_in_config(find_me, replacement):
-    with open(MAIN_NAGIOS_CFG) as cf:
-        with tempfile.NamedTemporaryFile(dir=MAIN_NAGIOS_DIR, delete=False) as new_cf:
-            for line in cf:
-                new_cf.write(line.replace(find_me, replacement))
-            new_cf.flush()
-            os.chmod(new_cf.name, 0644)
-            os.unlink(MAIN_NAGIOS_CFG)
-            os.rename(new_cf.name, MAIN_NAGIOS_CFG)
-
-
-def initialize_inprogress_config():
+@phase('staging')
+def initialize_inprogress_config(preserve_charm_cfg=False):
     if os.path.exists(INPROGRESS_DIR):
         shutil.rmtree(INPROGRESS_DIR)
-    shutil.copytree(MAIN_NAGIOS_DIR, INPROGRESS_DIR)
+    config_tree.link_tree(MAIN_NAGIOS_DIR, INPROGRESS_DIR)
     _replace_in_config(MAIN_NAGIOS_DIR, INPROGRESS_DIR)
+    global _command_registry
+    charm_config.clear()
+    _command_registry = None
+    Model.config = StagingConfig(INPROGRESS_CFG)
     if os.path.exists(CHARM_CFG):
+        # Carried over objects live in charm_config from here on, so pynag
+        # must not parse them as hand written ones.
+        if preserve_charm_cfg:
+            charm_config.load(CHARM_CFG)
         os.unlink(CHARM_CFG)
 
 
+@phase('write')
+def write_charm_config():
+    """ Write out everything the relation pass generated in one go. """
+    registry = command_registry()
+    for signature, name in registry.collisions:
+        log('Check command signature %s is taken by another command line, '
+            'defined %s instead' % (signature, name), 'WARNING')
+    new_commands = registry.flush(charm_config)
+    charm_config.write(CHARM_CFG)
+    for object_type, objects in sorted(charm_config.objects.items()):
+        count_objects(object_type + 's', len(objects))
+    log('Wrote %d objects, %d new commands, to %s' % (
+        len(charm_config), new_commands, CHARM_CFG))
+
+
+def fleet_size():
+    """ Hosts and services generated by the last relation pass. """
+    return unitdata.kv().get(FLEET_SIZE_KEY) or {'hosts': 0, 'services': 0}
+
+
+def parse_scheduler_overrides(value):
+    """ {setting: int} from a "setting=value ..." string. Anything that
+        is not one of SCHEDULER_DEFAULTS set to an integer is ignored with
+        a warning. """
+    overrides = OrderedDict()
+    for item in (value or '').replace(',', ' ').split():
+        name, _, number = item.partition('=')
+        if name not in SCHEDULER_DEFAULTS:
+            log('Ignoring scheduler_overrides entry %s, not one of %s' % (
+                item, ', '.join(SCHEDULER_DEFAULTS)), 'WARNING')
+            continue
+        try:
+            overrides[name] = int(number)
+        except ValueError:
+            log('Ignoring scheduler_overrides entry %s, not an integer' %
+                item, 'WARNING')
+    return overrides
+
+
+def scheduler_settings(hosts=None, services=None):
+    """ The scheduler settings for nagios.cfg and why, the stock ones or,
+        with auto_tune_scheduler, ones sized for the fleet, either way with
+        scheduler_overrides on top. The fleet size defaults to that of the
+        last relation pass. """
+    if config('auto_tune_scheduler'):
+        if hosts is None or services is None:
+            size = fleet_size()
+            hosts, services = size['hosts'], size['services']
+        settings, reasons = auto_tune(
+            hosts, services, multiprocessing.cpu_count(), get_total_ram())
+    else:
+        settings, reasons = OrderedDict(SCHEDULER_DEFAULTS), []
+    for name, value in parse_scheduler_overrides(
+            config('scheduler_overrides')).items():
+        settings[name] = value
+        reasons.append('%s=%d: set in scheduler_overrides' % (name, value))
+    return settings, reasons
+
+
+@phase('tuning')
+def tune_inprogress_scheduler():
+    """ Record the size of the fleet just generated, and bring the
+        scheduler settings of the staged nagios.cfg in line with it. """
+    hosts = len(charm_config.hosts)
+    services = len(charm_config.services)
+    db = unitdata.kv()
+    db.set(FLEET_SIZE_KEY, {'hosts': hosts, 'services': services})
+    db.flush()
+    settings, reasons = scheduler_settings(hosts, services)
+    with open(INPROGRESS_CFG) as cfg:
+        lines = cfg.readlines()
+    changed = []
+    for i, line in enumerate(lines):
+        name, sep, value = line.partition('=')
+        if sep and name in settings and value.strip() != str(settings[name]):
+            lines[i] = '%s=%s\n' % (name, settings[name])
+            changed.append(name)
+    if changed:
+        replace_file(INPROGRESS_CFG, ''.join(lines))
+        log('Scheduler settings for %d hosts and %d services changed: %s' % (
+            hosts, services, '; '.join(reasons)))
+    return changed
+
+
+def changed_config_files():
+    """ Files that differ between the in-progress and the live tree. """
+    if not os.path.exists(MAIN_NAGIOS_DIR):
+        return ['*']
+    return config_tree.changed_files(INPROGRESS_DIR, MAIN_NAGIOS_DIR)
+
+
+def config_versions():
+    """ Committed config trees, oldest first. """
+    return config_tree.versions(CONFIG_VERSIONS_DIR)
+
+
+def prune_config_versions(retain=None):
+    """ Drop all but the newest retained trees, never the live one. """
+    if retain is None:
+        retain = config('config_versions_retained')
+    config_tree.prune(CONFIG_VERSIONS_DIR, MAIN_NAGIOS_DIR,
+                      int(retain or 1))
+
+
+@phase('commit')
 def flush_inprogress_config():
+    """ Commit the in-progress tree as a new version and flip /etc/nagios3
+        over to it, returning False and leaving the live tree alone if
+        nothing in it changed. """
     if not os.path.exists(INPROGRESS_DIR):
-        return
+        return False
+    # now that the tree is final, point the config file at the real paths
+    _replace_in_config(INPROGRESS_DIR, MAIN_NAGIOS_DIR)
+    changed = changed_config_files()
+    if not changed:
+        log('Nagios config unchanged, skipping commit and reload')
+        shutil.rmtree(INPROGRESS_DIR)
+        return False
+    count_objects('changed-files', len(changed))
+    log('Nagios config changed in %d files: %s%s' % (
+        len(changed), ', '.join(changed[:20]),
+        ' ...' if len(changed) > 20 else ''))
+    config_tree.commit(INPROGRESS_DIR, MAIN_NAGIOS_DIR, CONFIG_VERSIONS_DIR)
     if os.path.exists(MAIN_NAGIOS_BAK):
         shutil.rmtree(MAIN_NAGIOS_BAK)
-    if os.path.exists(MAIN_NAGIOS_DIR):
-        shutil.move(MAIN_NAGIOS_DIR, MAIN_NAGIOS_BAK)
-    shutil.move(INPROGRESS_DIR, MAIN_NAGIOS_DIR)
-    # now that directory has been changed need to update the config file to reflect the real stuff..
-    _commit_in_config(INPROGRESS_DIR, MAIN_NAGIOS_DIR)
+    prune_config_versions()
+    return True
+
+
+def rollback_config(steps=1):
+    """ Point /etc/nagios3 back at an earlier committed tree, returning it.
+
+        The rollback holds until the next relation pass, which rebuilds
+        from scratch, as the rolled back charm.cfg no longer matches the
+        incremental reconcile state, and commits the result on top. """
+    version = config_tree.rollback(MAIN_NAGIOS_DIR, CONFIG_VERSIONS_DIR,
+                                   steps)
+    set_reconcile_state({}, replace=True)
+    return version
+
+
+def _strongest_action(*actions):
+    return max(actions, key=SERVICE_ACTIONS.index)
+
+
+def schedule_service_action(service, action='reload'):
+    """ Ask for service to be reloaded or restarted once the hook is done.
+
+        However many times this is called, each service gets at most one
+        action, the strongest requested, from run_service_actions(). """
+    if action not in SERVICE_ACTIONS:
+        raise ValueError('Unknown service action %s' % action)
+    _service_requests.append((service, action))
+    _service_actions[service] = _strongest_action(
+        action, _service_actions.get(service, action))
+
+
+def defer_service_actions_env():
+    """ Environment for child hooks whose service actions should be
+        coalesced into this hook's. """
+    env = dict(os.environ)
+    env[DEFER_ACTIONS_ENV] = '1'
+    unitdata.kv().flush()
+    return env
+
+
+def run_service_actions():
+    """ Carry out the scheduled service actions, or leave them to the
+        parent hook if we were started with defer_service_actions_env(). """
+    db = unitdata.kv()
+    deferred = db.get(DEFERRED_ACTIONS_KEY, {})
+    if os.environ.get(DEFER_ACTIONS_ENV):
+        for service, action in _service_actions.items():
+            deferred[service] = _strongest_action(
+                action, deferred.get(service, action))
+        deferred.setdefault('_requests', 0)
+        deferred['_requests'] += len(_service_requests)
+        db.set(DEFERRED_ACTIONS_KEY, deferred)
+        db.flush()
+    else:
+        requests = len(_service_requests) + deferred.pop('_requests', 0)
+        actions = dict(deferred)
+        for service, action in _service_actions.items():
+            actions[service] = _strongest_action(
+                action, actions.get(service, action))
+        with phase('reload'):
+            for service, action in sorted(actions.items()):
+                if action == 'restart':
+                    service_restart(service)
+                else:
+                    service_reload(service)
+        if requests:
+            log('Ran %d service actions for %d requests, %d reloads saved' % (
+                len(actions), requests, requests - len(actions)))
+        db.unset(DEFERRED_ACTIONS_KEY)
+        db.flush()
+    _service_actions.clear()
+    del _service_requests[:]
+
+
+def log_hook_counters():
+    """ Log how many hook tool processes this hook spawned, and how well
+        the hookenv cache saved on them. """
+    calls = hook_tool_calls()
+    log('Spawned %d hook tool processes: %s' % (
+        sum(calls.values()),
+        ', '.join('%s %d' % item for item in sorted(calls.items()))),
+        level='DEBUG')
+    stats = cache_stats()
+    log('hookenv cache: %d hits, %d misses%s' % (
+        stats['hits'], stats['misses'],
+        ''.join(' (%s %d/%d)' % (name, counts['hits'], counts['misses'])
+                for name, counts in sorted(stats['functions'].items()))),
+        level='DEBUG')
+
+
+# Hooks end with entrypoint.run(), which also picks up actions left
+# behind by children that ran with defer_service_actions_env().  Exit
+# callbacks run last registered first, so the reload is timed with the
+# rest of the hook and the counters are logged last.
+atexit(log_hook_counters)
+atexit(record_hook_stats)
+atexit(run_service_actions)
+
+
+def rebuild_due(hook, now=None):
+    """ Decide whether this hook should rebuild the nagios config, or only
+        record a pending rebuild while relations churn, as
+        debounce.decide() does with rebuild_quiet_period and
+        rebuild_max_delay. """
+    now = now or time.time()
+    db = unitdata.kv()
+    due, state = debounce.decide(
+        db.get(REBUILD_STATE_KEY), hook, now,
+        config('rebuild_quiet_period') or 0,
+        config('rebuild_max_delay') or 0,
+        [hook, relation_id(), remote_unit()])
+    if state is not None:
+        db.set(REBUILD_STATE_KEY, state)
+        db.flush()
+        if not due:
+            log('Relation churn, deferring rebuild (%d changes pending for '
+                '%ds)' % (len(state['pending']),
+                          now - state['first-pending']))
+    return due
+
+
+def rebuild_done():
+    """ Clear the pending rebuild after a successful relation pass. """
+    db = unitdata.kv()
+    state = db.get(REBUILD_STATE_KEY)
+    cleared = debounce.caught_up(state)
+    if cleared is not None:
+        log('Rebuild caught up with %d deferred relation changes' % (
+            len(state['pending'])))
+        db.set(REBUILD_STATE_KEY, cleared)
+        db.flush()
@@ -0,0 +1,79 @@
+""" Which parts of upgrade-charm depend on which config options.
+
+    config-changed only runs the handlers whose options changed since the
+    last successful run. A full run, for upgrade-charm itself or the first
+    config-changed, runs them all, including the handlers listed here with
+    no options, which depend on the charm or the machine rather than on
+    its config. """
+
+from collections import OrderedDict
+
+NAGIOS_CFG_OPTIONS = (
+    'nagios_user', 'nagios_group', 'enable_livestatus', 'livestatus_path',
+    'livestatus_args', 'check_external_commands', 'command_check_interval',
+    'command_file', 'debug_file', 'debug_verbosity', 'debug_level',
+    'daemon_dumps_core', 'flap_detection', 'admin_email', 'admin_pager',
+    'log_rotation_method', 'log_archive_path', 'use_syslog', 'monitor_self',
+    'nagios_host_context', 'load_monitor', 'service_check_timeout',
+    'service_check_timeout_state', 'auto_tune_scheduler',
+    'scheduler_overrides', 'enable_perfdata', 'perfdata_interval',
+)
+CONTACT_OPTIONS = (
+    'enable_pagerduty', 'contactgroup-members', 'admin_email',
+    'admin_service_notification_period', 'admin_host_notification_period',
+    'admin_service_notification_options', 'admin_host_notification_options',
+    'admin_service_notification_commands',
+    'admin_host_notification_commands',
+)
+
+# handler name -> the options it reads, in the order the handlers run
+CONFIG_HANDLERS = OrderedDict([
+    ('warn_legacy_relations', ()),
+    ('write_extra_config', ('extraconfig',)),
+    ('update_config', NAGIOS_CFG_OPTIONS),
+    ('enable_livestatus_config', ('enable_livestatus', 'livestatus_path',
+                                  'nagios_user')),
+    ('configure_livestatus_api', ('enable_livestatus', 'livestatus_path',
+                                  'livestatus_api_ttl', 'nagios_user')),
+    ('enable_pagerduty_config', ('enable_pagerduty', 'pagerduty_key',
+                                 'pagerduty_path',
+                                 'pagerduty_notification_levels',
+                                 'pagerduty_workers', 'nagios_user',
+                                 'nagios_group')),
+    ('update_contacts', CONTACT_OPTIONS),
+    ('configure_ssl', ('ssl', 'ssl_cert', 'ssl_key', 'ssl_chain')),
+    ('configure_perfdata', ('enable_perfdata', 'nagios_user', 'nagios_group',
+                            'ssl')),
+    ('update_localhost', ()),
+    ('update_cgi_config', ('nagiosadmin', 'ro-password')),
+    ('update_passwords', ('nagiosadmin', 'password', 'ro-password')),
+    ('postfix_loopback_only', ()),
+    ('mymonitors_relation', ()),
+    # the autogenerated hostgroups include the Nagios host itself, named
+    # after nagios_host_context, and any hosts defined in extraconfig
+    ('monitors_relation', ('check_timeout', 'resolve_target_addresses',
+                           'dns_cache_ttl', 'dns_lookup_timeout',
+                           'incremental_reconcile',
+                           'config_versions_retained', 'extraconfig',
+                           'nagios_host_context', 'monitor_self')),
+])
+
+# Options the other hooks read as they run, nothing to redo when they change
+RUNTIME_OPTIONS = (
+    'relation_fetch_workers', 'rebuild_quiet_period', 'rebuild_max_delay',
+    'profile_hooks', 'profile_max_reports', 'profile_max_megabytes',
+)
+
+
+def changed_options(config):
+    """ The options of a charmhelpers Config that differ from the last
+        saved run. """
+    return set(key for key in config if config.changed(key))
+
+
+def handlers_to_run(changed, full=False, handlers=CONFIG_HANDLERS):
+    """ Names of the handlers depending on any of the changed options, or
+        of every handler on a full run, in running order. """
+    changed = set(changed)
+    return [name for name, options in handlers.items()
+            if full or changed.intersection(options)]
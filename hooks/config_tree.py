@@ -0,0 +1,182 @@
+""" The versioned Nagios config trees.
+
+    /etc/nagios3 is a symlink to the live tree, one of the committed
+    versions kept under /etc/nagios3.versions. A change is staged in a tree
+    hard linked to the live one, so the versions share every file that did
+    not change between them and a commit only costs the files that did.
+
+    The flip side is that a file must never be edited in place anywhere
+    under these trees, as that changes it in every version sharing it.
+    Whatever the charm writes goes through replace_file(), and tools that
+    can only edit in place, such as htpasswd, are pointed at a copy by
+    replacing(). """
+
+import errno
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+
+def replace_file(path, content, perms=0o644):
+    """ Atomically replace path with content. """
+    if not isinstance(content, bytes):
+        content = content.encode('utf-8')
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path),
+                                     delete=False) as new_file:
+        new_file.write(content)
+        new_file.flush()
+        os.fchmod(new_file.fileno(), perms)
+    os.rename(new_file.name, path)
+
+
+@contextmanager
+def replacing(path):
+    """ Yield the path of a private copy of path for a tool to edit in
+        place, and replace path with it once the block succeeds. A missing
+        path starts out as an empty file. """
+    fd, copy = tempfile.mkstemp(dir=os.path.dirname(path),
+                                prefix='.' + os.path.basename(path) + '.')
+    os.close(fd)
+    try:
+        if os.path.exists(path):
+            shutil.copy2(path, copy)
+            st = os.stat(path)
+            os.chown(copy, st.st_uid, st.st_gid)
+        else:
+            os.chmod(copy, 0o644)
+        yield copy
+    except BaseException:
+        os.unlink(copy)
+        raise
+    os.rename(copy, path)
+
+
+def link_tree(src, dst):
+    """ Stage a copy of src at dst that hard links every file rather than
+        copying it. """
+    src = os.path.realpath(src)
+    for dirpath, dirnames, filenames in os.walk(src):
+        target_dir = os.path.normpath(
+            os.path.join(dst, os.path.relpath(dirpath, src)))
+        if not os.path.isdir(target_dir):
+            os.mkdir(target_dir)
+            shutil.copystat(dirpath, target_dir)
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            target = os.path.join(target_dir, name)
+            if os.path.islink(path):
+                os.symlink(os.readlink(path), target)
+            elif name in filenames:
+                try:
+                    os.link(path, target)
+                except OSError as e:
+                    if e.errno not in (errno.EXDEV, errno.EPERM):
+                        raise
+                    shutil.copy2(path, target)
+
+
+def _file_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def tree_files(root):
+    """ {relative path: path} of the files under root. """
+    files = {}
+    root = os.path.realpath(root)
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            files[os.path.relpath(path, root)] = path
+    return files
+
+
+def changed_files(staged, live):
+    """ Relative paths of the files that differ between the staged and the
+        live tree, sorted. Files still hard linked to the live copy are
+        unchanged without reading them. """
+    new = tree_files(staged)
+    old = tree_files(live)
+    changed = []
+    for relpath in set(new).union(old):
+        if relpath not in new or relpath not in old:
+            changed.append(relpath)
+        elif os.path.samefile(new[relpath], old[relpath]):
+            continue
+        elif _file_digest(new[relpath]) != _file_digest(old[relpath]):
+            changed.append(relpath)
+    return sorted(changed)
+
+
+def versions(versions_dir):
+    """ Committed trees, oldest first. """
+    if not os.path.isdir(versions_dir):
+        return []
+    return sorted(os.path.join(versions_dir, name)
+                  for name in os.listdir(versions_dir))
+
+
+def new_version_path(versions_dir, now=None):
+    """ Where to commit a tree at now, sorting after every earlier one. """
+    now = time.time() if now is None else now
+    return os.path.join(versions_dir, '%s.%06d' % (
+        time.strftime('%Y%m%d%H%M%S', time.gmtime(now)),
+        int(now % 1 * 1000000)))
+
+
+def point_at(link, version):
+    """ Atomically switch the symlink link over to version. """
+    new_link = link + '.new'
+    if os.path.lexists(new_link):
+        os.unlink(new_link)
+    os.symlink(version, new_link)
+    os.rename(new_link, link)
+
+
+def migrate(main_dir, versions_dir):
+    """ Turn a plain main_dir directory into the first committed tree. """
+    if not os.path.isdir(versions_dir):
+        os.mkdir(versions_dir, 0o755)
+    if os.path.isdir(main_dir) and not os.path.islink(main_dir):
+        version = new_version_path(versions_dir)
+        os.rename(main_dir, version)
+        point_at(main_dir, version)
+
+
+def commit(staged, main_dir, versions_dir, now=None):
+    """ Move the staged tree into the versions and make it the live one,
+        returning its path. """
+    migrate(main_dir, versions_dir)
+    version = new_version_path(versions_dir, now)
+    os.rename(staged, version)
+    point_at(main_dir, version)
+    return version
+
+
+def prune(versions_dir, main_dir, retain):
+    """ Drop all but the newest retain trees, never the live one. """
+    live = os.path.realpath(main_dir)
+    for version in versions(versions_dir)[:-max(1, retain)]:
+        if os.path.realpath(version) != live:
+            shutil.rmtree(version)
+
+
+def rollback(main_dir, versions_dir, steps=1):
+    """ Point main_dir back at the tree committed steps before the live
+        one, returning it. Raises ValueError if there is no such tree. """
+    committed = versions(versions_dir)
+    live = os.path.realpath(main_dir)
+    resolved = [os.path.realpath(v) for v in committed]
+    if live not in resolved:
+        raise ValueError('%s is not a committed config version yet, there '
+                         'is nothing to roll back to' % main_dir)
+    current = resolved.index(live)
+    if current - steps < 0:
+        raise ValueError('Only %d earlier config versions are retained' %
+                         current)
+    version = committed[current - steps]
+    point_at(main_dir, version)
+    return version
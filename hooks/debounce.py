@@ -0,0 +1,54 @@
+""" When relation hooks rebuild the nagios config during churn.
+
+    The state carried from one hook to the next is a dict of when the last
+    relation event arrived, when the oldest deferred one did, and the
+    deferred changes themselves, only kept for the log. """
+
+# Deferred relation changes remembered for the log
+PENDING_KEPT = 50
+
+
+def initial_state():
+    return {'last-event': None, 'first-pending': None, 'pending': []}
+
+
+def decide(state, hook, now, quiet, max_delay, change=None):
+    """ (due, state) for hook running at now: whether it should rebuild,
+        and the state to keep for the next hook, None if it is unchanged.
+
+        With a quiet period, a relation hook arriving less than quiet
+        seconds after the previous one only records change as pending. The
+        pending rebuild then runs in the first relation hook or
+        update-status after a quiet period without relation changes, and in
+        any relation hook once it has been pending for max_delay seconds. """
+    state = dict(state or initial_state())
+
+    if hook == 'update-status':
+        if not state['first-pending']:
+            return False, None
+        settled = now - state['last-event'] >= quiet
+        overdue = now - state['first-pending'] >= max_delay
+        return settled or overdue, None
+
+    if not quiet or '-relation-' not in hook:
+        return True, None
+
+    previous_event = state['last-event']
+    state['last-event'] = now
+    overdue = (state['first-pending'] and
+               now - state['first-pending'] >= max_delay)
+    if previous_event is None or now - previous_event >= quiet or overdue:
+        return True, state
+
+    # the relation data itself is read back from Juju when the rebuild runs
+    state['first-pending'] = state['first-pending'] or now
+    state['pending'] = (state['pending'] + [change])[-PENDING_KEPT:]
+    return False, state
+
+
+def caught_up(state):
+    """ The state after a successful rebuild, None if nothing was
+        pending. """
+    if not state or not state['first-pending']:
+        return None
+    return dict(state, **{'first-pending': None, 'pending': []})
@@ -0,0 +1,77 @@
+""" Resolving host names concurrently through a cache kept between hooks.
+
+    The cache is any kv store with get() and set(), such as the unit's
+    unitdata.kv(), holding one record per name under CACHE_PREFIX: the
+    address it resolved to, None if the lookup failed, when that expires and
+    the last address it ever resolved to. """
+
+import multiprocessing
+import socket
+import time
+from multiprocessing.pool import ThreadPool
+
+CACHE_PREFIX = 'dns.'
+# Failed lookups are retried after this many seconds, whatever the ttl
+NEGATIVE_TTL = 60
+LOOKUP_WORKERS = 16
+
+
+def lookup_address(name):
+    try:
+        return socket.getaddrinfo(name, None)[0][4][0]
+    except socket.error:
+        return None
+
+
+def resolve(db, names, timeout, ttl, lookup=lookup_address, now=None,
+            workers=LOOKUP_WORKERS):
+    """ ({name: address}, stats) for names, looking up whatever is not
+        cached in db with up to workers concurrent calls to lookup.
+
+        A name that fails to resolve maps to the last address it resolved
+        to, or None if it never did. Failures are cached for NEGATIVE_TTL
+        seconds, lookups that take longer than timeout are not cached at
+        all. stats counts the names, those looked up and those that timed
+        out. """
+    if now is None:
+        now = time.time()
+    records = {}
+    stale = []
+    for name in set(names):
+        record = db.get(CACHE_PREFIX + name) or {}
+        records[name] = record
+        if record.get('expires', 0) <= now:
+            stale.append(name)
+
+    timed_out = 0
+    if stale:
+        workers = min(workers, len(stale))
+        pool = ThreadPool(workers)
+        try:
+            pending = [(name, pool.apply_async(lookup, (name,)))
+                       for name in stale]
+            # a hung lookup holds on to its worker, so the whole batch
+            # gets as many timeouts as it takes rounds of workers
+            deadline = time.time() + timeout * -(-len(stale) // workers)
+            for name, result in pending:
+                try:
+                    address = result.get(max(0, deadline - time.time()))
+                except multiprocessing.TimeoutError:
+                    timed_out += 1
+                    continue
+                record = records[name]
+                if address is None:
+                    record['expires'] = now + NEGATIVE_TTL
+                    record['address'] = None
+                else:
+                    record['expires'] = now + ttl
+                    record['address'] = record['last-good'] = address
+                db.set(CACHE_PREFIX + name, record)
+        finally:
+            pool.terminate()
+
+    addresses = dict((name, record.get('address') or record.get('last-good'))
+                     for name, record in records.items())
+    stats = {'names': len(records), 'looked-up': len(stale),
+             'timed-out': timed_out}
+    return addresses, stats
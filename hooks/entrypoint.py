@@ -0,0 +1,22 @@
+""" The entry point of every python hook and action.
+
+    Callbacks registered with hookenv.atexit(), such as the service reloads
+    and hook stats of common, only run when the hook body goes through
+    charmhelpers' Hooks framework, so each hook and action ends with
+
+        if __name__ == '__main__':
+            run(main) """
+
+from charmhelpers.core import hookenv
+
+from profiling import run_profiled
+
+
+def run(func, *args, **kwargs):
+    """ Run func as the body of the current hook or action, profiled as
+        run_profiled() does. The atstart callbacks run before it, the
+        atexit ones only once it has returned or exited successfully. """
+    name = hookenv.hook_name()
+    hooks = hookenv.Hooks()
+    hooks.register(name, lambda: run_profiled(name, func, *args, **kwargs))
+    hooks.execute([name])
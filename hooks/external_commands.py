@@ -0,0 +1,236 @@
+""" Batched writer for Nagios' external command file.
+
+    The command file is a named pipe Nagios reads into its
+    external_command_buffer_slots buffer. Commands are packed into writes
+    of at most PIPE_BUF bytes, which the kernel makes atomic, so lines from
+    other writers can never be interleaved with ours and thousands of
+    commands cost a few dozen writes. The pipe is opened non-blocking:
+    when Nagios falls behind and the pipe fills up, the writer waits for it
+    to drain rather than failing or blocking forever.
+
+        writer = CommandWriter('/var/lib/nagios3/rw/nagios.cmd')
+        writer.write([format_command('ACKNOWLEDGE_SVC_PROBLEM', 'web-0',
+                                     'check_http', 2, 1, 1, 'admin',
+                                     'Looking into it')]) """
+
+import errno
+import fnmatch
+import os
+import re
+import select
+import time
+
+import status_dat
+
+COMMAND_FILE = '/var/lib/nagios3/rw/nagios.cmd'
+NAGIOS_CFG = '/etc/nagios3/nagios.cfg'
+PIPE_BUF = getattr(select, 'PIPE_BUF', 4096)
+DEFAULT_BUFFER_SLOTS = 4096
+# Seconds to wait for Nagios to make room in a full pipe
+WRITE_TIMEOUT = 60
+BUFFER_SLOTS_RE = re.compile(r'^external_command_buffer_slots=(\d+)\s*$',
+                             re.MULTILINE)
+
+
+if str is bytes:
+    def _text(value):
+        if isinstance(value, str):
+            return value.decode('utf-8')
+        return unicode(value)  # noqa: F821
+else:
+    def _text(value):
+        if isinstance(value, bytes):
+            return value.decode('utf-8')
+        return str(value)
+
+
+class CommandError(Exception):
+    pass
+
+
+def format_command(name, *args, **kwargs):
+    """ One external command line, e.g. "[1600000000] NAME;arg;arg\\n",
+        as text. Byte string arguments are taken to be UTF-8, which is also
+        how batches() encodes the line. Only the last argument, the comment
+        of most commands, may contain semicolons. """
+    now = kwargs.get('now') or time.time()
+    args = [_text(arg) for arg in args]
+    for arg in args:
+        if '\n' in arg or '\r' in arg:
+            raise CommandError('Newline in argument %r of %s' % (arg, name))
+    for arg in args[:-1]:
+        if ';' in arg:
+            raise CommandError('Semicolon in argument %r of %s' % (arg, name))
+    return u'[%d] %s\n' % (now, u';'.join([_text(name)] + args))
+
+
+def buffer_slots(path=NAGIOS_CFG):
+    """ Nagios' external_command_buffer_slots, the default if unset. """
+    try:
+        with open(path) as f:
+            match = BUFFER_SLOTS_RE.search(f.read())
+    except IOError:
+        match = None
+    return int(match.group(1)) if match else DEFAULT_BUFFER_SLOTS
+
+
+def batches(lines, size=PIPE_BUF, max_lines=DEFAULT_BUFFER_SLOTS):
+    """ Yield the lines joined into chunks of at most size bytes and
+        max_lines commands, never splitting a line between chunks. """
+    chunk = []
+    length = 0
+    for line in lines:
+        if not isinstance(line, bytes):
+            line = line.encode('utf-8')
+        if len(line) > size:
+            raise CommandError('Command of %d bytes can not be written '
+                               'atomically: %r' % (len(line), line[:80]))
+        if chunk and (length + len(line) > size or len(chunk) >= max_lines):
+            yield b''.join(chunk)
+            chunk = []
+            length = 0
+        chunk.append(line)
+        length += len(line)
+    if chunk:
+        yield b''.join(chunk)
+
+
+class CommandWriter(object):
+
+    def __init__(self, path=COMMAND_FILE, timeout=WRITE_TIMEOUT,
+                 slots=None):
+        self.path = path
+        self.timeout = timeout
+        self.slots = slots or buffer_slots()
+
+    def _open(self):
+        try:
+            return os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                raise CommandError('Nagios is not reading %s, is it running '
+                                   'with check_external_commands?' %
+                                   self.path)
+            if e.errno == errno.ENOENT:
+                raise CommandError('%s does not exist, is Nagios running '
+                                   'with check_external_commands?' %
+                                   self.path)
+            raise
+
+    def _wait(self, fd, deadline):
+        remaining = deadline - time.time()
+        if remaining <= 0 or not select.select([], [fd], [], remaining)[1]:
+            raise CommandError('Nagios did not read its command pipe for %ds'
+                               % self.timeout)
+
+    def write(self, lines):
+        """ Write the command lines, returning (commands, writes). """
+        commands = writes = 0
+        fd = self._open()
+        try:
+            for chunk in batches(lines, PIPE_BUF, self.slots):
+                deadline = time.time() + self.timeout
+                view = memoryview(chunk)
+                while view:
+                    try:
+                        written = os.write(fd, view)
+                    except OSError as e:
+                        if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                            raise
+                        # the pipe is full, wait for Nagios to drain it
+                        self._wait(fd, deadline)
+                        continue
+                    view = view[written:]
+                    writes += 1
+                commands += chunk.count(b'\n')
+        finally:
+            os.close(fd)
+        return commands, writes
+
+
+def _matches(name, patterns):
+    return any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)
+
+
+def application_of(host):
+    """ The application a host was generated for, as the autogenerated
+        hostgroups have it: its name without the unit number. """
+    return host.rsplit('-', 1)[0] if '-' in host else host
+
+
+def select_hosts(hosts=(), hostgroups=(), applications=(),
+                 path=status_dat.STATUS_FILE,
+                 objects_path=status_dat.OBJECTS_CACHE):
+    """ Status records of the hosts matching any of the host name
+        patterns, hostgroups or applications. """
+    members = status_dat.hostgroup_members(hostgroups, objects_path) \
+        if hostgroups else set()
+    selected = []
+    for record in status_dat.iter_status(
+            'host', ['host_name', 'current_state',
+                     'problem_has_been_acknowledged'], path):
+        name = record.host_name
+        if name in members or _matches(name, hosts) or \
+                _matches(application_of(name), applications):
+            selected.append(record)
+    return selected
+
+
+def select_services(hosts, services=(), path=status_dat.STATUS_FILE):
+    """ Status records of the services of hosts matching any of the service
+        description patterns, all of their services if there are none. """
+    hosts = set(hosts)
+    return [record for record in status_dat.iter_status(
+            'service', ['host_name', 'service_description', 'current_state',
+                        'problem_has_been_acknowledged'], path)
+            if record.host_name in hosts and
+            (not services or _matches(record.service_description, services))]
+
+
+def select_targets(hosts=(), hostgroups=(), applications=(), services=(),
+                   path=status_dat.STATUS_FILE,
+                   objects_path=status_dat.OBJECTS_CACHE):
+    """ (host records, service records) an action applies to: the selected
+        hosts and all of their services, or only the services matching
+        services if any are given. """
+    if not (hosts or hostgroups or applications):
+        raise CommandError('Select hosts with host, hostgroup or '
+                           'application, host=* for every host')
+    host_records = select_hosts(hosts, hostgroups, applications, path,
+                                objects_path)
+    service_records = select_services(
+        [record.host_name for record in host_records], services, path)
+    return ([] if services else host_records), service_records
+
+
+def acknowledge_commands(host_records, service_records, author, comment,
+                         sticky=True, notify=True, persistent=False,
+                         now=None):
+    """ ACKNOWLEDGE_*_PROBLEM lines for every host and service with an
+        unacknowledged problem. Nagios ignores acknowledgements of hosts
+        that are UP and services that are OK. """
+    flags = (2 if sticky else 0, int(notify), int(persistent), author,
+             comment)
+    for record in host_records:
+        if record.current_state and not record.problem_has_been_acknowledged:
+            yield format_command('ACKNOWLEDGE_HOST_PROBLEM',
+                                 record.host_name, *flags, now=now)
+    for record in service_records:
+        if record.current_state and not record.problem_has_been_acknowledged:
+            yield format_command('ACKNOWLEDGE_SVC_PROBLEM', record.host_name,
+                                 record.service_description, *flags, now=now)
+
+
+def downtime_commands(host_records, service_records, start, duration,
+                      author, comment, fixed=True, now=None):
+    """ SCHEDULE_*_DOWNTIME lines for every host and service. A flexible
+        downtime starts with the first problem between start and
+        start + duration and lasts for duration. """
+    end = start + duration
+    flags = (start, end, int(fixed), 0, duration, author, comment)
+    for record in host_records:
+        yield format_command('SCHEDULE_HOST_DOWNTIME', record.host_name,
+                             *flags, now=now)
+    for record in service_records:
+        yield format_command('SCHEDULE_SVC_DOWNTIME', record.host_name,
+                             record.service_description, *flags, now=now)
@@ -0,0 +1,32 @@
+""" Summaries of the hook runs recorded by common.record_hook_stats().
+
+    Each run is a dict with the hook name, its total seconds and the
+    seconds it spent in each phase. """
+
+import math
+
+
+def percentile(values, percent):
+    """ Nearest rank percentile of a list of numbers. """
+    values = sorted(values)
+    rank = int(math.ceil(percent / 100.0 * len(values)))
+    return values[max(0, rank - 1)]
+
+
+def summarize_hook_stats(runs, percents=(50, 90, 99)):
+    """ {hook: {phase: {'runs': n, 'p50': seconds, ..., 'max': seconds}}}
+        over the given runs, the whole run being the 'total' phase. """
+    samples = {}
+    for run in runs:
+        phases = dict(run['phases'], total=run['total'])
+        for name, seconds in phases.items():
+            samples.setdefault(run['hook'], {}).setdefault(
+                name, []).append(seconds)
+    summary = {}
+    for hook, phases in samples.items():
+        for name, values in phases.items():
+            stats = {'runs': len(values), 'max': max(values)}
+            for percent in percents:
+                stats['p%d' % percent] = percentile(values, percent)
+            summary.setdefault(hook, {})[name] = stats
+    return summary
@@ -0,0 +1,326 @@
+""" In-memory model of the objects the charm generates into charm.cfg.
+
+    pynag rewrites the whole file on every save(), which makes rendering a
+    large fleet quadratic in I/O.  The relation pass instead populates a
+    CharmConfig and streams it to disk once at the end. """
+
+import filecmp
+import hashlib
+import os
+import re
+import shlex
+
+from collections import OrderedDict
+
+DEFINE_RE = re.compile(r'^define\s+(\w+)\s*{\s*$')
+
+
+class NagiosObject(object):
+    """ A single object definition, exposing the subset of the pynag
+        ObjectDefinition API used by the relation pass. """
+    object_type = None
+    key_fields = ()
+
+    def __init__(self, owner=None, **attributes):
+        self.owner = owner
+        self.attributes = OrderedDict()
+        for field in self.key_fields:
+            if field in attributes:
+                self.attributes[field] = attributes.pop(field)
+        self.attributes.update(sorted(attributes.items()))
+
+    @property
+    def key(self):
+        values = tuple(self.attributes.get(f) for f in self.key_fields)
+        return values[0] if len(values) == 1 else values
+
+    def set_attribute(self, name, value):
+        self.attributes[name] = value
+
+    def get_attribute(self, name):
+        return self.attributes.get(name)
+
+    def __getitem__(self, name):
+        return self.attributes.get(name)
+
+    def get_filename(self):
+        return self.owner.path if self.owner else None
+
+    def save(self):
+        """ Register the object with its CharmConfig, nothing hits the disk
+            until CharmConfig.write(). """
+        if self.owner is not None:
+            self.owner.add(self)
+
+    def delete(self):
+        if self.owner is not None:
+            self.owner.remove(self)
+
+    def render(self):
+        lines = ['define %s {' % self.object_type]
+        for name, value in self.attributes.items():
+            if value is None:
+                continue
+            lines.append('\t %-30s %s' % (name, value))
+        lines.append('}\n\n')
+        return '\n'.join(lines)
+
+
+class Host(NagiosObject):
+    object_type = 'host'
+    key_fields = ('host_name',)
+
+
+class Service(NagiosObject):
+    object_type = 'service'
+    key_fields = ('host_name', 'service_description')
+
+
+class Command(NagiosObject):
+    object_type = 'command'
+    key_fields = ('command_name',)
+
+
+class Hostgroup(NagiosObject):
+    object_type = 'hostgroup'
+    key_fields = ('hostgroup_name',)
+
+
+OBJECT_TYPES = dict((cls.object_type, cls)
+                    for cls in (Host, Service, Command, Hostgroup))
+
+
+def object_key(object_type, obj):
+    """ The identifying key of a charm or pynag object, None for templates
+        and anything else that cannot be looked up by name. """
+    values = tuple(obj[field] for field in OBJECT_TYPES[object_type].key_fields)
+    if None in values:
+        return None
+    return values[0] if len(values) == 1 else values
+
+
+class ObjectIndex(object):
+    """ Hash lookups over every object Nagios will load, hand written and
+        charm generated alike, built once per hook from the parsed config.
+
+        The CharmConfig it is attached to keeps it current as the relation
+        pass adds and removes objects. """
+
+    def __init__(self):
+        self.objects = dict((object_type, {}) for object_type in OBJECT_TYPES)
+
+    @classmethod
+    def build(cls, model, charm_config=None):
+        """ Index the objects parsed by a pynag Model, then the charm's own
+            objects on top, and attach the index to charm_config. """
+        index = cls()
+        for object_type, fetcher in (('host', model.Host),
+                                     ('service', model.Service),
+                                     ('command', model.Command),
+                                     ('hostgroup', model.Hostgroup)):
+            for obj in fetcher.objects.all:
+                index.add(obj, object_type)
+        if charm_config is not None:
+            for objects in charm_config.objects.values():
+                for obj in objects.values():
+                    index.add(obj)
+            charm_config.index = index
+        return index
+
+    def add(self, obj, object_type=None):
+        object_type = object_type or obj.object_type
+        key = object_key(object_type, obj)
+        if key is not None:
+            # pynag keeps the first definition it parsed, so do we
+            self.objects[object_type].setdefault(key, obj)
+
+    def remove(self, obj, object_type=None):
+        object_type = object_type or obj.object_type
+        key = object_key(object_type, obj)
+        if self.objects[object_type].get(key) is obj:
+            del self.objects[object_type][key]
+
+    def get(self, object_type, key):
+        return self.objects[object_type].get(key)
+
+    @property
+    def hosts(self):
+        return self.objects['host']
+
+    @property
+    def services(self):
+        return self.objects['service']
+
+    @property
+    def commands(self):
+        return self.objects['command']
+
+    @property
+    def hostgroups(self):
+        return self.objects['hostgroup']
+
+
+def command_words(command_line):
+    """ The shell words of command_line, which tell whether two command
+        lines run the same command: whitespace between words does not
+        matter, whitespace quoted within one does. """
+    command_line = (command_line or '').strip()
+    if isinstance(command_line, bytes):
+        command_line = command_line.decode('utf-8')
+    try:
+        if str is bytes:
+            # Python 2's shlex cannot read unicode
+            return tuple(word.decode('utf-8') for word in
+                         shlex.split(command_line.encode('utf-8')))
+        return tuple(shlex.split(command_line))
+    except ValueError:
+        # unbalanced quotes, Nagios passes it to the shell as is anyway
+        return (command_line,)
+
+
+class CommandRegistry(object):
+    """ Check commands known to Nagios by name, loaded once from an index.
+
+        New commands are interned in memory and only handed to the
+        CharmConfig by flush(), so they reach the disk with the rest of
+        charm.cfg. """
+
+    def __init__(self, index):
+        # name: command_words() of its command line
+        self.command_words = dict(
+            (name, command_words(cmd['command_line']))
+            for name, cmd in index.commands.items())
+        self.pending = OrderedDict()
+        # (signature, name) for every command renamed to avoid a collision
+        self.collisions = []
+
+    def intern(self, signature, command_line):
+        """ Return the name of the command running command_line, defining
+            it under signature unless that name is taken by a different
+            command line. """
+        command_line = command_line.strip()
+        words = command_words(command_line)
+        existing = self.command_words.get(signature)
+        if existing is None or existing == words:
+            if existing is None:
+                self.command_words[signature] = words
+                self.pending[signature] = command_line
+            return signature
+        name = '%s_%s' % (signature, hashlib.sha1(
+            ' '.join(words).encode('utf-8')).hexdigest()[:8])
+        if name not in self.command_words:
+            self.collisions.append((signature, name))
+        return self.intern(name, command_line)
+
+    def flush(self, charm_config):
+        """ Move the commands defined since the last flush into charm_config,
+            returning how many there were. """
+        for name, command_line in self.pending.items():
+            charm_config.new('command', command_name=name,
+                             command_line=command_line).save()
+        count = len(self.pending)
+        self.pending.clear()
+        return count
+
+
+class CharmConfig(object):
+    """ The hosts, services, commands and hostgroups owned by the charm,
+        keyed the same way Nagios identifies them. """
+
+    def __init__(self, path):
+        self.path = path
+        self.index = None
+        self.objects = dict((object_type, OrderedDict())
+                            for object_type in OBJECT_TYPES)
+
+    @property
+    def hosts(self):
+        return self.objects['host']
+
+    @property
+    def services(self):
+        return self.objects['service']
+
+    @property
+    def commands(self):
+        return self.objects['command']
+
+    @property
+    def hostgroups(self):
+        return self.objects['hostgroup']
+
+    def new(self, object_type, **attributes):
+        """ Create an unregistered object, call save() to keep it. """
+        return OBJECT_TYPES[object_type](owner=self, **attributes)
+
+    def add(self, obj):
+        obj.owner = self
+        self.objects[obj.object_type][obj.key] = obj
+        if self.index is not None:
+            self.index.add(obj)
+        return obj
+
+    def remove(self, obj):
+        self.objects[obj.object_type].pop(obj.key, None)
+        if self.index is not None:
+            self.index.remove(obj)
+
+    def get(self, object_type, key):
+        return self.objects[object_type].get(key)
+
+    def clear(self):
+        self.index = None
+        for objects in self.objects.values():
+            objects.clear()
+
+    def __len__(self):
+        return sum(len(objects) for objects in self.objects.values())
+
+    def load(self, path=None):
+        """ Read back a charm.cfg written by write() or by pynag. """
+        path = path or self.path
+        if not os.path.exists(path):
+            return
+        current = None
+        with open(path) as cfg:
+            for line in cfg:
+                line = line.strip()
+                if not line or line[0] in '#;':
+                    continue
+                match = DEFINE_RE.match(line)
+                if match:
+                    current = (match.group(1), [])
+                elif line == '}':
+                    if current and current[0] in OBJECT_TYPES:
+                        obj = self.new(current[0])
+                        for name, value in current[1]:
+                            obj.set_attribute(name, value)
+                        self.add(obj)
+                    current = None
+                elif current is not None:
+                    parts = line.split(None, 1)
+                    current[1].append((parts[0],
+                                       parts[1] if len(parts) > 1 else ''))
+
+    def write(self, path=None):
+        """ Stream every object to disk in one sequential pass with a single
+            fsync, then move it into place. Returns False, leaving the file
+            alone, if its content would not change.
+
+            Objects are sorted by key so the same set of objects always
+            produces the same file, however the pass arrived at it. """
+        path = path or self.path
+        tmp_path = '%s.tmp' % path
+        with open(tmp_path, 'w', 1 << 16) as cfg:
+            for object_type in ('command', 'host', 'service', 'hostgroup'):
+                objects = self.objects[object_type]
+                for key in sorted(objects):
+                    cfg.write(objects[key].render())
+            cfg.flush()
+            os.fsync(cfg.fileno())
+        if os.path.exists(path) and filecmp.cmp(tmp_path, path, False):
+            os.unlink(tmp_path)
+            return False
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, path)
+        return True
@@ -0,0 +1,33 @@
+""" Apache access to the perfdata metrics, shared by upgrade-charm and the
+    perfdata relation hooks.
+
+    Scrapers on the perfdata relation are only told a host, port and path,
+    so the metrics cannot sit behind the web interface's login. Instead
+    Apache serves them to the unit itself and to the addresses of the units
+    related on perfdata, and the relation hooks keep that list current. """
+
+import subprocess
+
+from common import METRICS_DIR, METRICS_URL_DIR, perfdata_scrapers, root_path
+from rendering import remove_if_present, render_template
+
+METRICS_APACHE_CONF = root_path(
+    '/etc/apache2/conf-available/nagios-metrics.conf')
+
+
+def configure_metrics_access(enabled):
+    """ Serve the metrics to the perfdata scrapers, or stop serving them,
+        returning whether the Apache config changed. """
+    if enabled:
+        changed = render_template('nagios-metrics-apache.tmpl',
+                                  METRICS_APACHE_CONF,
+                                  {'metrics_dir': METRICS_DIR,
+                                   'url_dir': METRICS_URL_DIR,
+                                   'scrapers': perfdata_scrapers()})
+        if changed:
+            subprocess.call(['a2enconf', 'nagios-metrics'])
+    else:
+        changed = remove_if_present(METRICS_APACHE_CONF)
+        if changed:
+            subprocess.call(['a2disconf', 'nagios-metrics'])
+    return changed
@@ -0,0 +1,137 @@
+""" Opt-in profiling of hook entry points.
+
+    With the profile_hooks option, or NAGIOS_CHARM_PROFILE in the
+    environment, set to "cpu", "memory" or "cpu,memory", each hook run
+    through run_profiled() leaves a pstats dump and a text report of the
+    hottest functions and largest allocations behind in the unit's state
+    directory, next to the charm directory so that upgrade-charm keeps
+    them. Old reports are pruned to the configured count and size.
+    Memory profiling needs tracemalloc, so the Python 2 hooks skip it
+    with a warning. """
+
+import cProfile
+import os
+import pstats
+import time
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2 has no tracemalloc
+    tracemalloc = None
+
+from charmhelpers.core.hookenv import charm_dir, config, log
+
+PROFILE_ENV = 'NAGIOS_CHARM_PROFILE'
+PROFILE_DIR_NAME = 'nagios-hook-profiles'
+PROFILE_MODES = ('cpu', 'memory')
+# functions and allocation sites listed in each text report
+REPORT_LINES = 40
+
+
+def profile_dir():
+    """ PROFILE_DIR_NAME in the state directory of the unit's agent,
+        /var/lib/juju/agents/unit-*/state. """
+    agent_dir = os.path.dirname(os.path.abspath(charm_dir()))
+    return os.path.join(agent_dir, 'state', PROFILE_DIR_NAME)
+
+
+def profiling_modes():
+    """ The requested subset of PROFILE_MODES, the environment taking
+        precedence over the charm config. """
+    requested = os.environ.get(PROFILE_ENV)
+    if requested is None:
+        requested = config('profile_hooks') or ''
+    modes = set(mode.strip() for mode in requested.lower().split(','))
+    if 'memory' in modes and tracemalloc is None:
+        log('Memory profiling needs tracemalloc, not available on this '
+            'Python, skipping it', 'WARNING')
+        modes.discard('memory')
+    return [mode for mode in PROFILE_MODES if mode in modes]
+
+
+def run_profiled(name, func, *args, **kwargs):
+    """ Call func, profiled as the hook name if profiling is enabled.
+
+        The reports are written even if func raises, a failing hook being
+        as interesting as a slow one. """
+    modes = profiling_modes()
+    if not modes:
+        return func(*args, **kwargs)
+    profiler = cProfile.Profile() if 'cpu' in modes else None
+    tracing = 'memory' in modes
+    if tracing:
+        tracemalloc.start(25)
+    started = time.time()
+    try:
+        if profiler is not None:
+            return profiler.runcall(func, *args, **kwargs)
+        return func(*args, **kwargs)
+    finally:
+        snapshot = None
+        if tracing:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+        write_reports(name, started, time.time() - started, profiler,
+                      snapshot)
+
+
+def write_reports(name, started, duration, profiler=None, snapshot=None):
+    directory = profile_dir()
+    if not os.path.isdir(directory):
+        os.makedirs(directory, 0o700)
+    base = os.path.join(directory, '%s.%03d-%s' % (
+        time.strftime('%Y%m%dT%H%M%S', time.gmtime(started)),
+        int(started % 1 * 1000), name))
+    report = StringIO()
+    report.write('%s took %.2fs\n\n' % (name, duration))
+    if profiler is not None:
+        profiler.dump_stats(base + '.pstats')
+        stats = pstats.Stats(profiler, stream=report)
+        stats.sort_stats('cumulative').print_stats(REPORT_LINES)
+    if snapshot is not None:
+        report.write('Top %d allocation sites:\n' % REPORT_LINES)
+        for stat in snapshot.statistics('lineno')[:REPORT_LINES]:
+            report.write('%s\n' % stat)
+    with open(base + '.txt', 'w') as f:
+        f.write(report.getvalue())
+    prune_reports()
+    log('Profile of %s written to %s.*' % (name, base))
+
+
+def list_reports():
+    """ [{'name', 'files', 'size'}] for every recorded run, newest first. """
+    directory = profile_dir()
+    if not os.path.isdir(directory):
+        return []
+    reports = {}
+    for filename in os.listdir(directory):
+        name = filename.rsplit('.', 1)[0]
+        path = os.path.join(directory, filename)
+        report = reports.setdefault(name, {'name': name, 'files': [],
+                                           'size': 0})
+        report['files'].append(path)
+        report['size'] += os.path.getsize(path)
+    return [reports[name] for name in sorted(reports, reverse=True)]
+
+
+def prune_reports(max_reports=None, max_megabytes=None):
+    """ Drop the oldest runs beyond profile_max_reports, then until the
+        rest fit in profile_max_megabytes. The newest run is always kept. """
+    if max_reports is None:
+        max_reports = config('profile_max_reports')
+    if max_megabytes is None:
+        max_megabytes = config('profile_max_megabytes')
+    reports = list_reports()
+    total = sum(report['size'] for report in reports)
+    while len(reports) > 1 and (len(reports) > max_reports or
+                                total > max_megabytes * 1024 * 1024):
+        report = reports.pop()
+        total -= report['size']
+        for path in report['files']:
+            os.unlink(path)
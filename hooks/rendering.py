@@ -0,0 +1,86 @@
+""" Rendering of the charm templates into the files they configure.
+
+    All templates are loaded through one Jinja2 Environment whose compiled
+    bytecode is kept in BYTECODE_CACHE_DIR_NAME under the charm directory,
+    so a config-changed does not parse them all again. A target is only
+    replaced when the rendered output differs from what is on disk, and the
+    callers only reload the services behind the files that did change. """
+
+import hashlib
+import os
+import stat
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+from charmhelpers.core.hookenv import charm_dir, log
+
+from config_tree import replace_file
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'templates')
+BYTECODE_CACHE_DIR_NAME = '.jinja2-cache'
+
+_environment = None
+# Files written or removed by this hook, in order
+_changed_files = []
+
+
+def template_environment():
+    global _environment
+    if _environment is None:
+        cache_dir = os.path.join(charm_dir(), BYTECODE_CACHE_DIR_NAME)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, 0o700)
+        _environment = Environment(
+            loader=FileSystemLoader(TEMPLATES_DIR),
+            bytecode_cache=FileSystemBytecodeCache(cache_dir))
+    return _environment
+
+
+def _digest(content):
+    return hashlib.sha1(content).hexdigest()
+
+
+def render_template(name, target, context, perms=0o644):
+    """ Render the template name into target, returning whether target
+        changed, as write_if_changed() does. """
+    content = template_environment().get_template(name).render(context)
+    return write_if_changed(target, content, perms)
+
+
+def write_if_changed(target, content, perms=0o644):
+    """ Replace target with content, returning whether it changed. A file
+        with the same content and perms is left alone, one that only has
+        other perms is replaced as well. """
+    if not isinstance(content, bytes):
+        content = content.encode('utf-8')
+    if os.path.isfile(target) and \
+            stat.S_IMODE(os.stat(target).st_mode) == perms:
+        with open(target, 'rb') as f:
+            if _digest(f.read()) == _digest(content):
+                return False
+    replace_file(target, content, perms)
+    _changed_files.append(target)
+    return True
+
+
+def remove_if_present(target):
+    """ Remove a file the charm no longer wants, returning whether there
+        was one. """
+    if not os.path.isfile(target):
+        return False
+    os.remove(target)
+    _changed_files.append(target)
+    return True
+
+
+def changed_files():
+    return list(_changed_files)
+
+
+def log_changed_files():
+    if _changed_files:
+        log('Changed %d configuration files: %s' % (
+            len(_changed_files), ', '.join(_changed_files)))
+    else:
+        log('No configuration files changed')
@@ -0,0 +1,94 @@
+""" Nagios scheduler settings sized for the fleet the charm generates.
+
+    auto_tune() only looks at the numbers it is given, the relation hooks
+    pass it the hosts and services they just generated and this machine's
+    CPUs and RAM. """
+
+import math
+
+from collections import OrderedDict
+
+# The scheduler settings of a stock nagios.cfg, in the order they appear
+SCHEDULER_DEFAULTS = OrderedDict([
+    ('status_update_interval', 10),
+    ('max_service_check_spread', 30),
+    ('max_concurrent_checks', 0),
+    ('check_result_reaper_frequency', 10),
+    ('max_check_result_reaper_time', 30),
+    ('use_large_installation_tweaks', 0),
+    ('enable_environment_macros', 1),
+])
+# What auto_tune assumes of the checks: the stock 5 minute check_interval,
+# a few seconds each, and a forked plugin's memory
+ASSUMED_CHECK_INTERVAL = 300
+ASSUMED_CHECK_SECONDS = 3
+CHECK_MEMORY = 16 * 1024 * 1024
+CHECKS_PER_CPU = 32
+# Check results handled by each run of the reaper
+REAPER_BATCH = 500
+LARGE_INSTALLATION_SERVICES = 2000
+
+
+def auto_tune(hosts, services, cpus, ram):
+    """ Scheduler settings sized for a fleet on this machine, and the
+        reasoning behind each change from SCHEDULER_DEFAULTS.
+
+        Values move in steps so that a few units coming or going does not
+        rewrite nagios.cfg. enable_environment_macros is left alone, any
+        notification command may read the NAGIOS_* variables. """
+    settings = OrderedDict(SCHEDULER_DEFAULTS)
+    reasons = []
+    checks = hosts + services
+    rate = checks / float(ASSUMED_CHECK_INTERVAL)
+
+    # every fork costs CPU and memory, unlimited concurrency lets a restart
+    # start every check at once
+    by_cpu = cpus * CHECKS_PER_CPU
+    by_memory = max(1, ram // 2 // CHECK_MEMORY)
+    limit = min(by_cpu, by_memory)
+    needed = int(math.ceil(rate * ASSUMED_CHECK_SECONDS))
+    settings['max_concurrent_checks'] = limit
+    reasons.append(
+        'max_concurrent_checks=%d: %d allowed by %d CPUs and %d by %.1f GiB '
+        'of RAM, %d checks keep about %d running%s' % (
+            limit, by_cpu, cpus, by_memory, ram / 1024.0 ** 3, checks,
+            needed, ', checks will queue' if needed > limit else ''))
+
+    # reap often enough that each run handles a bounded batch of results,
+    # and give each run a proportionate time slice
+    for frequency in (10, 5, 2):
+        if rate * frequency <= REAPER_BATCH:
+            break
+    if frequency != SCHEDULER_DEFAULTS['check_result_reaper_frequency']:
+        settings['check_result_reaper_frequency'] = frequency
+        settings['max_check_result_reaper_time'] = frequency * 3
+        reasons.append(
+            'check_result_reaper_frequency=%d, max_check_result_reaper_time'
+            '=%d: %.0f results a second' % (frequency, frequency * 3, rate))
+
+    # time to start every check once after a restart at the limit above
+    spread = int(math.ceil(
+        checks * ASSUMED_CHECK_SECONDS / float(limit) / 60 / 5)) * 5
+    if spread > SCHEDULER_DEFAULTS['max_service_check_spread']:
+        settings['max_service_check_spread'] = spread
+        reasons.append('max_service_check_spread=%d: minutes to start %d '
+                       'checks %d at a time' % (spread, checks, limit))
+
+    # status.dat is rewritten whole on every update
+    if checks >= 20000:
+        settings['status_update_interval'] = 60
+    elif checks >= 5000:
+        settings['status_update_interval'] = 30
+    if settings['status_update_interval'] != \
+            SCHEDULER_DEFAULTS['status_update_interval']:
+        reasons.append('status_update_interval=%d: status.dat holds %d '
+                       'objects' % (settings['status_update_interval'],
+                                    checks))
+
+    if services >= LARGE_INSTALLATION_SERVICES:
+        settings['use_large_installation_tweaks'] = 1
+        reasons.append('use_large_installation_tweaks=1: %d services, '
+                       'enable_environment_macros=0 in scheduler_overrides '
+                       'saves more if no notification command reads '
+                       'NAGIOS_* variables' % services)
+    return settings, reasons
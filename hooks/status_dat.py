@@ -0,0 +1,298 @@
+""" Streaming reader for Nagios' status.dat and objects.cache.
+
+    Both files are a sequence of blocks:
+
+        servicestatus {
+        	host_name=web-0
+        	service_description=check_http
+        	current_state=2
+        	...
+        	}
+
+    The file is memory mapped and scanned block by block, so memory use
+    does not grow with the file. Only the blocks of the requested kind are
+    looked at, and of those only the requested fields are extracted and
+    converted, each into a small record with __slots__ rather than a dict
+    of every attribute. """
+
+import fnmatch
+import mmap
+import os
+import time
+
+STATUS_FILE = '/var/cache/nagios3/status.dat'
+OBJECTS_CACHE = '/var/cache/nagios3/objects.cache'
+
+INT_FIELDS = frozenset((
+    'current_state', 'last_hard_state', 'current_attempt', 'max_attempts',
+    'state_type', 'last_state_change', 'last_hard_state_change',
+    'last_check', 'next_check', 'last_notification',
+    'current_notification_number', 'problem_has_been_acknowledged',
+    'acknowledgement_type', 'scheduled_downtime_depth',
+    'notifications_enabled', 'active_checks_enabled',
+    'passive_checks_enabled', 'is_flapping', 'has_been_checked',
+))
+FLOAT_FIELDS = frozenset((
+    'check_latency', 'check_execution_time', 'percent_state_change',
+    'check_interval', 'retry_interval',
+))
+COMMON_FIELDS = (
+    'host_name', 'current_state', 'state_type', 'current_attempt',
+    'max_attempts', 'last_check', 'next_check', 'last_state_change',
+    'last_hard_state_change', 'plugin_output', 'long_plugin_output',
+    'performance_data', 'check_latency', 'check_execution_time',
+    'percent_state_change', 'is_flapping', 'problem_has_been_acknowledged',
+    'scheduled_downtime_depth', 'notifications_enabled',
+    'active_checks_enabled', 'has_been_checked',
+)
+HOST_FIELDS = COMMON_FIELDS
+SERVICE_FIELDS = COMMON_FIELDS[:1] + ('service_description',) + \
+    COMMON_FIELDS[1:]
+HOST_STATES = ('UP', 'DOWN', 'UNREACHABLE')
+SERVICE_STATES = ('OK', 'WARNING', 'CRITICAL', 'UNKNOWN')
+# Above this many fields, splitting a block up beats searching it per field
+SEARCH_FIELDS = 8
+
+if str is bytes:
+    def _text(value):
+        return value
+else:
+    def _text(value):
+        return value.decode('utf-8', 'replace')
+
+
+class StatusRecord(object):
+    """ Base of the record classes made by record_class(), which add a
+        slot for each projected field. """
+    __slots__ = ()
+    fields = ()
+    states = ()
+
+    def __init__(self, values):
+        for name, value in zip(self.fields, values):
+            setattr(self, name, value)
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in self.fields)
+
+    @property
+    def state(self):
+        """ The state's name, e.g. CRITICAL. """
+        try:
+            return self.states[self.current_state]
+        except (AttributeError, IndexError, TypeError):
+            return None
+
+    @property
+    def name(self):
+        return self.host_name
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self.as_dict())
+
+
+class HostStatus(StatusRecord):
+    __slots__ = ()
+    kind = 'hoststatus'
+    all_fields = HOST_FIELDS
+    states = HOST_STATES
+
+
+class ServiceStatus(StatusRecord):
+    __slots__ = ()
+    kind = 'servicestatus'
+    all_fields = SERVICE_FIELDS
+    states = SERVICE_STATES
+
+    @property
+    def name(self):
+        return '%s/%s' % (self.host_name, self.service_description)
+
+
+RECORD_TYPES = {'host': HostStatus, 'service': ServiceStatus}
+_record_classes = {}
+
+
+def record_class(kind, fields=None):
+    """ The record class for 'host' or 'service' holding just fields, all
+        of the kind's known fields by default. """
+    base = RECORD_TYPES[kind]
+    fields = tuple(fields or base.all_fields)
+    cls = _record_classes.get((kind, fields))
+    if cls is None:
+        unknown = set(fields) - set(base.all_fields)
+        if unknown:
+            raise ValueError('Unknown %s status fields: %s' % (
+                kind, ', '.join(sorted(unknown))))
+        cls = _record_classes[(kind, fields)] = type(
+            base.__name__, (base,), {'__slots__': fields, 'fields': fields})
+    return cls
+
+
+def _convert(name, raw):
+    if name in INT_FIELDS:
+        try:
+            return int(raw)
+        except ValueError:
+            return None
+    if name in FLOAT_FIELDS:
+        try:
+            return float(raw)
+        except ValueError:
+            return None
+    return _text(raw)
+
+
+def iter_blocks(data, kinds):
+    """ Yield (kind, start, end) for each block of one of kinds in data, a
+        bytes-like object such as an mmap. start is the newline ending the
+        block's opening line, end the one before its closing brace. """
+    pos = 0
+    while True:
+        opening = data.find(b' {\n', pos)
+        if opening < 0:
+            return
+        kind = data[data.rfind(b'\n', 0, opening) + 1:opening]
+        end = data.find(b'\n\t}', opening)
+        if end < 0:
+            return
+        if kind in kinds:
+            yield kind, opening + 2, end
+        pos = end + 3
+
+
+def _search_fields(data, start, end, keys):
+    """ Raw values of the fields keyed by b'\\n\\tname=', None if absent. """
+    values = []
+    for key in keys:
+        found = data.find(key, start, end)
+        if found < 0:
+            values.append(None)
+            continue
+        found += len(key)
+        stop = data.find(b'\n', found, end)
+        values.append(data[found:end if stop < 0 else stop])
+    return values
+
+
+def _split_fields(data, start, end, names, separator):
+    wanted = dict.fromkeys(names)
+    for line in data[start + 2:end].split(b'\n\t'):
+        name, _, value = line.partition(separator)
+        if name in wanted:
+            wanted[name] = value
+    return [wanted[name] for name in names]
+
+
+def _open(path):
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def iter_status(kind, fields=None, path=STATUS_FILE):
+    """ Yield a record for each host or service in status.dat with only
+        fields filled in. """
+    cls = record_class(kind, fields)
+    names = [name.encode('ascii') for name in cls.fields]
+    keys = [b'\n\t' + name + b'=' for name in names]
+    block = cls.kind.encode('ascii')
+    data = _open(path)
+    if data is None:
+        return
+    try:
+        for _, start, end in iter_blocks(data, (block,)):
+            if len(keys) <= SEARCH_FIELDS:
+                raw = _search_fields(data, start, end, keys)
+            else:
+                raw = _split_fields(data, start, end, names, b'=')
+            yield cls([None if value is None else _convert(name, value)
+                       for name, value in zip(cls.fields, raw)])
+    finally:
+        data.close()
+
+
+def hostgroup_members(hostgroups, path=OBJECTS_CACHE):
+    """ The set of hosts belonging to any of hostgroups, as objects.cache
+        has them. Its fields are separated from their values by a tab. """
+    wanted = set(hostgroups)
+    members = set()
+    data = _open(path)
+    if data is None:
+        return members
+    try:
+        for _, start, end in iter_blocks(data, (b'define hostgroup',)):
+            name, hosts = _split_fields(data, start, end,
+                                        [b'hostgroup_name', b'members'],
+                                        b'\t')
+            if name is not None and _text(name.strip()) in wanted and hosts:
+                members.update(_text(host.strip())
+                               for host in hosts.split(b','))
+    finally:
+        data.close()
+    return members
+
+
+def query(kind='service', states=None, hosts=None, hostgroups=None,
+          services=None, min_age=None, fields=None, path=STATUS_FILE,
+          objects_path=OBJECTS_CACHE, now=None):
+    """ Iterate over the status records matching every given filter.
+
+        states      state names, e.g. ['CRITICAL', 'WARNING']
+        hosts       host name glob patterns
+        hostgroups  hostgroup names, resolved through objects.cache
+        services    service description glob patterns, only for services
+        min_age     seconds the host or service has been in its state
+        fields      fields to return, those filtered on are always added
+
+        Unknown kinds, states or fields and service patterns for hosts
+        raise ValueError. """
+    if kind not in RECORD_TYPES:
+        raise ValueError('Unknown status kind %r, expected %s' % (
+            kind, ' or '.join(sorted(RECORD_TYPES))))
+    if services and kind != 'service':
+        raise ValueError('Service patterns only match service status, '
+                         'not %s status' % kind)
+    fields = list(fields or ('host_name', 'current_state',
+                             'last_state_change', 'plugin_output'))
+    if kind == 'service':
+        fields.insert(1, 'service_description')
+    for needed in ('host_name', 'current_state', 'last_state_change'):
+        if needed not in fields:
+            fields.append(needed)
+    fields = tuple(sorted(set(fields), key=fields.index))
+    # unknown fields raise here rather than once iteration starts
+    record_class(kind, fields)
+    allowed = None
+    if states:
+        names = RECORD_TYPES[kind].states
+        unknown = set(state.upper() for state in states) - set(names)
+        if unknown:
+            raise ValueError('Unknown %s states: %s, expected any of %s' % (
+                kind, ', '.join(sorted(unknown)), ', '.join(names)))
+        allowed = set(names.index(state.upper()) for state in states)
+    members = hostgroup_members(hostgroups, objects_path) \
+        if hostgroups else None
+    now = now or time.time()
+    return _matching(iter_status(kind, fields, path), allowed, members,
+                     hosts, services, min_age, now)
+
+
+def _matching(records, allowed, members, hosts, services, min_age, now):
+    for record in records:
+        if allowed is not None and record.current_state not in allowed:
+            continue
+        if members is not None and record.host_name not in members:
+            continue
+        if hosts and not any(fnmatch.fnmatchcase(record.host_name, pattern)
+                             for pattern in hosts):
+            continue
+        if services and not any(
+                fnmatch.fnmatchcase(record.service_description, pattern)
+                for pattern in services):
+            continue
+        if min_age and (record.last_state_change is None or
+                        now - record.last_state_change < min_age):
+            continue
+        yield record
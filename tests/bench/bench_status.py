@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+""" Benchmark the status.dat reader against a synthetic status.dat.
+
+    Writes a status.dat of about the requested size, laid out the way
+    Nagios 3 writes it with the full set of attributes per block, and times
+    each way of reading it in a fresh process so its peak RSS can be told
+    apart:
+
+      dicts      every block parsed into a dict, as the CGIs and pynag do
+      records    status_dat.iter_status() with every known field
+      projected  status_dat.query() for the CRITICAL services, with the
+                 default four fields
+
+    Usage: bench_status.py [--megabytes 100] [--keep] [--json] """
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+HOOKS_DIR = os.path.join(os.path.dirname(os.path.dirname(BENCH_DIR)), 'hooks')
+sys.path.insert(0, HOOKS_DIR)
+
+import status_dat  # noqa: E402
+
+CASES = ('dicts', 'records', 'projected')
+SERVICES_PER_HOST = 12
+
+COMMON = '''\tmodified_attributes=0
+\tcheck_command={command}
+\tcheck_period=24x7
+\tnotification_period=24x7
+\tcheck_interval=5.000000
+\tretry_interval=1.000000
+\tevent_handler=
+\thas_been_checked=1
+\tshould_be_scheduled=1
+\tcheck_execution_time=0.0{n:02d}
+\tcheck_latency=0.1{n:02d}
+\tcheck_type=0
+\tcurrent_state={state}
+\tlast_hard_state={state}
+\tlast_event_id=0
+\tcurrent_event_id=0
+\tcurrent_problem_id=0
+\tlast_problem_id=0
+\tcurrent_attempt=1
+\tmax_attempts=3
+\tstate_type=1
+\tlast_state_change={changed}
+\tlast_hard_state_change={changed}
+\tlast_time_ok={now}
+\tlast_time_warning=0
+\tlast_time_unknown=0
+\tlast_time_critical=0
+\tplugin_output={output}
+\tlong_plugin_output=
+\tperformance_data=time=0.0{n:02d}s;5.000;10.000;0.000 size=1{n:03d}B;;;0
+\tlast_check={now}
+\tnext_check={next}
+\tcheck_options=0
+\tcurrent_notification_number=0
+\tcurrent_notification_id=0
+\tlast_notification=0
+\tnext_notification=0
+\tno_more_notifications=0
+\tnotifications_enabled=1
+\tactive_checks_enabled=1
+\tpassive_checks_enabled=1
+\tevent_handler_enabled=1
+\tproblem_has_been_acknowledged=0
+\tacknowledgement_type=0
+\tflap_detection_enabled=1
+\tfailure_prediction_enabled=1
+\tprocess_performance_data=1
+\tobsess_over_service=1
+\tlast_update={now}
+\tis_flapping=0
+\tpercent_state_change=0.00
+\tscheduled_downtime_depth=0
+\t}}
+
+'''
+
+
+def write_status(path, megabytes):
+    """ Write a status.dat of about megabytes, returning its host and
+        service counts. """
+    now = int(time.time())
+    hosts = services = 0
+    target = megabytes * 1024 * 1024
+    with open(path, 'w') as f:
+        f.write('info {\n\tcreated=%d\n\tversion=3.5.1\n\t}\n\n' % now)
+        f.write('programstatus {\n\tnagios_pid=1\n\t}\n\n')
+        while f.tell() < target:
+            host = 'juju-%s-%d' % ('nova-compute', hosts)
+            f.write('hoststatus {\n\thost_name=%s\n' % host)
+            f.write(COMMON.format(command='check-host-alive', n=hosts % 100,
+                                  state=0, changed=now - 86400, now=now,
+                                  next=now + 300,
+                                  output='PING OK - Packet loss = 0%'))
+            hosts += 1
+            for i in range(SERVICES_PER_HOST):
+                state = 2 if (hosts * SERVICES_PER_HOST + i) % 97 == 0 else 0
+                f.write('servicestatus {\n\thost_name=%s\n'
+                        '\tservice_description=%s-check_%d\n' % (
+                            host, host, i))
+                f.write(COMMON.format(
+                    command='check_nrpe!check_%d' % i, n=i, state=state,
+                    changed=now - 600 * i, now=now, next=now + 300,
+                    output='CRITICAL: it broke' if state else 'OK: fine'))
+                services += 1
+    return hosts, services
+
+
+def read_dicts(path):
+    """ The dict per block way of reading status.dat. """
+    blocks = []
+    current = None
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line.endswith('{'):
+                current = {'meta': {'type': line[:-1].strip()}}
+            elif line == '}':
+                blocks.append(current)
+                current = None
+            elif current is not None and '=' in line:
+                key, _, value = line.partition('=')
+                current[key] = value
+    return sum(1 for block in blocks
+               if block['meta']['type'] == 'servicestatus')
+
+
+def run_case(case, path):
+    if case == 'dicts':
+        return read_dicts(path)
+    if case == 'records':
+        return sum(1 for _ in status_dat.iter_status('service', path=path))
+    return sum(1 for _ in status_dat.query(states=['CRITICAL'], path=path))
+
+
+def measure(case, path):
+    """ Run a case in its own process, returning (seconds, rss, result). """
+    start = time.time()
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                             '--case', case, path], stdout=subprocess.PIPE)
+    _, status, usage = os.wait4(proc.pid, 0)
+    wall = time.time() - start
+    result = proc.stdout.read().decode().strip()
+    if status:
+        raise SystemExit('%s failed' % case)
+    return wall, usage.ru_maxrss / 1024.0, int(result)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--megabytes', type=int, default=100)
+    parser.add_argument('--keep', action='store_true',
+                        help='keep the generated status.dat')
+    parser.add_argument('--json', action='store_true',
+                        help='print results as JSON lines')
+    parser.add_argument('--case', choices=CASES, help=argparse.SUPPRESS)
+    parser.add_argument('path', nargs='?', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.case:
+        print(run_case(args.case, args.path))
+        return 0
+
+    fd, path = tempfile.mkstemp(prefix='status-', suffix='.dat')
+    os.close(fd)
+    try:
+        hosts, services = write_status(path, args.megabytes)
+        size = os.path.getsize(path) / 1024.0 / 1024
+        if not args.json:
+            print('%.0f MiB status.dat, %d hosts, %d services' % (
+                size, hosts, services))
+            print('%-10s %9s %8s %9s' % ('reader', 'wall s', 'rss MiB',
+                                         'matches'))
+        for case in CASES:
+            wall, rss, result = measure(case, path)
+            if args.json:
+                print(json.dumps({'case': case, 'wall': wall, 'rss': rss,
+                                  'matches': result, 'megabytes': size,
+                                  'services': services}, sort_keys=True))
+            else:
+                print('%-10s %9.2f %8.1f %9d' % (case, wall, rss, result))
+            sys.stdout.flush()
+    finally:
+        if args.keep:
+            print('status.dat kept at %s' % path, file=sys.stderr)
+        else:
+            os.unlink(path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
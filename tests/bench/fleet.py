@@ -0,0 +1,143 @@
+""" Synthetic fleets for the hook benchmarks.
+
+    A fleet is a set of monitored units spread over applications the way a
+    typical OpenStack deployment is: bare metal units on their own machines
+    with most services in LXD containers on top of them, each sending the
+    monitors.yaml its nrpe subordinate would, and a share of applications
+    related over the plain nagios interface instead. """
+
+import json
+import os
+import random
+
+import yaml
+
+# (application, share of the units, nrpe checks beyond the base set,
+#  remote checks) for applications related over the monitors interface
+MONITORED_APPLICATIONS = (
+    ('nova-compute', 0.30, ['check_nova-compute', 'check_libvirt-bin',
+                            'check_neutron-openvswitch-agent'], {}),
+    ('ceph-osd', 0.20, ['check_ceph-osd', 'check_smart'], {}),
+    ('rabbitmq-server', 0.05, ['check_rabbitmq', 'check_rabbitmq_queue'],
+     {'tcp': {'amqp': {'port': 5672}}}),
+    ('mysql', 0.05, ['check_mysql_proc'],
+     {'mysql': {'basic': {'user': 'monitors', 'password': 'monitors'}}}),
+    ('keystone', 0.05, ['check_apache2', 'check_haproxy',
+                        'check_haproxy_queue'],
+     {'http': {'api': {'port': 5000, 'path': '/v3/',
+                       'status': 'HTTP/1.1 200'}}}),
+    ('nova-cloud-controller', 0.05, ['check_nova-api', 'check_haproxy',
+                                     'check_nova-scheduler'],
+     {'http': {'api': {'port': 8774, 'path': '/'}}}),
+    ('neutron-gateway', 0.10, ['check_neutron-l3-agent',
+                               'check_neutron-dhcp-agent',
+                               'check_netns'], {}),
+    ('memcached', 0.05, ['check_memcached'],
+     {'tcp': {'memcache': {'port': 11211, 'string': 'stats',
+                           'expect': 'STAT'}}}),
+)
+# applications related over the nagios interface, with no monitors.yaml
+NAGIOS_APPLICATIONS = (
+    ('ubuntu', 0.10),
+    ('landscape-client', 0.05),
+)
+BASE_NRPE_CHECKS = ('check_load', 'check_disk_root', 'check_swap',
+                    'check_mem', 'check_conntrack', 'check_users',
+                    'check_zombie_procs', 'check_total_procs',
+                    'check_swap_activity', 'check_ntpmon')
+# bare metal applications, the rest go into containers on their machines
+METAL_APPLICATIONS = ('nova-compute', 'ceph-osd')
+
+
+def monitors_yaml(nrpe_checks, remote_checks):
+    remote = {'nrpe': dict((check, {'command': check})
+                           for check in nrpe_checks)}
+    remote.update(remote_checks)
+    return yaml.safe_dump({'version': '0.3', 'monitors': {'remote': remote}},
+                          default_flow_style=False)
+
+
+def _split(total, shares):
+    counts = [int(total * share) for share in shares]
+    # hand the rounding remainder to the largest share
+    counts[0] += total - sum(counts)
+    return counts
+
+
+def generate(size, seed=0):
+    """ Return {relid: {unit: settings}} for a fleet of size units. """
+    rng = random.Random(seed)
+    applications = MONITORED_APPLICATIONS + tuple(
+        (name, share, None, None) for name, share in NAGIOS_APPLICATIONS)
+    counts = _split(size, [share for _, share, _, _ in applications])
+    machines = max(1, sum(count for (name, _, _, _), count
+                          in zip(applications, counts)
+                          if name in METAL_APPLICATIONS))
+    containers = {}
+
+    relations = {}
+    for relnum, ((name, _, checks, remote), count) in enumerate(
+            zip(applications, counts), 1):
+        if not count:
+            continue
+        if checks is None:
+            relid = 'nagios:%d' % relnum
+        else:
+            relid = 'monitors:%d' % relnum
+            payload = monitors_yaml(BASE_NRPE_CHECKS + tuple(checks),
+                                    remote)
+        units = relations[relid] = {}
+        for i in range(count):
+            if name in METAL_APPLICATIONS:
+                machine = str(len(containers))
+                containers[machine] = 0
+            else:
+                host = str(rng.randrange(machines))
+                containers[host] = containers.get(host, 0) + 1
+                machine = '%s/lxd/%d' % (host, containers[host] - 1)
+            address = '10.%d.%d.%d' % (relnum, i // 250, i % 250 + 2)
+            if checks is None:
+                units['%s/%d' % (name, i)] = {
+                    'private-address': address,
+                    'ingress-address': address,
+                }
+            else:
+                units['nrpe-%s/%d' % (name, i)] = {
+                    'monitors': payload,
+                    'target-id': '%s-%d' % (name, i),
+                    'target-address': address,
+                    'machine_id': machine,
+                    'private-address': address,
+                    'ingress-address': address,
+                }
+    return relations
+
+
+def _dump(value, *path):
+    with open(os.path.join(*path), 'w') as f:
+        json.dump(value, f)
+
+
+def write_fixture(relations, config, path):
+    """ Lay a fleet and charm config out for fake-hook-tool. """
+    for subdir in ('relation-ids', 'relation-list', 'relation-get'):
+        os.makedirs(os.path.join(path, subdir))
+    _dump(config, path, 'config.json')
+    relation_ids = {}
+    for relid, units in relations.items():
+        relation_ids.setdefault(relid.split(':')[0], []).append(relid)
+        _dump(sorted(units), path, 'relation-list', relid + '.json')
+        os.mkdir(os.path.join(path, 'relation-get', relid))
+        for unit, settings in units.items():
+            _dump(settings, path, 'relation-get', relid,
+                  unit.replace('/', '_') + '.json')
+    for relname, relids in relation_ids.items():
+        _dump(sorted(relids), path, 'relation-ids', relname + '.json')
+
+
+def default_config(config_yaml):
+    """ The charm's config with every option at its default. """
+    with open(config_yaml) as f:
+        options = yaml.safe_load(f)['options']
+    return dict((name, option.get('default'))
+                for name, option in options.items())
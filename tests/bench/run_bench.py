@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+""" Offline benchmarks for the relation and upgrade-charm hooks.
+
+    Each fleet size gets a scratch directory holding a minimal /etc/nagios3
+    tree (the hooks are pointed at it with NAGIOS_CHARM_ROOT), a fixture
+    written by fleet.py, fake hook tools answering from it, and a charm
+    directory linking back to this checkout. The hooks then run as Juju
+    would run them, and for each run we report:
+
+      wall      seconds until the hook exited
+      tools     hook tool processes it spawned, children included
+      rss       peak resident set size of the hook or any child, in MiB
+      written   bytes in files created or replaced under the scratch root
+
+    The hooks need the charm's own dependencies (pynag, jinja2, yaml) and
+    run under the interpreter named by their #! lines unless --python is
+    given. Nothing outside the scratch directory is touched, apart from
+    the service and apache tools, which are faked as well.
+
+    Usage: run_bench.py [--sizes 10,100,1000] [--hooks ...] [--json] """
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import fleet
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+CHARM_SRC = os.path.dirname(os.path.dirname(BENCH_DIR))
+FAKE_TOOLS = ('relation-ids', 'relation-list', 'relation-get', 'relation-set',
+              'config-get', 'juju-log', 'status-set', 'network-get',
+              'unit-get', 'open-port', 'close-port', 'action-get',
+              'action-set', 'action-fail', 'service', 'systemctl',
+              'a2ensite', 'a2dissite', 'a2enmod', 'a2enconf', 'a2disconf',
+              'htpasswd')
+CHARM_CONTENT = ('hooks', 'actions', 'files', 'metadata.yaml',
+                 'actions.yaml', 'config.yaml', 'monitors.yaml')
+# (label, hook) pairs run in order against the same scratch tree
+SCENARIOS = (
+    ('rebuild', 'monitors-relation-changed'),
+    ('unchanged', 'monitors-relation-changed'),
+    ('upgrade', 'upgrade-charm'),
+)
+
+NAGIOS_CFG = '''log_file=/var/log/nagios3/nagios.log
+cfg_file={etc}/commands.cfg
+cfg_dir={etc}/conf.d
+resource_file={etc}/resource.cfg
+status_file=/var/cache/nagios3/status.dat
+'''
+STOCK_OBJECTS = {
+    'commands.cfg': '''define command {
+    command_name    check-host-alive
+    command_line    /usr/lib/nagios/plugins/check_ping -H '$HOSTADDRESS$' -w 5000,100% -c 5000,100% -p 1
+}
+define command {
+    command_name    notify-service-by-email
+    command_line    /usr/bin/printf "%b" "$SERVICEOUTPUT$" | /usr/bin/mail -s "$SERVICEDESC$" $CONTACTEMAIL$
+}
+''',
+    'conf.d/generic-host_nagios2.cfg': '''define host {
+    name                    generic-host
+    check_command           check-host-alive
+    max_check_attempts      10
+    register                0
+}
+''',
+    'conf.d/generic-service_nagios2.cfg': '''define service {
+    name                    generic-service
+    check_interval          5
+    retry_interval          1
+    max_check_attempts      3
+    register                0
+}
+''',
+    'conf.d/localhost_nagios2.cfg': '''define host {
+    use                     generic-host
+    host_name               localhost
+    address                 127.0.0.1
+}
+''',
+    'conf.d/timeperiods_nagios2.cfg': '''define timeperiod {
+    timeperiod_name         24x7
+    alias                   24 Hours A Day, 7 Days A Week
+    monday                  00:00-24:00
+}
+''',
+    'resource.cfg': '$USER1$=/usr/lib/nagios/plugins\n',
+}
+
+
+def make_scratch(size, overrides, workdir):
+    """ Lay out everything a benchmark run needs under workdir. """
+    root = os.path.join(workdir, 'root')
+    etc = os.path.join(root, 'etc', 'nagios3')
+    for path in (os.path.join(etc, 'conf.d'),
+                 os.path.join(root, 'etc', 'apache2', 'sites-available'),
+                 os.path.join(root, 'etc', 'apache2', 'conf-available'),
+                 os.path.join(root, 'etc', 'cron.d'),
+                 os.path.join(root, 'etc', 'ssl', 'certs'),
+                 os.path.join(root, 'etc', 'ssl', 'private'),
+                 os.path.join(root, 'var', 'lib', 'juju')):
+        os.makedirs(path)
+    with open(os.path.join(etc, 'nagios.cfg'), 'w') as f:
+        f.write(NAGIOS_CFG.format(etc=etc))
+    for name, content in STOCK_OBJECTS.items():
+        with open(os.path.join(etc, name), 'w') as f:
+            f.write(content)
+
+    config = fleet.default_config(os.path.join(CHARM_SRC, 'config.yaml'))
+    config.update(overrides)
+    fleet.write_fixture(fleet.generate(size), config,
+                        os.path.join(workdir, 'fixture'))
+
+    bin_dir = os.path.join(workdir, 'bin')
+    os.mkdir(bin_dir)
+    for tool in FAKE_TOOLS:
+        os.symlink(os.path.join(BENCH_DIR, 'fake-hook-tool'),
+                   os.path.join(bin_dir, tool))
+
+    charm = os.path.join(workdir, 'charm')
+    os.makedirs(os.path.join(charm, 'scripts'))
+    for name in CHARM_CONTENT:
+        os.symlink(os.path.join(CHARM_SRC, name), os.path.join(charm, name))
+    # upgrade-charm reconfigures the host's postfix through this
+    stub = os.path.join(charm, 'scripts', 'postfix_loopback_only.sh')
+    with open(stub, 'w') as f:
+        f.write('#!/bin/sh\n')
+    os.chmod(stub, 0o755)
+    return root
+
+
+def hook_env(workdir, hook):
+    env = dict(os.environ)
+    env.update({
+        'PATH': os.path.join(workdir, 'bin') + os.pathsep + env['PATH'],
+        'CHARM_DIR': os.path.join(workdir, 'charm'),
+        'JUJU_CHARM_DIR': os.path.join(workdir, 'charm'),
+        'JUJU_UNIT_NAME': 'nagios/0',
+        'JUJU_PRINCIPAL_UNIT': '',
+        'JUJU_HOOK_NAME': hook,
+        'JUJU_VERSION': '2.8.0',
+        'UNIT_STATE_DB': os.path.join(workdir, 'state.db'),
+        'NAGIOS_CHARM_ROOT': os.path.join(workdir, 'root'),
+        'BENCH_FIXTURE': os.path.join(workdir, 'fixture'),
+        'BENCH_CALLS': os.path.join(workdir, 'calls.log'),
+    })
+    for name in ('JUJU_RELATION_ID', 'JUJU_REMOTE_UNIT'):
+        env.pop(name, None)
+    return env
+
+
+def snapshot(root):
+    files = {}
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            st = os.lstat(path)
+            files[path] = (st.st_ino, st.st_mtime, st.st_size)
+    return files
+
+
+def run_hook(workdir, hook, python=None):
+    """ Run a hook to completion and measure it. """
+    calls = os.path.join(workdir, 'calls.log')
+    open(calls, 'w').close()
+    root = os.path.join(workdir, 'root')
+    before = snapshot(root)
+    cmd = [os.path.join('hooks', hook)]
+    if python:
+        cmd.insert(0, python)
+    with open(os.path.join(workdir, hook + '.log'), 'a') as log:
+        start = time.time()
+        proc = subprocess.Popen(cmd, cwd=os.path.join(workdir, 'charm'),
+                                env=hook_env(workdir, hook),
+                                stdout=log, stderr=subprocess.STDOUT)
+        # wait4 rather than wait, for the resource usage of the hook and
+        # every child it waited for
+        _, status, usage = os.wait4(proc.pid, 0)
+        wall = time.time() - start
+    written = sum(size for path, (ino, mtime, size)
+                  in snapshot(root).items()
+                  if before.get(path, (None, None))[:2] != (ino, mtime))
+    with open(calls) as f:
+        tools = sum(1 for _ in f)
+    return {
+        'hook': hook,
+        'status': os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1,
+        'wall': wall,
+        'tools': tools,
+        'rss': usage.ru_maxrss / 1024.0,
+        'written': written,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default='10,100,1000',
+                        help='comma separated fleet sizes, up to 20000')
+    parser.add_argument('--hooks', default=','.join(s for s, _ in SCENARIOS),
+                        help='comma separated scenarios out of %s' %
+                        ', '.join(s for s, _ in SCENARIOS))
+    parser.add_argument('--set', action='append', default=[],
+                        metavar='OPTION=JSON',
+                        help='override a charm config option')
+    parser.add_argument('--python', help='interpreter to run the hooks with')
+    parser.add_argument('--keep', action='store_true',
+                        help='keep the scratch directories')
+    parser.add_argument('--json', action='store_true',
+                        help='print results as JSON lines')
+    args = parser.parse_args(argv)
+
+    overrides = {}
+    for item in args.set:
+        name, value = item.split('=', 1)
+        overrides[name] = json.loads(value)
+    wanted = args.hooks.split(',')
+
+    if not args.json:
+        print('%7s  %-10s %9s %7s %8s %12s' % (
+            'units', 'scenario', 'wall s', 'tools', 'rss MiB', 'written'))
+    failed = False
+    for size in [int(s) for s in args.sizes.split(',')]:
+        workdir = tempfile.mkdtemp(prefix='nagios-bench-%d-' % size)
+        try:
+            make_scratch(size, overrides, workdir)
+            for label, hook in SCENARIOS:
+                if label not in wanted:
+                    continue
+                result = run_hook(workdir, hook, args.python)
+                result.update(units=size, scenario=label)
+                failed = failed or result['status'] != 0
+                if args.json:
+                    print(json.dumps(result, sort_keys=True))
+                else:
+                    print('%7d  %-10s %9.2f %7d %8.1f %12d%s' % (
+                        size, label, result['wall'], result['tools'],
+                        result['rss'], result['written'],
+                        '' if result['status'] == 0 else
+                        '  FAILED, see %s' % os.path.join(
+                            workdir, hook + '.log')))
+                sys.stdout.flush()
+        finally:
+            if args.keep or failed:
+                print('scratch directory kept at %s' % workdir,
+                      file=sys.stderr)
+            else:
+                shutil.rmtree(workdir)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,57 @@
+""" The interpreter of the hooks' #! lines, for the tests that have to run
+    the hooks, or the charm modules only it can import, under it. """
+
+import os
+import subprocess
+import sys
+import unittest
+
+HOOK_PYTHON = '/usr/bin/python'
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def hook_python_has(*modules):
+    """ Whether HOOK_PYTHON can import every one of modules. """
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.call(
+                [HOOK_PYTHON, '-c', 'import ' + ', '.join(modules)],
+                stdout=devnull, stderr=devnull) == 0
+    except OSError:
+        return False
+
+
+def importable(*modules):
+    """ Whether this interpreter can import every one of modules, trying
+        them in order and stopping at the first that fails. List six before
+        charmhelpers, which would try to apt-get install it. """
+    for module in modules:
+        try:
+            __import__(module)
+        except ImportError:
+            return False
+    return True
+
+
+def under_hook_python(test_module, *modules):
+    """ A TestCase running the tests of test_module under HOOK_PYTHON, for
+        the interpreters that cannot import modules, so that every test
+        runner covers them. It is skipped wherever the tests run directly.
+        """
+    class HookPythonTest(unittest.TestCase):
+
+        def test_under_hook_python(self):
+            if importable(*modules):
+                self.skipTest('run directly by %s' % sys.executable)
+            if not hook_python_has(*modules):
+                self.skipTest('%s needs %s' % (test_module,
+                                               ', '.join(modules)))
+            proc = subprocess.Popen(
+                [HOOK_PYTHON, '-m', 'unittest', test_module], cwd=TESTS_DIR,
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            output = proc.communicate()[0].decode('utf-8', 'replace')
+            self.assertEqual(proc.returncode, 0, output)
+
+    HookPythonTest.__module__ = test_module
+    HookPythonTest.__qualname__ = HookPythonTest.__name__
+    return HookPythonTest
@@ -0,0 +1,34 @@
+import os
+import subprocess
+import unittest
+
+CHARM_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                         '..')
+PATCH = os.path.join(CHARM_DIR, 'charm-helpers.patch')
+
+
+def have_patch():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.call(['patch', '--version'],
+                                   stdout=devnull, stderr=devnull) == 0
+    except OSError:
+        return False
+
+
+@unittest.skipUnless(have_patch(), 'needs patch')
+class CharmHelpersPatchTest(unittest.TestCase):
+    """ make sync reapplies charm-helpers.patch on a fresh charmhelpers,
+        so it has to match the changes in the tree. """
+
+    def test_patch_is_applied(self):
+        proc = subprocess.Popen(
+            ['patch', '-p1', '--reverse', '--dry-run', '--force',
+             '-i', PATCH], cwd=CHARM_DIR,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = proc.communicate()[0].decode('utf-8', 'replace')
+        self.assertEqual(proc.returncode, 0, output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'bench'))
+
+import fleet  # noqa: E402
+import run_bench  # noqa: E402
+from hook_python import HOOK_PYTHON, hook_python_has  # noqa: E402
+
+HOOK = 'monitors-relation-changed'
+SERVICE_TOOLS = ('service', 'systemctl')
+
+
+@unittest.skipUnless(hook_python_has('pynag', 'jinja2', 'yaml'),
+                     'the hooks need pynag, jinja2 and yaml under %s' %
+                     HOOK_PYTHON)
+class ConfigCommitTest(unittest.TestCase):
+    """ A relation pass commits a new config version and reloads Nagios
+        only when the config changed. """
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='nagios-commit-')
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.root = run_bench.make_scratch(10, {}, self.workdir)
+        self.main_dir = os.path.join(self.root, 'etc', 'nagios3')
+        self.versions_dir = os.path.join(self.root, 'etc',
+                                         'nagios3.versions')
+
+    def write_fixture(self, size, **overrides):
+        fixture = os.path.join(self.workdir, 'fixture')
+        with open(os.path.join(fixture, 'config.json')) as f:
+            config = json.load(f)
+        config.update(overrides)
+        shutil.rmtree(fixture)
+        fleet.write_fixture(fleet.generate(size), config, fixture)
+
+    def run_action(self, name, **params):
+        with open(os.path.join(self.workdir, 'fixture', 'action.json'),
+                  'w') as f:
+            json.dump(params, f)
+        log = os.path.join(self.workdir, name + '.log')
+        with open(log, 'a') as f:
+            status = subprocess.call(
+                [HOOK_PYTHON, os.path.join('actions', name)],
+                cwd=os.path.join(self.workdir, 'charm'),
+                env=run_bench.hook_env(self.workdir, name),
+                stdout=f, stderr=subprocess.STDOUT)
+        self.assertEqual(status, 0, 'see %s' % log)
+
+    def charm_cfg(self, tree):
+        with open(os.path.join(tree, 'conf.d', 'charm.cfg')) as f:
+            return f.read()
+
+    def versions(self):
+        return [os.path.join(self.versions_dir, name)
+                for name in sorted(os.listdir(self.versions_dir))]
+
+    def run_hook(self):
+        result = run_bench.run_hook(self.workdir, HOOK)
+        self.assertEqual(result['status'], 0, 'see %s' % os.path.join(
+            self.workdir, HOOK + '.log'))
+        with open(os.path.join(self.workdir, 'calls.log')) as f:
+            return [line.strip() for line in f]
+
+    def test_unchanged_config_is_not_committed_or_reloaded(self):
+        tools = self.run_hook()
+        self.assertTrue(set(SERVICE_TOOLS).intersection(tools))
+        versions = sorted(os.listdir(self.versions_dir))
+        live = os.readlink(self.main_dir)
+
+        tools = self.run_hook()
+        self.assertFalse(set(SERVICE_TOOLS).intersection(tools))
+        self.assertEqual(sorted(os.listdir(self.versions_dir)), versions)
+        self.assertEqual(os.readlink(self.main_dir), live)
+        self.assertFalse(os.path.exists(self.main_dir + '-inprogress'))
+
+    def test_rollback_is_regenerated_by_the_next_pass(self):
+        self.run_hook()
+        self.write_fixture(12)
+        self.run_hook()
+        migrated, first, second = self.versions()
+        self.assertEqual(os.readlink(self.main_dir), second)
+
+        self.run_action('rollback-config', steps=1)
+        self.assertEqual(os.readlink(self.main_dir), first)
+
+        # the rolled back charm.cfg no longer matches the relations, so the
+        # next pass rebuilds it in full and commits that on top
+        self.run_hook()
+        third = self.versions()[-1]
+        self.assertEqual(self.versions(), [migrated, first, second, third])
+        self.assertEqual(os.readlink(self.main_dir), third)
+        self.assertEqual(self.charm_cfg(third), self.charm_cfg(second))
+
+    def test_old_versions_are_pruned(self):
+        self.write_fixture(10, config_versions_retained=2)
+        self.run_hook()
+        for size in (11, 12, 13):
+            self.write_fixture(size, config_versions_retained=2)
+            self.run_hook()
+        versions = self.versions()
+        self.assertEqual(len(versions), 2)
+        self.assertEqual(os.readlink(self.main_dir), versions[-1])
+        self.assertIn('define host', self.charm_cfg(versions[-1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import sys
+import unittest
+
+import yaml
+
+HOOKS_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'hooks')
+sys.path.insert(0, HOOKS_DIR)
+
+from config_handlers import (
+    CONFIG_HANDLERS,
+    RUNTIME_OPTIONS,
+    changed_options,
+    handlers_to_run,
+)
+
+CONFIG_YAML = os.path.join(HOOKS_DIR, '..', 'config.yaml')
+
+
+class FakeConfig(dict):
+    def __init__(self, current, previous):
+        super(FakeConfig, self).__init__(current)
+        self.previous = previous
+
+    def changed(self, key):
+        return self.previous.get(key) != self.get(key)
+
+
+class TestConfigHandlers(unittest.TestCase):
+
+    def test_every_option_is_handled(self):
+        with open(CONFIG_YAML) as f:
+            options = set(yaml.safe_load(f)['options'])
+        handled = set(RUNTIME_OPTIONS)
+        for dependencies in CONFIG_HANDLERS.values():
+            handled.update(dependencies)
+        self.assertEqual(options - handled, set())
+        self.assertEqual(handled - options, set())
+
+    def test_unchanged_config_runs_nothing(self):
+        self.assertEqual(handlers_to_run(set()), [])
+
+    def test_debug_level_only_rerenders_nagios_cfg(self):
+        self.assertEqual(handlers_to_run({'debug_level'}), ['update_config'])
+
+    def test_shared_option_runs_handlers_in_order(self):
+        self.assertEqual(handlers_to_run({'enable_pagerduty'}),
+                         ['enable_pagerduty_config', 'update_contacts'])
+        self.assertEqual(handlers_to_run({'ro-password'}),
+                         ['update_cgi_config', 'update_passwords'])
+
+    def test_hostgroup_members_rerun_the_relation_pass(self):
+        for option in ('extraconfig', 'nagios_host_context', 'monitor_self'):
+            self.assertIn('monitors_relation', handlers_to_run({option}))
+        self.assertEqual(handlers_to_run({'extraconfig'}),
+                         ['write_extra_config', 'monitors_relation'])
+
+    def test_runtime_options_run_nothing(self):
+        self.assertEqual(handlers_to_run(RUNTIME_OPTIONS), [])
+
+    def test_full_run_runs_everything(self):
+        self.assertEqual(handlers_to_run(set(), full=True),
+                         list(CONFIG_HANDLERS))
+
+    def test_changed_options(self):
+        config = FakeConfig({'ssl': 'on', 'debug_level': 0},
+                            {'ssl': 'off', 'debug_level': 0})
+        self.assertEqual(changed_options(config), {'ssl'})
+
+
+if __name__ == '__main__':
+    unittest.main()
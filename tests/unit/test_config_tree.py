@@ -0,0 +1,192 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..',
+                                'hooks'))
+
+import config_tree  # noqa: E402
+
+# Far enough apart to sort in commit order, and after any migration
+LATER = 4102444800
+
+
+class ConfigTreeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.main = os.path.join(self.dir, 'nagios3')
+        self.staged = os.path.join(self.dir, 'nagios3-inprogress')
+        self.versions = os.path.join(self.dir, 'nagios3.versions')
+        os.makedirs(os.path.join(self.main, 'conf.d'))
+        self.write(self.main, 'nagios.cfg', 'cfg_dir=conf.d\n')
+        self.write(self.main, 'conf.d/extra.cfg', 'define host {}\n')
+        os.symlink('nagios.cfg', os.path.join(self.main, 'link.cfg'))
+
+    def write(self, root, relpath, content):
+        with open(os.path.join(root, relpath), 'w') as f:
+            f.write(content)
+
+    def read(self, root, relpath):
+        with open(os.path.join(root, relpath)) as f:
+            return f.read()
+
+    def inode(self, root, relpath):
+        return os.stat(os.path.join(root, relpath)).st_ino
+
+    def commit(self, now, **changes):
+        config_tree.link_tree(self.main, self.staged)
+        for relpath, content in changes.items():
+            config_tree.replace_file(os.path.join(self.staged, relpath),
+                                     content)
+        return config_tree.commit(self.staged, self.main, self.versions,
+                                  now)
+
+    def test_link_tree_shares_every_file(self):
+        config_tree.link_tree(self.main, self.staged)
+        for relpath in ('nagios.cfg', 'conf.d/extra.cfg'):
+            self.assertEqual(self.inode(self.staged, relpath),
+                             self.inode(self.main, relpath))
+        self.assertEqual(os.readlink(os.path.join(self.staged, 'link.cfg')),
+                         'nagios.cfg')
+
+    def test_replace_file_never_writes_through_a_link(self):
+        config_tree.link_tree(self.main, self.staged)
+        path = os.path.join(self.staged, 'nagios.cfg')
+        config_tree.replace_file(path, u'cfg_dir=conf.d\nx=1\n', 0o640)
+        self.assertEqual(self.read(self.main, 'nagios.cfg'),
+                         'cfg_dir=conf.d\n')
+        self.assertEqual(self.read(self.staged, 'nagios.cfg'),
+                         'cfg_dir=conf.d\nx=1\n')
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o640)
+        self.assertEqual(os.listdir(self.staged).count('nagios.cfg'), 1)
+
+    def test_replacing_edits_a_private_copy(self):
+        config_tree.link_tree(self.main, self.staged)
+        path = os.path.join(self.staged, 'conf.d', 'extra.cfg')
+        os.chmod(path, 0o640)
+        with config_tree.replacing(path) as copy:
+            self.assertNotEqual(copy, path)
+            with open(copy, 'a') as f:
+                f.write('define host {}\n')
+        self.assertEqual(self.read(self.main, 'conf.d/extra.cfg'),
+                         'define host {}\n')
+        self.assertEqual(self.read(self.staged, 'conf.d/extra.cfg'),
+                         'define host {}\n' * 2)
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o640)
+        self.assertEqual(sorted(os.listdir(os.path.dirname(path))),
+                         ['extra.cfg'])
+
+    def test_replacing_leaves_the_file_alone_on_failure(self):
+        path = os.path.join(self.main, 'nagios.cfg')
+        inode = os.stat(path).st_ino
+        with self.assertRaises(RuntimeError):
+            with config_tree.replacing(path) as copy:
+                with open(copy, 'w') as f:
+                    f.write('broken')
+                raise RuntimeError()
+        self.assertEqual(os.stat(path).st_ino, inode)
+        self.assertEqual(sorted(os.listdir(self.main)),
+                         ['conf.d', 'link.cfg', 'nagios.cfg'])
+
+    def test_replacing_a_missing_file(self):
+        path = os.path.join(self.main, 'htpasswd.users')
+        with config_tree.replacing(path) as copy:
+            with open(copy, 'a') as f:
+                f.write('admin:x\n')
+        self.assertEqual(self.read(self.main, 'htpasswd.users'), 'admin:x\n')
+
+    def test_changed_files(self):
+        config_tree.link_tree(self.main, self.staged)
+        self.assertEqual(config_tree.changed_files(self.staged, self.main),
+                         [])
+
+        # replaced with the same content, no longer linked to the live file
+        config_tree.replace_file(os.path.join(self.staged, 'nagios.cfg'),
+                                 'cfg_dir=conf.d\n')
+        self.assertNotEqual(self.inode(self.staged, 'nagios.cfg'),
+                            self.inode(self.main, 'nagios.cfg'))
+        self.assertEqual(config_tree.changed_files(self.staged, self.main),
+                         [])
+
+        config_tree.replace_file(os.path.join(self.staged, 'nagios.cfg'),
+                                 'cfg_dir=conf.d\nx=1\n')
+        self.write(self.staged, 'conf.d/charm.cfg', 'define host {}\n')
+        os.remove(os.path.join(self.staged, 'conf.d', 'extra.cfg'))
+        # link.cfg reads the changed nagios.cfg through the symlink
+        self.assertEqual(config_tree.changed_files(self.staged, self.main),
+                         ['conf.d/charm.cfg', 'conf.d/extra.cfg',
+                          'link.cfg', 'nagios.cfg'])
+
+    def test_first_commit_migrates_the_plain_directory(self):
+        version = self.commit(LATER, **{'nagios.cfg': 'cfg_dir=conf.d\n#\n'})
+        self.assertTrue(os.path.islink(self.main))
+        self.assertEqual(os.readlink(self.main), version)
+        self.assertFalse(os.path.exists(self.staged))
+        first, second = config_tree.versions(self.versions)
+        self.assertEqual(second, version)
+        self.assertEqual(self.read(first, 'nagios.cfg'), 'cfg_dir=conf.d\n')
+        self.assertEqual(self.read(self.main, 'nagios.cfg'),
+                         'cfg_dir=conf.d\n#\n')
+
+    def test_commits_only_cost_the_changed_files(self):
+        first = self.commit(LATER)
+        second = self.commit(LATER + 60, **{'nagios.cfg': 'changed\n'})
+        self.assertEqual(self.inode(first, 'conf.d/extra.cfg'),
+                         self.inode(second, 'conf.d/extra.cfg'))
+        self.assertNotEqual(self.inode(first, 'nagios.cfg'),
+                            self.inode(second, 'nagios.cfg'))
+        self.assertEqual(self.read(first, 'nagios.cfg'), 'cfg_dir=conf.d\n')
+        self.assertEqual(os.readlink(self.main), second)
+        self.assertFalse(os.path.lexists(self.main + '.new'))
+
+    def test_versions_sort_by_commit_time(self):
+        self.assertEqual(config_tree.versions(self.versions), [])
+        paths = [config_tree.new_version_path(self.versions, now)
+                 for now in (LATER, LATER + 0.5, LATER + 10)]
+        self.assertEqual(sorted(paths), paths)
+        self.assertEqual(len(set(paths)), 3)
+
+    def test_rollback(self):
+        self.assertRaises(ValueError, config_tree.rollback, self.main,
+                          self.versions)
+        first = self.commit(LATER, **{'nagios.cfg': '1\n'})
+        second = self.commit(LATER + 60, **{'nagios.cfg': '2\n'})
+        third = self.commit(LATER + 120, **{'nagios.cfg': '3\n'})
+        self.assertEqual(config_tree.rollback(self.main, self.versions, 2),
+                         first)
+        self.assertEqual(self.read(self.main, 'nagios.cfg'), '1\n')
+        # only the tree migrated by the first commit is older
+        self.assertRaises(ValueError, config_tree.rollback, self.main,
+                          self.versions, 2)
+        # the versions rolled back from are kept
+        self.assertIn(third, config_tree.versions(self.versions))
+        self.assertIn(second, config_tree.versions(self.versions))
+
+        # a commit on top of a rollback stages from the rolled back tree
+        fourth = self.commit(LATER + 180)
+        self.assertEqual(self.read(fourth, 'nagios.cfg'), '1\n')
+        self.assertEqual(config_tree.rollback(self.main, self.versions),
+                         third)
+
+    def test_prune_keeps_the_newest_and_the_live_tree(self):
+        committed = [self.commit(LATER + i * 60, **{'nagios.cfg': '%d\n' % i})
+                     for i in range(4)]
+        migrated = config_tree.versions(self.versions)[0]
+        config_tree.rollback(self.main, self.versions, 3)
+        config_tree.prune(self.versions, self.main, 2)
+        self.assertEqual(config_tree.versions(self.versions),
+                         committed[:1] + committed[2:])
+        self.assertFalse(os.path.exists(migrated))
+        self.assertEqual(self.read(self.main, 'nagios.cfg'), '0\n')
+
+        config_tree.prune(self.versions, self.main, 0)
+        self.assertEqual(config_tree.versions(self.versions),
+                         [committed[0], committed[3]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..',
+                                'hooks'))
+
+import debounce  # noqa: E402
+
+HOOK = 'monitors-relation-changed'
+
+
+class DecideTest(unittest.TestCase):
+
+    def run_hooks(self, times, quiet=30, max_delay=300, hook=HOOK):
+        """ Run a relation hook at each of times, returning whether each
+            rebuilt and the final state. """
+        state = None
+        due = []
+        for now in times:
+            rebuild, new_state = debounce.decide(
+                state, hook, now, quiet, max_delay, [hook, 'r:1', now])
+            due.append(rebuild)
+            state = new_state if new_state is not None else state
+        return due, state
+
+    def test_without_quiet_period_every_hook_rebuilds(self):
+        self.assertEqual(debounce.decide(None, HOOK, 100, 0, 300),
+                         (True, None))
+        self.assertEqual(debounce.decide(None, 'config-changed', 100, 30,
+                                         300), (True, None))
+
+    def test_churn_is_deferred(self):
+        due, state = self.run_hooks([100, 110, 120])
+        self.assertEqual(due, [True, False, False])
+        self.assertEqual(state['first-pending'], 110)
+        self.assertEqual(state['last-event'], 120)
+        self.assertEqual([change[2] for change in state['pending']],
+                         [110, 120])
+
+    def test_quiet_period_boundary(self):
+        self.assertEqual(self.run_hooks([100, 129])[0], [True, False])
+        self.assertEqual(self.run_hooks([100, 130])[0], [True, True])
+
+    def test_overdue_rebuild_runs_despite_churn(self):
+        times = list(range(100, 420, 20))
+        due, state = self.run_hooks(times, max_delay=300)
+        # pending since 120, overdue from 420 on
+        self.assertEqual(due, [True] + [False] * (len(times) - 1))
+        due, _ = self.run_hooks(times + [420], max_delay=300)
+        self.assertTrue(due[-1])
+
+    def test_update_status_runs_a_settled_rebuild(self):
+        _, state = self.run_hooks([100, 110])
+        self.assertEqual(debounce.decide(state, 'update-status', 139, 30,
+                                         300), (False, None))
+        self.assertEqual(debounce.decide(state, 'update-status', 140, 30,
+                                         300), (True, None))
+        self.assertEqual(debounce.decide(None, 'update-status', 1000, 30,
+                                         300), (False, None))
+
+    def test_pending_changes_are_capped(self):
+        times = [100 + i for i in range(debounce.PENDING_KEPT + 10)]
+        _, state = self.run_hooks(times, max_delay=10 ** 6)
+        self.assertEqual(len(state['pending']), debounce.PENDING_KEPT)
+        self.assertEqual(state['pending'][-1][2], times[-1])
+
+    def test_decide_leaves_the_given_state_alone(self):
+        _, state = self.run_hooks([100, 110])
+        before = dict(state, pending=list(state['pending']))
+        debounce.decide(state, HOOK, 115, 30, 300, 'x')
+        self.assertEqual(state, before)
+
+    def test_caught_up(self):
+        self.assertIsNone(debounce.caught_up(None))
+        self.assertIsNone(debounce.caught_up(debounce.initial_state()))
+        _, state = self.run_hooks([100, 110])
+        cleared = debounce.caught_up(state)
+        self.assertEqual(cleared['first-pending'], None)
+        self.assertEqual(cleared['pending'], [])
+        self.assertEqual(cleared['last-event'], 110)
+        # the next event within the quiet period is deferred again
+        self.assertFalse(debounce.decide(cleared, HOOK, 120, 30, 300)[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
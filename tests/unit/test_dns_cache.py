@@ -0,0 +1,138 @@
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..',
+                                'hooks'))
+
+import dns_cache  # noqa: E402
+
+
+class KV(dict):
+    """ The get() and set() of unitdata.kv(), keeping copies as it
+        does. """
+
+    def get(self, key, default=None):
+        value = dict.get(self, key)
+        return default if value is None else dict(value)
+
+    def set(self, key, value):
+        self[key] = dict(value)
+
+
+class Resolver(object):
+    """ A lookup function answering from a dict, None for unknown names. """
+
+    def __init__(self, addresses):
+        self.addresses = dict(addresses)
+        self.looked_up = []
+
+    def __call__(self, name):
+        self.looked_up.append(name)
+        return self.addresses.get(name)
+
+
+class ResolveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = KV()
+        self.lookup = Resolver({'web-0': '10.0.0.2', 'db-0': '10.0.0.3'})
+
+    def resolve(self, names, now, ttl=300, timeout=5, **kwargs):
+        kwargs.setdefault('lookup', self.lookup)
+        return dns_cache.resolve(self.db, names, timeout, ttl, now=now,
+                                 **kwargs)
+
+    def test_cached_until_the_ttl_expires(self):
+        addresses, stats = self.resolve(['web-0', 'db-0', 'web-0'], 1000)
+        self.assertEqual(addresses, {'web-0': '10.0.0.2', 'db-0': '10.0.0.3'})
+        self.assertEqual(stats, {'names': 2, 'looked-up': 2, 'timed-out': 0})
+        self.assertEqual(self.db[dns_cache.CACHE_PREFIX + 'web-0']['expires'],
+                         1300)
+
+        addresses, stats = self.resolve(['web-0', 'db-0'], 1299)
+        self.assertEqual(addresses['web-0'], '10.0.0.2')
+        self.assertEqual(stats['looked-up'], 0)
+        self.assertEqual(len(self.lookup.looked_up), 2)
+
+        self.lookup.addresses['web-0'] = '10.0.0.4'
+        addresses, stats = self.resolve(['web-0'], 1300)
+        self.assertEqual(addresses, {'web-0': '10.0.0.4'})
+        self.assertEqual(stats['looked-up'], 1)
+
+    def test_failures_are_cached_briefly(self):
+        addresses, _ = self.resolve(['gone-0'], 1000, ttl=3600)
+        self.assertEqual(addresses, {'gone-0': None})
+        self.assertEqual(self.resolve(['gone-0'], 1059)[1]['looked-up'], 0)
+        self.assertEqual(
+            self.resolve(['gone-0'], 1000 + dns_cache.NEGATIVE_TTL)[1]
+            ['looked-up'], 1)
+
+    def test_failures_fall_back_to_the_last_good_address(self):
+        self.resolve(['web-0'], 1000)
+        del self.lookup.addresses['web-0']
+        addresses, _ = self.resolve(['web-0'], 2000)
+        self.assertEqual(addresses, {'web-0': '10.0.0.2'})
+        record = self.db[dns_cache.CACHE_PREFIX + 'web-0']
+        self.assertIsNone(record['address'])
+        self.assertEqual(record['expires'], 2000 + dns_cache.NEGATIVE_TTL)
+
+        self.lookup.addresses['web-0'] = '10.0.0.4'
+        addresses, _ = self.resolve(['web-0'], 2000 + dns_cache.NEGATIVE_TTL)
+        self.assertEqual(addresses, {'web-0': '10.0.0.4'})
+
+    def test_lookups_run_concurrently(self):
+        names = ['web-%d' % i for i in range(4)]
+        started = []
+        all_started = threading.Event()
+
+        def lookup(name):
+            started.append(name)
+            if len(started) == len(names):
+                all_started.set()
+            # only returns before the timeout if every lookup is running
+            if all_started.wait(2):
+                return '10.0.0.1'
+
+        addresses, stats = self.resolve(names, 1000, timeout=5,
+                                        lookup=lookup, workers=4)
+        self.assertEqual(set(addresses.values()), set(['10.0.0.1']))
+        self.assertEqual(stats['timed-out'], 0)
+
+    def test_timed_out_lookups_are_not_cached(self):
+        self.resolve(['web-0'], 1000)
+        hung = threading.Event()
+        self.addCleanup(hung.set)
+
+        def lookup(name):
+            if name == 'web-0':
+                hung.wait(10)
+            return self.lookup(name)
+
+        started = time.time()
+        addresses, stats = self.resolve(['web-0', 'db-0'], 2000,
+                                        timeout=0.2, lookup=lookup)
+        self.assertLess(time.time() - started, 2)
+        self.assertEqual(stats['timed-out'], 1)
+        self.assertEqual(addresses, {'web-0': '10.0.0.2', 'db-0': '10.0.0.3'})
+        self.assertEqual(self.db[dns_cache.CACHE_PREFIX + 'web-0']['expires'],
+                         1300)
+        self.assertEqual(self.resolve(['web-0'], 2001)[1]['looked-up'], 1)
+
+    def test_deadline_grows_with_rounds_of_workers(self):
+        # two rounds of one worker, each lookup well within its timeout
+        def lookup(name):
+            time.sleep(0.3)
+            return self.lookup(name)
+
+        addresses, stats = self.resolve(['web-0', 'db-0'], 1000,
+                                        timeout=0.5, lookup=lookup,
+                                        workers=1)
+        self.assertEqual(stats['timed-out'], 0)
+        self.assertEqual(addresses, {'web-0': '10.0.0.2', 'db-0': '10.0.0.3'})
+
+
+if __name__ == '__main__':
+    unittest.main()
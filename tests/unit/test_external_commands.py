@@ -0,0 +1,203 @@
+import fcntl
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..',
+                                'hooks'))
+
+import external_commands  # noqa: E402
+from external_commands import CommandError  # noqa: E402
+
+STATUS = '''hoststatus {
+\thost_name=mysql-0
+\tcurrent_state=1
+\tproblem_has_been_acknowledged=0
+\t}
+
+hoststatus {
+\thost_name=mysql-1
+\tcurrent_state=0
+\tproblem_has_been_acknowledged=0
+\t}
+
+hoststatus {
+\thost_name=web-0
+\tcurrent_state=0
+\tproblem_has_been_acknowledged=0
+\t}
+
+servicestatus {
+\thost_name=mysql-0
+\tservice_description=check_disk
+\tcurrent_state=2
+\tproblem_has_been_acknowledged=0
+\t}
+
+servicestatus {
+\thost_name=mysql-1
+\tservice_description=check_disk
+\tcurrent_state=2
+\tproblem_has_been_acknowledged=1
+\t}
+
+servicestatus {
+\thost_name=mysql-1
+\tservice_description=check_load
+\tcurrent_state=0
+\tproblem_has_been_acknowledged=0
+\t}
+
+servicestatus {
+\thost_name=web-0
+\tservice_description=check_http
+\tcurrent_state=2
+\tproblem_has_been_acknowledged=0
+\t}
+'''
+OBJECTS = '''define hostgroup {
+\thostgroup_name\tfrontend
+\tmembers\tweb-0
+\t}
+'''
+
+
+class TestCommands(unittest.TestCase):
+
+    def test_format(self):
+        self.assertEqual(
+            external_commands.format_command('ACKNOWLEDGE_SVC_PROBLEM',
+                                             'web-0', 'check_http', 2,
+                                             'admin', 'see; ticket 1',
+                                             now=1600000000),
+            '[1600000000] ACKNOWLEDGE_SVC_PROBLEM;web-0;check_http;2;admin;'
+            'see; ticket 1\n')
+        self.assertRaises(CommandError, external_commands.format_command,
+                          'X', 'a;b', 'comment')
+        self.assertRaises(CommandError, external_commands.format_command,
+                          'X', 'a', 'two\nlines')
+
+    def test_non_ascii_arguments(self):
+        comment = u'Disk replaced \u2013 J\u00f6rg'
+        line = external_commands.format_command(
+            'ACKNOWLEDGE_SVC_PROBLEM', 'web-0', u'check_http', 2,
+            comment.encode('utf-8'), comment, now=1600000000)
+        expected = (u'[1600000000] ACKNOWLEDGE_SVC_PROBLEM;web-0;check_http;'
+                    u'2;%s;%s\n' % (comment, comment))
+        self.assertEqual(line, expected)
+        self.assertEqual(list(external_commands.batches([line])),
+                         [expected.encode('utf-8')])
+
+    def test_batches(self):
+        lines = ['[1] COMMAND;%04d\n' % i for i in range(1000)]
+        chunks = list(external_commands.batches(lines, 4096))
+        self.assertEqual(b''.join(chunks), ''.join(lines).encode('ascii'))
+        self.assertTrue(all(len(chunk) <= 4096 and chunk.endswith(b'\n')
+                            for chunk in chunks))
+        self.assertEqual(len(chunks), 5)
+        self.assertEqual(len(list(external_commands.batches(lines, 4096,
+                                                            100))), 10)
+        self.assertRaises(CommandError, list,
+                          external_commands.batches(['x' * 5000], 4096))
+
+
+class TestWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, 'nagios.cmd')
+        os.mkfifo(self.path)
+
+    def test_no_reader(self):
+        writer = external_commands.CommandWriter(self.path, slots=4096)
+        self.assertRaises(CommandError, writer.write, ['[1] X\n'])
+
+    def test_back_pressure(self):
+        """ More than a pipe's worth of commands get through a reader that
+            only drains the pipe after a pause. """
+        lines = ['[1] SCHEDULE_HOST_DOWNTIME;host-%05d;1;2;1;0;1;a;c\n' % i
+                 for i in range(5000)]
+        fd = os.open(self.path, os.O_RDONLY | os.O_NONBLOCK)
+        received = []
+
+        def read():
+            time.sleep(0.2)
+            fcntl.fcntl(fd, fcntl.F_SETFL, 0)
+            while True:
+                data = os.read(fd, 65536)
+                if not data:
+                    break
+                received.append(data)
+
+        reader = threading.Thread(target=read)
+        reader.start()
+        writer = external_commands.CommandWriter(self.path, timeout=10,
+                                                 slots=4096)
+        commands, writes = writer.write(lines)
+        reader.join()
+        os.close(fd)
+        self.assertEqual(commands, 5000)
+        self.assertEqual(b''.join(received), ''.join(lines).encode('ascii'))
+        self.assertTrue(writes < 200)
+
+
+class TestSelect(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.status = os.path.join(self.dir, 'status.dat')
+        self.objects = os.path.join(self.dir, 'objects.cache')
+        with open(self.status, 'w') as f:
+            f.write(STATUS)
+        with open(self.objects, 'w') as f:
+            f.write(OBJECTS)
+
+    def select(self, **kwargs):
+        hosts, services = external_commands.select_targets(
+            path=self.status, objects_path=self.objects, **kwargs)
+        return ([h.host_name for h in hosts],
+                ['%s/%s' % (s.host_name, s.service_description)
+                 for s in services])
+
+    def test_selectors(self):
+        self.assertEqual(self.select(applications=['mysql']), (
+            ['mysql-0', 'mysql-1'],
+            ['mysql-0/check_disk', 'mysql-1/check_disk',
+             'mysql-1/check_load']))
+        self.assertEqual(self.select(hostgroups=['frontend']),
+                         (['web-0'], ['web-0/check_http']))
+        self.assertEqual(self.select(hosts=['*'], services=['check_d*']),
+                         ([], ['mysql-0/check_disk', 'mysql-1/check_disk']))
+        self.assertRaises(CommandError, self.select, services=['check_disk'])
+
+    def test_acknowledge_only_open_problems(self):
+        hosts, services = external_commands.select_targets(
+            applications=['mysql'], path=self.status,
+            objects_path=self.objects)
+        lines = list(external_commands.acknowledge_commands(
+            hosts, services, 'admin', 'disk', now=1))
+        self.assertEqual(lines, [
+            '[1] ACKNOWLEDGE_HOST_PROBLEM;mysql-0;2;1;0;admin;disk\n',
+            '[1] ACKNOWLEDGE_SVC_PROBLEM;mysql-0;check_disk;2;1;0;admin;'
+            'disk\n'])
+
+    def test_downtime(self):
+        hosts, services = external_commands.select_targets(
+            hostgroups=['frontend'], path=self.status,
+            objects_path=self.objects)
+        self.assertEqual(list(external_commands.downtime_commands(
+            hosts, services, 100, 3600, 'admin', 'upgrade', now=1)), [
+            '[1] SCHEDULE_HOST_DOWNTIME;web-0;100;3700;1;0;3600;admin;'
+            'upgrade\n',
+            '[1] SCHEDULE_SVC_DOWNTIME;web-0;check_http;100;3700;1;0;3600;'
+            'admin;upgrade\n'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..',
+                                'hooks'))
+
+from hook_stats import percentile, summarize_hook_stats  # noqa: E402
+
+
+def hook_run(hook, total, **phases):
+    return {'hook': hook, 'started': 0, 'total': total, 'phases': phases,
+            'counts': {}}
+
+
+class PercentileTest(unittest.TestCase):
+
+    def test_nearest_rank(self):
+        values = list(range(100, 0, -1))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 90), 90)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertEqual(percentile(values, 0), 1)
+
+    def test_small_samples(self):
+        self.assertEqual(percentile([3.5], 99), 3.5)
+        self.assertEqual(percentile([1, 2], 50), 1)
+        self.assertEqual(percentile([1, 2], 51), 2)
+        self.assertEqual(percentile([4, 1, 3, 2], 75), 3)
+
+
+class SummarizeTest(unittest.TestCase):
+
+    def test_summary_by_hook_and_phase(self):
+        runs = [hook_run('config-changed', 4.0, generate=3.0, commit=0.5),
+                hook_run('config-changed', 2.0, generate=1.0),
+                hook_run('update-status', 0.1, dns=0.05)]
+        summary = summarize_hook_stats(runs)
+        self.assertEqual(sorted(summary), ['config-changed', 'update-status'])
+        self.assertEqual(sorted(summary['config-changed']),
+                         ['commit', 'generate', 'total'])
+        self.assertEqual(summary['config-changed']['total'],
+                         {'runs': 2, 'p50': 2.0, 'p90': 4.0, 'p99': 4.0,
+                          'max': 4.0})
+        # a phase only counts the runs that went through it
+        self.assertEqual(summary['config-changed']['commit']['runs'], 1)
+        self.assertEqual(summary['update-status']['dns']['p50'], 0.05)
+
+    def test_percents(self):
+        runs = [hook_run('upgrade-charm', total) for total in (1, 2, 3, 4)]
+        stats = summarize_hook_stats(runs, percents=(25, 75))
+        self.assertEqual(stats['upgrade-charm']['total'],
+                         {'runs': 4, 'p25': 1, 'p75': 3, 'max': 4})
+
+    def test_no_runs(self):
+        self.assertEqual(summarize_hook_stats([]), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,312 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..',
+                                'hooks'))
+
+from hook_python import importable, under_hook_python  # noqa: E402
+
+if importable('six'):
+    from charmhelpers.core import hookenv, unitdata  # noqa: E402
+else:
+    # charmhelpers would try to apt-get install six on import
+    hookenv = unitdata = None
+
+HookPythonTest = under_hook_python('test_hookenv', 'six', 'yaml')
+
+# Records its arguments, with the contents of a --file in place of its
+# path since hookenv removes the file once the tool has run
+FAKE_TOOL = '''#!%(python)s
+import json, os, sys
+args = sys.argv[1:]
+if '--file' in args:
+    i = args.index('--file') + 1
+    with open(args[i]) as f:
+        args[i] = f.read()
+with open(%(calls)r, 'a') as f:
+    f.write(json.dumps([os.path.basename(sys.argv[0])] + args) + '\\n')
+sys.stdout.write(%(output)r)
+'''
+
+
+@unittest.skipIf(hookenv is None, 'charmhelpers needs six')
+class HookToolTest(unittest.TestCase):
+    """ Runs hookenv against fake hook tools that record their calls. """
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.bin = os.path.join(self.dir, 'bin')
+        os.mkdir(self.bin)
+        self.calls_path = os.path.join(self.dir, 'calls')
+
+        environ = dict(os.environ)
+
+        def restore_environ():
+            os.environ.clear()
+            os.environ.update(environ)
+        self.addCleanup(restore_environ)
+        os.environ.update({
+            'PATH': self.bin + os.pathsep + os.environ.get('PATH', ''),
+            'CHARM_DIR': self.dir,
+            'UNIT_STATE_DB': os.path.join(self.dir, 'state.db'),
+            'JUJU_UNIT_NAME': 'nagios/0',
+        })
+        os.environ.pop('JUJU_CHARM_DIR', None)
+        self.reset()
+        self.addCleanup(self.reset)
+
+    def reset(self):
+        hookenv.cache.clear()
+        hookenv._cache_index.clear()
+        hookenv._cache_hits.clear()
+        hookenv._cache_misses.clear()
+        hookenv._log_buffer = None
+        del hookenv._atexit[:]
+        if unitdata._KV is not None:
+            unitdata._KV.close()
+            unitdata._KV = None
+
+    def tool(self, name, output=''):
+        path = os.path.join(self.bin, name)
+        with open(path, 'w') as f:
+            f.write(FAKE_TOOL % {'python': sys.executable,
+                                 'calls': self.calls_path,
+                                 'output': output})
+        os.chmod(path, 0o755)
+
+    def calls(self):
+        try:
+            with open(self.calls_path) as f:
+                return [json.loads(line) for line in f]
+        except IOError:
+            return []
+
+
+class ConfigTest(HookToolTest):
+
+    def setUp(self):
+        super(ConfigTest, self).setUp()
+        self.tool('config-get', json.dumps(
+            {'check_timeout': 10, 'extraconfig': '', 'nested': {'a': [1]}}))
+
+    def test_one_config_get_per_process(self):
+        self.assertEqual(hookenv.config('check_timeout'), 10)
+        self.assertEqual(hookenv.config('extraconfig'), '')
+        self.assertIsNone(hookenv.config('missing'))
+        self.assertEqual(hookenv.config()['check_timeout'], 10)
+        self.assertEqual(self.calls(),
+                         [['config-get', '--all', '--format=json']])
+
+    def test_values_are_copies_of_the_snapshot(self):
+        hookenv.config('nested')['a'].append(2)
+        hookenv.config()['nested']['a'].append(3)
+        hookenv.flush('config')
+        self.assertEqual(hookenv.config('nested'), {'a': [1]})
+        self.assertEqual(len(self.calls()), 1)
+
+    def test_full_config_tracks_changes(self):
+        config = hookenv.config()
+        self.assertIsInstance(config, hookenv.Config)
+        self.assertTrue(config.changed('check_timeout'))
+
+    def test_unparseable_output(self):
+        self.tool('config-get', 'not json')
+        self.assertIsNone(hookenv.config('check_timeout'))
+        self.assertIsNone(hookenv.config())
+
+
+class LogTest(HookToolTest):
+
+    def setUp(self):
+        super(LogTest, self).setUp()
+        self.tool('juju-log')
+
+    def test_unbuffered_messages_are_written_at_once(self):
+        hookenv.log('hello')
+        hookenv.log({'hosts': 2}, hookenv.WARNING)
+        self.assertEqual(self.calls(), [
+            ['juju-log', 'hello'],
+            ['juju-log', '-l', 'WARNING', repr({'hosts': 2})]])
+
+    def test_buffered_messages_wait_for_flush(self):
+        hookenv.buffer_log()
+        hookenv.log('one')
+        hookenv.log('debug', hookenv.DEBUG)
+        hookenv.log('two')
+        self.assertEqual(self.calls(), [])
+        hookenv.flush_log()
+        self.assertEqual(self.calls(), [['juju-log', 'one\ntwo'],
+                                        ['juju-log', '-l', 'DEBUG', 'debug']])
+        hookenv.flush_log()
+        self.assertEqual(len(self.calls()), 2)
+
+    def test_errors_flush_what_came_before(self):
+        hookenv.buffer_log()
+        hookenv.log('before')
+        hookenv.log('broken', hookenv.ERROR)
+        hookenv.log('after')
+        self.assertEqual(self.calls(), [['juju-log', 'before'],
+                                        ['juju-log', '-l', 'ERROR', 'broken']])
+        hookenv.flush_log()
+        self.assertEqual(self.calls()[-1], ['juju-log', 'after'])
+
+    def test_batches_are_bounded(self):
+        self.addCleanup(setattr, hookenv, 'LOG_BATCH_SIZE',
+                        hookenv.LOG_BATCH_SIZE)
+        hookenv.LOG_BATCH_SIZE = 10
+        hookenv.buffer_log()
+        for message in ('aaaa', 'bbbb', 'cccc'):
+            hookenv.log(message)
+        hookenv.flush_log()
+        self.assertEqual(self.calls(), [['juju-log', 'aaaa\nbbbb'],
+                                        ['juju-log', 'cccc']])
+
+
+class CacheTest(HookToolTest):
+
+    def setUp(self):
+        super(CacheTest, self).setUp()
+        self.computed = []
+
+        @hookenv.cached
+        def lookup(relid, unit=None, extra=None):
+            self.computed.append((relid, unit))
+            return {'relid': relid, 'unit': unit}
+        self.lookup = lookup
+
+    def test_hits_and_misses(self):
+        self.lookup('r:1', 'web/0')
+        self.lookup('r:1', 'web/0')
+        self.lookup('r:1', unit='web/0')
+        self.lookup('r:2')
+        self.assertEqual(self.computed, [('r:1', 'web/0'),
+                                         ('r:1', 'web/0'), ('r:2', None)])
+        stats = hookenv.cache_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 3))
+        self.assertEqual(stats['functions']['lookup'],
+                         {'hits': 1, 'misses': 3})
+
+    def test_keyword_order_does_not_matter(self):
+        self.lookup('r:1', unit='web/0', extra='x')
+        self.lookup('r:1', extra='x', unit='web/0')
+        self.assertEqual(len(self.computed), 1)
+
+    def test_flush_by_argument(self):
+        self.lookup('r:1', 'web/0')
+        self.lookup('r:1', 'web/1')
+        self.lookup('r:2', 'web/0')
+        hookenv.flush('web/1')
+        self.lookup('r:1', 'web/0')
+        self.lookup('r:2', 'web/0')
+        self.assertEqual(len(self.computed), 3)
+        self.lookup('r:1', 'web/1')
+        self.assertEqual(len(self.computed), 4)
+
+        # only whole arguments match, not parts of them
+        hookenv.flush('r:')
+        hookenv.flush('web')
+        self.lookup('r:1', 'web/0')
+        self.assertEqual(len(self.computed), 4)
+
+        hookenv.flush('r:1')
+        self.lookup('r:2', 'web/0')
+        self.assertEqual(len(self.computed), 4)
+        self.lookup('r:1', 'web/0')
+        self.assertEqual(len(self.computed), 5)
+
+    def test_flush_by_function_name(self):
+        self.lookup('r:1', 'web/0')
+        self.lookup('r:2', 'web/0')
+        hookenv.flush('lookup')
+        self.lookup('r:1', 'web/0')
+        self.lookup('r:2', 'web/0')
+        self.assertEqual(len(self.computed), 4)
+
+    def test_unhashable_arguments_are_cached(self):
+        self.lookup('r:1', extra=['a', 'b'])
+        self.lookup('r:1', extra=['a', 'b'])
+        self.assertEqual(len(self.computed), 1)
+        self.lookup('r:1', extra=['a'])
+        self.assertEqual(len(self.computed), 2)
+        hookenv.flush('r:1')
+        self.lookup('r:1', extra=['a', 'b'])
+        self.assertEqual(len(self.computed), 3)
+
+
+RELATION_SET_HELP = '''usage: relation-set [options] key=value [key=value ...]
+    --file  (= )
+        file containing key-value pairs
+'''
+
+
+class RelationSetTest(HookToolTest):
+
+    def setUp(self):
+        super(RelationSetTest, self).setUp()
+        self.tool('relation-set', RELATION_SET_HELP)
+
+    def probes(self):
+        return self.calls().count(['relation-set', '--help'])
+
+    def test_probe_is_remembered_per_juju_version(self):
+        os.environ['JUJU_VERSION'] = '2.9.42'
+        self.assertTrue(hookenv.relation_set_accepts_file())
+        self.assertTrue(hookenv.relation_set_accepts_file())
+        self.assertEqual(self.probes(), 1)
+
+        # a later hook reads it back from the kv store
+        self.reset()
+        self.assertTrue(hookenv.relation_set_accepts_file())
+        self.assertEqual(self.probes(), 1)
+
+        self.reset()
+        os.environ['JUJU_VERSION'] = '3.1.6'
+        self.assertTrue(hookenv.relation_set_accepts_file())
+        self.assertEqual(self.probes(), 2)
+
+    def test_without_juju_version_each_process_probes(self):
+        os.environ.pop('JUJU_VERSION', None)
+        self.assertTrue(hookenv.relation_set_accepts_file())
+        self.assertTrue(hookenv.relation_set_accepts_file())
+        self.assertEqual(self.probes(), 1)
+        self.reset()
+        self.assertTrue(hookenv.relation_set_accepts_file())
+        self.assertEqual(self.probes(), 2)
+
+    def test_old_relation_set_gets_arguments(self):
+        os.environ.pop('JUJU_VERSION', None)
+        self.tool('relation-set', 'usage: relation-set key=value')
+        hookenv.relation_set('r:1', {'port': 80})
+        self.assertEqual(self.calls()[-1],
+                         ['relation-set', '-r', 'r:1', 'port=80'])
+
+    def test_relation_set_many(self):
+        os.environ.pop('JUJU_VERSION', None)
+        self.addCleanup(setattr, tempfile, 'tempdir', tempfile.tempdir)
+        tempfile.tempdir = self.dir
+        hookenv.relation_set_many(['r:1', 'r:2'], {'port': 80},
+                                  hostname='web-0')
+        calls = [call for call in self.calls() if '--help' not in call]
+        self.assertEqual([call[:4] for call in calls],
+                         [['relation-set', '-r', 'r:1', '--file'],
+                          ['relation-set', '-r', 'r:2', '--file']])
+        for call in calls:
+            self.assertEqual(yaml.safe_load(call[4]),
+                             {'port': '80', 'hostname': 'web-0'})
+        # the settings file is removed afterwards
+        self.assertEqual(sorted(os.listdir(self.dir)), ['bin', 'calls'])
+        self.assertEqual(self.probes(), 1)
+
+        hookenv.relation_set_many([], {'port': 80})
+        self.assertEqual(len(self.calls()), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
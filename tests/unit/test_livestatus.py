@@ -0,0 +1,216 @@
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..',
+                                'files'))
+
+import nagios_api  # noqa: E402
+import nagios_livestatus  # noqa: E402
+
+SERVICES = [['web-0', 'check_http', 2, u'HTTP CRITICAL \u2013 503'],
+            ['db-0', 'check_disk', 0, 'DISK OK']]
+
+
+class FakeLivestatus(object):
+    """ Answers every request on a unix socket with canned rows, keeping
+        connections open as KeepAlive asks. """
+
+    def __init__(self, path):
+        self.requests = []
+        self.connections = 0
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(path)
+        self.sock.listen(5)
+        thread = threading.Thread(target=self.serve)
+        thread.daemon = True
+        thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except socket.error:
+                return
+            self.connections += 1
+            thread = threading.Thread(target=self.handle, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def handle(self, conn):
+        buf = b''
+        while True:
+            while b'\n\n' not in buf:
+                data = conn.recv(4096)
+                if not data:
+                    conn.close()
+                    return
+                buf += data
+            request, buf = buf.split(b'\n\n', 1)
+            request = request.decode('utf-8')
+            self.requests.append(request)
+            if 'GET nosuchtable' in request:
+                status, body = 404, 'Invalid GET request'
+            elif 'Stats:' in request:
+                status, body = 200, json.dumps([[1, 0, 1, 0]])
+            else:
+                # one row per line, as livestatus writes them
+                status, body = 200, '[' + ',\n'.join(
+                    json.dumps(row) for row in SERVICES) + ']\n'
+            body = body.encode('utf-8')
+            conn.sendall(('%3d %11d\n' % (status, len(body))).encode('ascii') +
+                         body)
+
+    def close(self):
+        self.sock.close()
+
+
+class LivestatusTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, 'live')
+        self.server = FakeLivestatus(self.path)
+        self.addCleanup(self.server.close)
+        self.client = nagios_livestatus.LivestatusClient(self.path)
+        self.addCleanup(self.client.close)
+
+
+class TestClient(LivestatusTestCase):
+
+    def test_query_projects_columns(self):
+        rows = list(self.client.query(
+            'services', ['host_name', 'description', 'state',
+                         'plugin_output'], ['state = 2']))
+        self.assertEqual(rows[0], {'host_name': 'web-0',
+                                   'description': 'check_http', 'state': 2,
+                                   'plugin_output': SERVICES[0][3]})
+        request = self.server.requests[0]
+        self.assertIn('Columns: host_name description state plugin_output\n',
+                      request)
+        self.assertIn('Filter: state = 2\n', request)
+        self.assertIn('KeepAlive: on', request)
+
+    def test_connection_is_reused(self):
+        for _ in range(3):
+            list(self.client.query('services', ['host_name']))
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_abandoned_response_is_not_reused(self):
+        rows = self.client.query('services', ['host_name'])
+        next(rows)
+        rows.close()
+        list(self.client.query('services', ['host_name']))
+        self.assertEqual(self.server.connections, 2)
+
+    def test_batch(self):
+        services, summary = self.client.batch([
+            nagios_livestatus.Query('services', ['host_name']),
+            nagios_livestatus.Query('services', stats=['state = 0',
+                                                       'state = 1']),
+        ])
+        self.assertEqual([row['host_name'] for row in services],
+                         ['web-0', 'db-0'])
+        self.assertEqual(summary, [{'stats_0': 1, 'stats_1': 0}])
+        self.assertEqual(self.server.connections, 1)
+
+    def test_error(self):
+        self.assertRaises(nagios_livestatus.LivestatusError, list,
+                          self.client.query('nosuchtable'))
+
+    def test_decoder_handles_split_characters(self):
+        body = json.dumps(SERVICES).encode('utf-8')
+        decoder = nagios_livestatus.RowDecoder()
+        rows = []
+        for i in range(len(body)):
+            rows.extend(decoder.feed(body[i:i + 1]))
+        decoder.close()
+        self.assertEqual(rows, SERVICES)
+
+
+class TestAPI(LivestatusTestCase):
+
+    def get(self, path, query=''):
+        response = {}
+
+        def start_response(status, headers):
+            response['status'] = status
+            response['headers'] = dict(headers)
+
+        body = b''.join(nagios_api.application({
+            'PATH_INFO': path, 'QUERY_STRING': query,
+            'LIVESTATUS_PATH': self.path, 'NAGIOS_API_TTL': '60',
+        }, start_response))
+        return response['status'], json.loads(body.decode('utf-8'))
+
+    def setUp(self):
+        super(TestAPI, self).setUp()
+        nagios_api._cache.clear()
+        nagios_api._refreshing.clear()
+
+    def test_services_are_cached(self):
+        status, body = self.get('/services', 'state=critical,warning')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(body[0]['host_name'], 'web-0')
+        self.assertIn('Filter: state = 2\nFilter: state = 1\nOr: 2\n',
+                      self.server.requests[0])
+        self.assertEqual(self.get('/services', 'state=critical,warning')[1],
+                         body)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_concurrent_misses_query_once(self):
+        go = threading.Event()
+        computed = []
+        bodies = []
+
+        def compute():
+            computed.append(1)
+            # long enough for every other thread to miss the cache too
+            time.sleep(0.2)
+            return b'[]'
+
+        def request():
+            go.wait()
+            bodies.append(nagios_api.cached('/services', 60, compute))
+
+        threads = [threading.Thread(target=request) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        go.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(bodies, [b'[]'] * 8)
+        self.assertEqual(len(computed), 1)
+
+    def test_failed_refresh_is_retried(self):
+        def fail():
+            raise nagios_livestatus.LivestatusError('down')
+
+        self.assertRaises(nagios_livestatus.LivestatusError,
+                          nagios_api.cached, '/hosts', 60, fail)
+        self.assertEqual(nagios_api.cached('/hosts', 60, lambda: b'[]'),
+                         b'[]')
+
+    def test_summary(self):
+        status, body = self.get('/summary')
+        self.assertEqual(body['services'], {'ok': 1, 'warning': 0,
+                                            'critical': 1, 'unknown': 0})
+
+    def test_bad_requests(self):
+        self.assertEqual(self.get('/services', 'state=broken')[0],
+                         '400 Bad Request')
+        self.assertEqual(self.get('/services', 'columns=host_name,x-y')[0],
+                         '400 Bad Request')
+        self.assertEqual(self.get('/nothing')[0], '404 Not Found')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,241 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..',
+                                'hooks'))
+
+import nagios_objects  # noqa: E402
+
+CHARM_CFG = '''# written by pynag
+define service {
+	 host_name                      web-0
+	 service_description            web-0-http
+	 use                            generic-service
+	 check_command                  check_http
+}
+
+define host {
+	 host_name                      web-0
+	 address                        10.0.0.2
+	 use                            generic-host
+}
+
+define command {
+	 command_name                   check_http
+	 command_line                   /usr/lib/nagios/plugins/check_http -H $HOSTADDRESS$
+}
+
+define host {
+	 host_name                      db-0
+	 address                        10.0.0.3
+}
+
+define timeperiod {
+	 timeperiod_name                24x7
+}
+'''
+
+
+class CharmConfigTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, 'charm.cfg')
+        with open(self.path, 'w') as f:
+            f.write(CHARM_CFG)
+
+    def loaded(self):
+        charm_config = nagios_objects.CharmConfig(self.path)
+        charm_config.load()
+        return charm_config
+
+    def test_load(self):
+        charm_config = self.loaded()
+        self.assertEqual(sorted(charm_config.hosts), ['db-0', 'web-0'])
+        self.assertEqual(list(charm_config.services), [('web-0', 'web-0-http')])
+        self.assertEqual(charm_config.hosts['web-0']['address'], '10.0.0.2')
+        self.assertEqual(
+            charm_config.commands['check_http']['command_line'],
+            '/usr/lib/nagios/plugins/check_http -H $HOSTADDRESS$')
+        # only the object types the charm generates are kept
+        self.assertEqual(len(charm_config), 4)
+
+    def attributes(self, charm_config):
+        return dict(((object_type, key), list(obj.attributes.items()))
+                    for object_type, objects in charm_config.objects.items()
+                    for key, obj in objects.items())
+
+    def test_write_is_sorted_and_round_trips(self):
+        before = self.loaded()
+        self.assertTrue(before.write())
+        with open(self.path) as f:
+            written = f.read()
+        names = [line.split()[1] for line in written.splitlines()
+                 if line.split()[:1] in (['host_name'], ['command_name'])]
+        self.assertEqual(names, ['check_http', 'db-0', 'web-0', 'web-0'])
+        self.assertLess(written.index('define command'),
+                        written.index('define host'))
+        self.assertLess(written.index('define host'),
+                        written.index('define service'))
+
+        reloaded = self.loaded()
+        self.assertEqual(self.attributes(reloaded), self.attributes(before))
+        other = os.path.join(self.dir, 'other.cfg')
+        reloaded.write(other)
+        with open(other) as f:
+            self.assertEqual(f.read(), written)
+
+    def test_unchanged_file_is_left_alone(self):
+        charm_config = self.loaded()
+        charm_config.write()
+        inode = os.stat(self.path).st_ino
+        self.assertFalse(charm_config.write())
+        self.assertEqual(os.stat(self.path).st_ino, inode)
+        self.assertEqual(os.listdir(self.dir), ['charm.cfg'])
+
+        charm_config.hosts['db-0'].set_attribute('address', '10.0.0.4')
+        self.assertTrue(charm_config.write())
+        self.assertEqual(self.loaded().hosts['db-0']['address'], '10.0.0.4')
+
+
+class Parsed(object):
+    """ The objects.all of one pynag Model class. """
+
+    def __init__(self, *objects):
+        self.all = list(objects)
+
+
+class Model(object):
+    """ Stands in for a parsed pynag Model, whose objects are looked up by
+        field like dicts. """
+
+    def __init__(self, hosts=(), services=(), commands=(), hostgroups=()):
+        self.Host = type('Host', (), {'objects': Parsed(*hosts)})
+        self.Service = type('Service', (), {'objects': Parsed(*services)})
+        self.Command = type('Command', (), {'objects': Parsed(*commands)})
+        self.Hostgroup = type('Hostgroup', (),
+                              {'objects': Parsed(*hostgroups)})
+
+
+class ObjectIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.hand_written = {'host_name': 'web-0', 'address': '10.0.0.1'}
+        self.template = {'name': 'generic-host', 'host_name': None}
+        model = Model(hosts=[self.hand_written, self.template,
+                             {'host_name': 'web-0', 'address': 'dup'}],
+                      services=[{'host_name': 'web-0',
+                                 'service_description': 'SSH'}],
+                      commands=[{'command_name': 'check_ssh'}])
+        self.charm_config = nagios_objects.CharmConfig('charm.cfg')
+        self.charm_config.new('host', host_name='db-0').save()
+        self.index = nagios_objects.ObjectIndex.build(model,
+                                                      self.charm_config)
+
+    def test_build(self):
+        self.assertIs(self.charm_config.index, self.index)
+        self.assertEqual(sorted(self.index.hosts), ['db-0', 'web-0'])
+        # pynag keeps the first of duplicate definitions
+        self.assertIs(self.index.get('host', 'web-0'), self.hand_written)
+        self.assertEqual(list(self.index.services), [('web-0', 'SSH')])
+        self.assertEqual(list(self.index.commands), ['check_ssh'])
+        self.assertIsNone(self.index.get('hostgroup', 'web'))
+
+    def test_follows_the_charm_config(self):
+        host = self.charm_config.new('host', host_name='db-1')
+        self.assertIsNone(self.index.get('host', 'db-1'))
+        host.save()
+        self.assertIs(self.index.get('host', 'db-1'), host)
+        service = self.charm_config.new('service', host_name='db-1',
+                                        service_description='mysql')
+        service.save()
+        self.assertIs(self.index.get('service', ('db-1', 'mysql')), service)
+
+        host.delete()
+        service.delete()
+        self.assertIsNone(self.index.get('host', 'db-1'))
+        self.assertIsNone(self.index.get('service', ('db-1', 'mysql')))
+        self.assertEqual(sorted(self.index.hosts), sorted(
+            set(self.charm_config.hosts) | set(['web-0'])))
+
+    def test_removing_a_shadowed_object_keeps_the_indexed_one(self):
+        shadow = self.charm_config.new('host', host_name='web-0')
+        shadow.save()
+        self.assertIs(self.index.get('host', 'web-0'), self.hand_written)
+        shadow.delete()
+        self.assertIs(self.index.get('host', 'web-0'), self.hand_written)
+
+        self.index.remove(self.hand_written, 'host')
+        self.assertIsNone(self.index.get('host', 'web-0'))
+
+
+class CommandRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.charm_config = nagios_objects.CharmConfig('charm.cfg')
+        model = Model(commands=[{
+            'command_name': 'check_nrpe',
+            'command_line': '/usr/lib/nagios/plugins/check_nrpe  -H '
+                            '$HOSTADDRESS$ -c $ARG1$'}])
+        index = nagios_objects.ObjectIndex.build(model, self.charm_config)
+        self.registry = nagios_objects.CommandRegistry(index)
+
+    def test_known_and_identical_lines_are_deduplicated(self):
+        self.assertEqual(self.registry.intern(
+            'check_nrpe', '/usr/lib/nagios/plugins/check_nrpe -H '
+            '$HOSTADDRESS$  -c $ARG1$'), 'check_nrpe')
+        line = '/usr/lib/nagios/plugins/check_tcp -H $HOSTADDRESS$ -p 80'
+        self.assertEqual(self.registry.intern('check_tcp_80', line),
+                         'check_tcp_80')
+        self.assertEqual(self.registry.intern('check_tcp_80', line + ' '),
+                         'check_tcp_80')
+        self.assertEqual(self.registry.collisions, [])
+        self.assertEqual(self.registry.flush(self.charm_config), 1)
+        self.assertEqual(list(self.charm_config.commands), ['check_tcp_80'])
+        self.assertEqual(self.registry.flush(self.charm_config), 0)
+
+    def test_quoted_whitespace_is_significant(self):
+        line = '/usr/lib/nagios/plugins/check_http -H $HOSTADDRESS$ -s "a  b"'
+        self.assertEqual(self.registry.intern('check_http_s', line),
+                         'check_http_s')
+        self.assertEqual(self.registry.intern('check_http_s',
+                                              line.replace(' -s', '   -s')),
+                         'check_http_s')
+        self.assertEqual(self.registry.intern(
+            'check_http_u', line.replace('a  b', u'\u2013  b')),
+            'check_http_u')
+        other = self.registry.intern('check_http_s', line.replace('a  b',
+                                                                  'a b'))
+        self.assertNotEqual(other, 'check_http_s')
+        self.registry.flush(self.charm_config)
+        self.assertEqual(
+            self.charm_config.commands['check_http_s']['command_line'], line)
+
+    def test_collisions_get_a_stable_suffix(self):
+        line = '/usr/lib/nagios/plugins/check_nrpe -H $HOSTADDRESS$ -t 30'
+        name = self.registry.intern('check_nrpe', line)
+        self.assertTrue(name.startswith('check_nrpe_'))
+        self.assertEqual(len(name), len('check_nrpe_') + 8)
+        self.assertEqual(self.registry.collisions, [('check_nrpe', name)])
+
+        # the same line gets the same name, now and in a later hook
+        self.assertEqual(self.registry.intern('check_nrpe', line), name)
+        self.assertEqual(len(self.registry.collisions), 1)
+        self.registry.flush(self.charm_config)
+        later = nagios_objects.CommandRegistry(self.charm_config.index)
+        self.assertEqual(later.intern('check_nrpe', line), name)
+        self.assertEqual(later.collisions, [])
+        self.assertEqual(later.flush(self.charm_config), 0)
+
+        other = self.registry.intern('check_nrpe', line + ' -u')
+        self.assertNotIn(other, ('check_nrpe', name))
+        self.assertEqual(
+            self.charm_config.commands[name]['command_line'], line)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..',
+                                'files'))
+
+import pagerduty_dispatcher  # noqa: E402
+import pagerduty_enqueue  # noqa: E402
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs
+
+
+class StandIn(ThreadingMixIn, HTTPServer):
+    """ Stands in for the PagerDuty events API, answering with the queued
+        statuses and then 200. """
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), Handler)
+        self.events = []
+        self.connections = set()
+        self.statuses = []
+        self.lock = threading.Lock()
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/nagios/2010-04-15/create_event' % (
+            self.server_address[1])
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        server = self.server
+        with server.lock:
+            server.connections.add(self.client_address)
+            status = server.statuses.pop(0) if server.statuses else 200
+            if status == 200:
+                server.events.append(dict(
+                    (key, values[0]) for key, values in
+                    parse_qs(body.decode('utf-8')).items()))
+        reply = b'{"status": "ok"}' if status == 200 else b'Bad event'
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestPagerDuty(unittest.TestCase):
+
+    def setUp(self):
+        self.queue_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.queue_dir)
+        self.server = StandIn()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def enqueue(self, host, service, kind='PROBLEM', pid=None):
+        environ = {'NAGIOS_HOSTNAME': host, 'NAGIOS_SERVICEDESC': service,
+                   'PATH': '/usr/bin'}
+        pagerduty_enqueue.main(['-q', self.queue_dir, '-f',
+                                'pd_nagios_object=service', '-f',
+                                'NOTIFICATIONTYPE=%s' % kind], environ)
+
+    def dispatcher(self, workers=2, serve=False):
+        dispatcher = pagerduty_dispatcher.Dispatcher(
+            self.queue_dir, self.server.url, workers, retry_delay=0.01)
+        if serve:
+            thread = threading.Thread(target=dispatcher.serve)
+            thread.start()
+            self.addCleanup(thread.join)
+        else:
+            dispatcher.start()
+        self.addCleanup(dispatcher.stop)
+        return dispatcher
+
+    def wait_for(self, condition, timeout=10):
+        deadline = time.time() + timeout
+        while not condition():
+            if time.time() > deadline:
+                self.fail('Timed out')
+            time.sleep(0.01)
+
+    def queued(self):
+        return pagerduty_dispatcher.queued_files(self.queue_dir)
+
+    def test_enqueue(self):
+        self.enqueue('web-0', 'check_http')
+        names = os.listdir(self.queue_dir)
+        self.assertEqual(len(names), 1)
+        event = pagerduty_dispatcher.read_event(
+            os.path.join(self.queue_dir, names[0]))
+        self.assertEqual(event, {b'HOSTNAME': b'web-0',
+                                 b'SERVICEDESC': b'check_http',
+                                 b'NOTIFICATIONTYPE': b'PROBLEM',
+                                 b'pd_nagios_object': b'service',
+                                 b'pd_version': b'1.0'})
+
+    def test_sends_over_kept_alive_connections(self):
+        for i in range(30):
+            self.enqueue('host-%d' % i, 'check_disk')
+        dispatcher = self.dispatcher(workers=3)
+        dispatcher.scan()
+        self.wait_for(dispatcher.idle)
+        self.assertEqual(self.queued(), [])
+        self.assertEqual(len(self.server.events), 30)
+        self.assertTrue(len(self.server.connections) <= 3)
+
+    def test_retries_and_rejections(self):
+        self.server.statuses = [503, 500, 200, 400]
+        self.enqueue('web-0', 'check_http')
+        self.enqueue('web-0', 'check_http', 'RECOVERY')
+        dispatcher = self.dispatcher()
+        dispatcher.scan()
+        self.wait_for(dispatcher.idle)
+        self.assertEqual(self.queued(), [])
+        # retried twice and delivered, then the recovery was rejected
+        self.assertEqual([e['NOTIFICATIONTYPE'] for e in self.server.events],
+                         ['PROBLEM'])
+
+    def test_watches_queue(self):
+        dispatcher = self.dispatcher(serve=True)
+        time.sleep(0.1)
+        for kind in ('PROBLEM', 'ACKNOWLEDGEMENT', 'RECOVERY'):
+            self.enqueue('web-0', 'check_http', kind)
+        self.wait_for(lambda: len(self.server.events) == 3)
+        self.wait_for(dispatcher.idle)
+        self.assertEqual([e['NOTIFICATIONTYPE'] for e in self.server.events],
+                         ['PROBLEM', 'ACKNOWLEDGEMENT', 'RECOVERY'])
+        self.assertEqual(self.queued(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import fcntl
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..',
+                                'files'))
+
+import nagios_perfdata_exporter as exporter  # noqa: E402
+
+SPOOL = (
+    "1600000000\tweb-0\tcheck_http\ttime=0.012s;5;10;0 size=1024B;;;0\n"
+    "1600000000\tweb-0\t\trta=2.5ms;100;500;0 pl=0%;20;60;0\n"
+    "1600000001\tdb-0\tcheck_disk_root\t'/ used'=2GB;8;9;0;10\n"
+    "garbage line\n"
+)
+
+
+class TestPerfdataParsing(unittest.TestCase):
+
+    def test_units_are_normalised(self):
+        self.assertEqual(
+            list(exporter.parse_perfdata('rta=2.5ms;100;500;0')),
+            [('rta', '_seconds', 0.0025, 0.1, 0.5)])
+        self.assertEqual(
+            list(exporter.parse_perfdata("'/ used'=2GB;8;9;0;10")),
+            [('/ used', '_bytes', 2.0 * 1024 ** 3, 8.0 * 1024 ** 3,
+              9.0 * 1024 ** 3)])
+
+    def test_ranges_and_missing_thresholds(self):
+        self.assertEqual(list(exporter.parse_perfdata('users=3;5:10')),
+                         [('users', '', 3.0, None, None)])
+
+    def test_malformed_metrics_are_skipped(self):
+        self.assertEqual(
+            list(exporter.parse_perfdata('load=U ok=1c')),
+            [('ok', '_total', 1.0, None, None)])
+
+
+class TestPerfdataProcessing(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def spool(self, content):
+        path = os.path.join(self.dir, 'service-perfdata')
+        with open(path, 'w') as f:
+            f.write(content)
+        exporter.rotate(path)
+
+    def metrics(self):
+        with open(os.path.join(self.dir, exporter.METRICS_FILE)) as f:
+            return f.read()
+
+    def test_spool_becomes_metrics(self):
+        self.spool(SPOOL)
+        self.assertEqual(exporter.process(self.dir, self.dir,
+                                          now=1600000010), 3)
+        metrics = self.metrics()
+        self.assertIn('# TYPE nagios_perfdata_seconds gauge\n', metrics)
+        self.assertIn('nagios_perfdata_seconds{host="web-0",'
+                      'service="check_http",label="time"} 0.012 '
+                      '1600000000000\n', metrics)
+        self.assertIn('nagios_perfdata_bytes_critical{host="db-0",'
+                      'service="check_disk_root",label="/ used"} '
+                      '9663676416.0 1600000001000\n', metrics)
+        self.assertEqual(
+            [name for name in os.listdir(self.dir) if '-perfdata' in name],
+            [])
+
+    def test_later_runs_keep_and_update_values(self):
+        self.spool(SPOOL)
+        exporter.process(self.dir, self.dir, now=1600000010)
+        self.spool("1600000020\tweb-0\tcheck_http\ttime=0.5s\n")
+        self.assertEqual(exporter.process(self.dir, self.dir,
+                                          now=1600000030), 1)
+        metrics = self.metrics()
+        self.assertIn('label="time"} 0.5 1600000020000\n', metrics)
+        self.assertIn('label="/ used"}', metrics)
+
+    def test_stale_values_expire(self):
+        self.spool(SPOOL)
+        exporter.process(self.dir, self.dir, max_age=60, now=1600000100)
+        self.assertEqual(self.metrics(), '')
+
+    def test_nothing_new_writes_nothing(self):
+        self.spool(SPOOL)
+        exporter.process(self.dir, self.dir, now=1600000010)
+        state = os.path.join(self.dir, exporter.STATE_FILE)
+        inode = os.stat(state).st_ino
+        self.assertEqual(exporter.process(self.dir, self.dir,
+                                          now=1600000020), 0)
+        self.assertEqual(os.stat(state).st_ino, inode)
+
+    def test_busy_run_leaves_the_spool_to_the_lock_holder(self):
+        self.spool(SPOOL)
+        with open(os.path.join(self.dir, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.assertIsNone(exporter.process(self.dir, self.dir))
+        self.assertEqual(len([name for name in os.listdir(self.dir)
+                              if '-perfdata.' in name]), 1)
+        self.assertEqual(exporter.process(self.dir, self.dir,
+                                          now=1600000010), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'bench'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..',
+                                'files'))
+
+import fleet  # noqa: E402
+import run_bench  # noqa: E402
+from hook_python import HOOK_PYTHON, hook_python_has  # noqa: E402
+from nagios_perfdata_exporter import METRICS_FILE  # noqa: E402
+
+RELID = 'perfdata:30'
+SCRAPER = 'prometheus/0'
+SCRAPER_ADDRESS = '10.30.0.7'
+
+
+@unittest.skipUnless(hook_python_has('pynag', 'jinja2', 'yaml'),
+                     'the hooks need pynag, jinja2 and yaml under %s' %
+                     HOOK_PYTHON)
+class PerfdataRelationTest(unittest.TestCase):
+    """ What the perfdata relation advertises must be scrapable by the
+        related units, with nothing but the advertised address, port and
+        path. """
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='nagios-perfdata-')
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.root = run_bench.make_scratch(2, {'enable_perfdata': True},
+                                           self.workdir)
+        self.fixture = os.path.join(self.workdir, 'fixture')
+        with open(os.path.join(self.fixture, 'config.json')) as f:
+            self.config = json.load(f)
+
+    def relate(self, units):
+        relations = fleet.generate(2)
+        relations[RELID] = dict(
+            (unit, {'private-address': address, 'ingress-address': address})
+            for unit, address in units.items())
+        shutil.rmtree(self.fixture)
+        fleet.write_fixture(relations, self.config, self.fixture)
+
+    def run_hook(self, hook):
+        env = run_bench.hook_env(self.workdir, hook)
+        env.update(JUJU_RELATION_ID=RELID, JUJU_REMOTE_UNIT=SCRAPER)
+        log = os.path.join(self.workdir, hook + '.log')
+        with open(log, 'a') as f:
+            status = subprocess.call(
+                [HOOK_PYTHON, os.path.join('hooks', hook)],
+                cwd=os.path.join(self.workdir, 'charm'), env=env,
+                stdout=f, stderr=subprocess.STDOUT)
+        self.assertEqual(status, 0, 'see %s' % log)
+
+    def advertised(self):
+        with open(os.path.join(self.fixture, 'relation-set',
+                               RELID + '.json')) as f:
+            return json.load(f)
+
+    def apache_conf(self):
+        """ The path the conf serves each URL prefix from, and the Require
+            lines of each directory. """
+        path = os.path.join(self.root, 'etc', 'apache2', 'conf-available',
+                            'nagios-metrics.conf')
+        with open(path) as f:
+            conf = f.read()
+        self.assertNotIn('Auth', conf)
+        aliases = dict(re.findall(r'^Alias (\S+) (\S+)$', conf, re.M))
+        requires = dict(
+            (directory, [line.split()[1:] for line in body.splitlines()
+                         if line.strip().startswith('Require')])
+            for directory, body in re.findall(
+                r'^<Directory (\S+)>$(.*?)^</Directory>$', conf,
+                re.M | re.S))
+        return aliases, requires
+
+    def allowed(self, path, address):
+        """ The file Apache serves path from to address, None if it refuses
+            it. """
+        aliases, requires = self.apache_conf()
+        for url_dir, directory in aliases.items():
+            if path.startswith(url_dir + '/'):
+                rules = requires[directory]
+                if ['all', 'granted'] in rules or \
+                        any(rule[0] == 'ip' and address in rule[1:]
+                            for rule in rules):
+                    return os.path.join(directory, path[len(url_dir) + 1:])
+        return None
+
+    def test_advertised_endpoint_is_scrapable(self):
+        self.relate({SCRAPER: SCRAPER_ADDRESS})
+        self.run_hook('perfdata-relation-joined')
+        advertised = self.advertised()
+        self.assertEqual(advertised['hostname'], '10.0.0.1')
+        self.assertEqual(advertised['port'], '80')
+        self.assertEqual(
+            self.allowed(advertised['metrics_path'], SCRAPER_ADDRESS),
+            os.path.join(self.root, 'var', 'lib', 'nagios3', 'metrics',
+                         METRICS_FILE))
+        self.assertIsNone(self.allowed(advertised['metrics_path'],
+                                       '10.99.0.1'))
+
+    def test_departed_scrapers_lose_access(self):
+        self.relate({SCRAPER: SCRAPER_ADDRESS, 'prometheus/1': '10.30.0.8'})
+        self.run_hook('perfdata-relation-joined')
+        path = self.advertised()['metrics_path']
+        self.assertTrue(self.allowed(path, '10.30.0.8'))
+
+        self.relate({SCRAPER: SCRAPER_ADDRESS})
+        self.run_hook('perfdata-relation-departed')
+        self.assertTrue(self.allowed(path, SCRAPER_ADDRESS))
+        self.assertIsNone(self.allowed(path, '10.30.0.8'))
+
+
+if __name__ == '__main__':
+    unittest.main()
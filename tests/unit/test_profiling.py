@@ -0,0 +1,105 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..',
+                                'hooks'))
+
+from hook_python import importable, under_hook_python  # noqa: E402
+
+if importable('six', 'yaml'):
+    import profiling  # noqa: E402
+else:
+    # charmhelpers would try to apt-get install six on import
+    profiling = None
+
+HookPythonTest = under_hook_python('test_profiling', 'six', 'yaml')
+
+
+@unittest.skipIf(profiling is None, 'charmhelpers needs six and yaml')
+class ReportsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.charm_dir = os.path.join(self.dir, 'charm')
+        os.mkdir(self.charm_dir)
+        os.environ['CHARM_DIR'] = self.charm_dir
+        self.addCleanup(os.environ.pop, 'CHARM_DIR')
+        self.reports = os.path.join(self.dir, 'state',
+                                    profiling.PROFILE_DIR_NAME)
+
+    def record(self, name, *sizes):
+        if not os.path.isdir(self.reports):
+            os.makedirs(self.reports)
+        for suffix, size in zip(('.txt', '.pstats'), sizes):
+            with open(os.path.join(self.reports, name + suffix), 'w') as f:
+                f.write('x' * size)
+
+    def names(self):
+        return [report['name'] for report in profiling.list_reports()]
+
+    def test_reports_are_kept_outside_the_charm(self):
+        self.assertEqual(profiling.profile_dir(), self.reports)
+
+    def test_list_reports_newest_first(self):
+        self.assertEqual(profiling.list_reports(), [])
+        self.record('20240101T000000.000-install', 10, 100)
+        self.record('20240102T000000.000-config-changed', 20)
+        newest, oldest = profiling.list_reports()
+        self.assertEqual(newest, {
+            'name': '20240102T000000.000-config-changed',
+            'files': [os.path.join(self.reports,
+                                   '20240102T000000.000-config-changed.txt')],
+            'size': 20})
+        self.assertEqual(oldest['name'], '20240101T000000.000-install')
+        self.assertEqual(sorted(oldest['files']), [
+            os.path.join(self.reports, '20240101T000000.000-install.pstats'),
+            os.path.join(self.reports, '20240101T000000.000-install.txt')])
+        self.assertEqual(oldest['size'], 110)
+
+    def test_prune_to_count(self):
+        for day in range(1, 5):
+            self.record('2024010%dT000000.000-update-status' % day, 10, 10)
+        profiling.prune_reports(max_reports=2, max_megabytes=1)
+        self.assertEqual(self.names(), ['20240104T000000.000-update-status',
+                                        '20240103T000000.000-update-status'])
+        self.assertEqual(len(os.listdir(self.reports)), 4)
+
+    def test_prune_to_size_keeps_the_newest(self):
+        megabyte = 1024 * 1024
+        self.record('20240101T000000.000-install', megabyte // 2)
+        self.record('20240102T000000.000-upgrade-charm', megabyte // 2)
+        self.record('20240103T000000.000-config-changed', megabyte)
+        profiling.prune_reports(max_reports=10, max_megabytes=1)
+        self.assertEqual(self.names(), ['20240103T000000.000-config-changed'])
+        profiling.prune_reports(max_reports=0, max_megabytes=0)
+        self.assertEqual(self.names(), ['20240103T000000.000-config-changed'])
+
+    def test_memory_mode_needs_tracemalloc(self):
+        os.environ[profiling.PROFILE_ENV] = 'cpu,memory'
+        self.addCleanup(os.environ.pop, profiling.PROFILE_ENV)
+        if profiling.tracemalloc is None:
+            self.assertEqual(profiling.profiling_modes(), ['cpu'])
+        else:
+            self.assertEqual(profiling.profiling_modes(), ['cpu', 'memory'])
+        os.environ[profiling.PROFILE_ENV] = ''
+        self.assertEqual(profiling.profiling_modes(), [])
+
+    def test_profiled_run_writes_a_report(self):
+        os.environ[profiling.PROFILE_ENV] = 'cpu'
+        self.addCleanup(os.environ.pop, profiling.PROFILE_ENV)
+        # pruning reads the charm config, out of reach here
+        self.addCleanup(setattr, profiling, 'prune_reports',
+                        profiling.prune_reports)
+        profiling.prune_reports = lambda: None
+        self.assertEqual(profiling.run_profiled('install', sum, [1, 2]), 3)
+        report, = profiling.list_reports()
+        self.assertTrue(report['name'].endswith('-install'))
+        self.assertEqual(len(report['files']), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
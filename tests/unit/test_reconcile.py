@@ -0,0 +1,103 @@
+import copy
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'bench'))
+
+import fleet  # noqa: E402
+import run_bench  # noqa: E402
+from hook_python import HOOK_PYTHON, hook_python_has  # noqa: E402
+
+HOOK = 'monitors-relation-changed'
+
+
+def metal(machine_id):
+    return machine_id.split('/')[0]
+
+
+@unittest.skipUnless(hook_python_has('pynag', 'jinja2', 'yaml'),
+                     'the hooks need pynag, jinja2 and yaml under %s' %
+                     HOOK_PYTHON)
+class IncrementalReconcileTest(unittest.TestCase):
+    """ An incremental pass must leave charm.cfg as a full rebuild of the
+        same relations would. """
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='nagios-reconcile-')
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.root = run_bench.make_scratch(
+            20, {'incremental_reconcile': True}, self.workdir)
+        self.fixture = os.path.join(self.workdir, 'fixture')
+        with open(os.path.join(self.fixture, 'config.json')) as f:
+            self.config = json.load(f)
+        self.relations = fleet.generate(20)
+        self.run_hook()
+
+    def write_fixture(self, relations, **overrides):
+        shutil.rmtree(self.fixture)
+        config = dict(self.config, **overrides)
+        fleet.write_fixture(relations, config, self.fixture)
+
+    def run_hook(self):
+        result = run_bench.run_hook(self.workdir, HOOK)
+        self.assertEqual(result['status'], 0, 'see %s' % os.path.join(
+            self.workdir, HOOK + '.log'))
+        with open(os.path.join(self.root, 'etc', 'nagios3', 'conf.d',
+                               'charm.cfg')) as f:
+            return f.read()
+
+    def assertMatchesRebuild(self, relations):
+        self.write_fixture(relations)
+        incremental = self.run_hook()
+        self.write_fixture(relations, incremental_reconcile=False)
+        self.assertEqual(incremental, self.run_hook())
+        return incremental
+
+    def units(self, relations, application):
+        for relid, units in relations.items():
+            for unit, settings in units.items():
+                if unit.startswith('nrpe-%s/' % application):
+                    yield relid, unit, settings
+
+    def test_unit_added(self):
+        relations = copy.deepcopy(self.relations)
+        relid, unit, settings = next(self.units(relations, 'keystone'))
+        added = dict(settings, **{'target-id': 'keystone-9',
+                                  'target-address': '10.99.0.9'})
+        relations[relid]['nrpe-keystone/9'] = added
+        charm_cfg = self.assertMatchesRebuild(relations)
+        self.assertIn('keystone-9', charm_cfg)
+
+    def test_unit_removed_with_its_children(self):
+        relations = copy.deepcopy(self.relations)
+        metal_units = dict((settings['machine_id'], (relid, unit))
+                           for relid, unit, settings
+                           in self.units(relations, 'nova-compute'))
+        children = [settings for relid, units in relations.items()
+                    for settings in units.values()
+                    if '/lx' in settings.get('machine_id', '') and
+                    metal(settings['machine_id']) in metal_units]
+        self.assertTrue(children)
+        relid, unit = metal_units[metal(children[0]['machine_id'])]
+        parent = relations[relid].pop(unit)['target-id']
+        charm_cfg = self.assertMatchesRebuild(relations)
+        self.assertNotIn(['parents', parent],
+                         [line.split() for line in charm_cfg.splitlines()])
+
+    def test_parent_changed(self):
+        relations = copy.deepcopy(self.relations)
+        machines = sorted(settings['machine_id'] for _, _, settings
+                          in self.units(relations, 'nova-compute'))
+        self.assertTrue(len(machines) > 1)
+        relid, unit, settings = next(self.units(relations, 'keystone'))
+        others = [m for m in machines if m != metal(settings['machine_id'])]
+        settings['machine_id'] = '%s/lxd/7' % others[0]
+        self.assertMatchesRebuild(relations)
+
+
+if __name__ == '__main__':
+    unittest.main()
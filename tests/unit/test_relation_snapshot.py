@@ -0,0 +1,96 @@
+import copy
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'bench'))
+
+import fleet  # noqa: E402
+import run_bench  # noqa: E402
+from hook_python import HOOK_PYTHON, hook_python_has  # noqa: E402
+
+# Loads a snapshot under the hook interpreter and prints it as JSON, along
+# with whether any level of it could be changed
+LOAD_SNAPSHOT = '''
+import json, sys
+import common
+snapshot = common.load_relation_snapshot(int(sys.argv[1]))
+def writable(mapping):
+    try:
+        mapping['x'] = 1
+    except TypeError:
+        return False
+    return True
+levels = [snapshot] + list(snapshot.values()) + [
+    settings for units in snapshot.values() for settings in units.values()]
+print(json.dumps({
+    'snapshot': dict((relid, dict((unit, dict(settings))
+                                  for unit, settings in units.items()))
+                     for relid, units in snapshot.items()),
+    'writable': any(writable(level) for level in levels)}))
+'''
+
+
+@unittest.skipUnless(hook_python_has('pynag', 'yaml'),
+                     'common needs pynag and yaml under %s' % HOOK_PYTHON)
+class LoadRelationSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='nagios-snapshot-')
+        self.addCleanup(shutil.rmtree, self.workdir)
+        run_bench.make_scratch(20, {}, self.workdir)
+        self.fixture = os.path.join(self.workdir, 'fixture')
+        with open(os.path.join(self.fixture, 'config.json')) as f:
+            self.config = json.load(f)
+        self.relations = fleet.generate(20)
+        # a unit that has not sent what to monitor yet
+        relid = min(r for r in self.relations if r.startswith('monitors:'))
+        self.relations[relid]['nrpe-new/0'] = {
+            'private-address': '10.9.0.1', 'ingress-address': '10.9.0.1'}
+        shutil.rmtree(self.fixture)
+        fleet.write_fixture(self.relations, self.config, self.fixture)
+
+    def load(self, workers):
+        env = run_bench.hook_env(self.workdir, 'monitors-relation-changed')
+        env['PYTHONPATH'] = os.path.join(self.workdir, 'charm', 'hooks')
+        calls = os.path.join(self.workdir, 'calls.log')
+        open(calls, 'w').close()
+        output = subprocess.check_output(
+            [HOOK_PYTHON, '-c', LOAD_SNAPSHOT, str(workers)],
+            cwd=os.path.join(self.workdir, 'charm'), env=env)
+        with open(calls) as f:
+            tools = [line.strip() for line in f]
+        return json.loads(output.decode('utf-8').splitlines()[-1]), tools
+
+    def expected(self):
+        relations = copy.deepcopy(self.relations)
+        for relid, units in relations.items():
+            for unit, settings in list(units.items()):
+                if relid.startswith('nagios:'):
+                    settings.update({
+                        'target-id': unit.replace('/', '-'),
+                        'target-address': settings['ingress-address'],
+                        'monitors': '{"monitors": {"remote": {}}}'})
+                elif 'monitors' not in settings:
+                    del units[unit]
+        return relations
+
+    def test_snapshot_of_every_unit(self):
+        loaded, tools = self.load(4)
+        self.assertEqual(loaded['snapshot'], self.expected())
+        self.assertFalse(loaded['writable'])
+        units = sum(len(units) for units in self.relations.values())
+        self.assertEqual(tools.count('relation-get'), units)
+        self.assertEqual(tools.count('relation-ids'), 2)
+        self.assertEqual(tools.count('relation-list'), len(self.relations))
+
+    def test_workers_do_not_change_the_snapshot(self):
+        self.assertEqual(self.load(1)[0], self.load(8)[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..',
+                                'hooks'))
+
+from hook_python import importable, under_hook_python  # noqa: E402
+
+if importable('six', 'jinja2'):
+    import rendering  # noqa: E402
+else:
+    rendering = None
+
+HookPythonTest = under_hook_python('test_rendering', 'six', 'jinja2')
+
+
+@unittest.skipIf(rendering is None, 'rendering needs six and jinja2')
+class RenderingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.target = os.path.join(self.dir, 'nagios.cfg')
+        del rendering._changed_files[:]
+        self.addCleanup(setattr, rendering, '_environment', None)
+        rendering._environment = None
+        os.environ['CHARM_DIR'] = self.dir
+        self.addCleanup(os.environ.pop, 'CHARM_DIR')
+
+    def write(self, content, perms=0o644):
+        with open(self.target, 'w') as f:
+            f.write(content)
+        os.chmod(self.target, perms)
+
+    def read(self):
+        with open(self.target) as f:
+            return f.read()
+
+    def mode(self):
+        return stat.S_IMODE(os.stat(self.target).st_mode)
+
+    def test_unchanged_file_is_left_alone(self):
+        self.write('cfg_dir=conf.d\n')
+        inode = os.stat(self.target).st_ino
+        self.assertFalse(rendering.write_if_changed(self.target,
+                                                    u'cfg_dir=conf.d\n'))
+        self.assertEqual(os.stat(self.target).st_ino, inode)
+        self.assertEqual(rendering.changed_files(), [])
+
+    def test_changed_file_is_replaced(self):
+        self.write('cfg_dir=conf.d\n')
+        self.assertTrue(rendering.write_if_changed(self.target,
+                                                   b'cfg_dir=objects\n',
+                                                   0o640))
+        self.assertEqual(self.read(), 'cfg_dir=objects\n')
+        self.assertEqual(self.mode(), 0o640)
+        self.assertEqual(rendering.changed_files(), [self.target])
+
+    def test_other_perms_only_are_replaced(self):
+        self.write('#!/bin/sh\n')
+        self.assertTrue(rendering.write_if_changed(self.target,
+                                                   '#!/bin/sh\n', 0o755))
+        self.assertEqual(self.mode(), 0o755)
+        self.assertEqual(rendering.changed_files(), [self.target])
+        self.assertFalse(rendering.write_if_changed(self.target,
+                                                    '#!/bin/sh\n', 0o755))
+
+    def test_missing_file_is_written(self):
+        self.assertTrue(rendering.write_if_changed(self.target, 'x=1\n'))
+        self.assertEqual(self.read(), 'x=1\n')
+        self.assertEqual(self.mode(), 0o644)
+
+    def test_remove_if_present(self):
+        self.assertFalse(rendering.remove_if_present(self.target))
+        self.write('x=1\n')
+        self.assertTrue(rendering.remove_if_present(self.target))
+        self.assertFalse(os.path.exists(self.target))
+        self.assertEqual(rendering.changed_files(), [self.target])
+
+    def test_templates_share_one_cached_environment(self):
+        environment = rendering.template_environment()
+        self.assertIs(rendering.template_environment(), environment)
+        context = {'url_dir': '/nagios-metrics',
+                   'metrics_dir': '/var/lib/nagios3/metrics',
+                   'scrapers': ['10.0.0.7']}
+        self.assertTrue(rendering.render_template(
+            'nagios-metrics-apache.tmpl', self.target, context))
+        self.assertIn('Require ip 10.0.0.7', self.read())
+        self.assertFalse(rendering.render_template(
+            'nagios-metrics-apache.tmpl', self.target, context))
+        # the compiled template is kept for the next hook
+        self.assertTrue(os.listdir(os.path.join(
+            self.dir, rendering.BYTECODE_CACHE_DIR_NAME)))
+
+
+if __name__ == '__main__':
+    unittest.main()
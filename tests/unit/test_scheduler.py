@@ -0,0 +1,75 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..',
+                                'hooks'))
+
+import scheduler  # noqa: E402
+
+GIB = 1024 ** 3
+
+
+class AutoTuneTest(unittest.TestCase):
+
+    def tune(self, hosts, services, cpus=4, ram=8 * GIB):
+        return scheduler.auto_tune(hosts, services, cpus, ram)[0]
+
+    def test_small_fleet_keeps_the_stock_values(self):
+        settings = self.tune(10, 100)
+        for name, value in scheduler.SCHEDULER_DEFAULTS.items():
+            if name != 'max_concurrent_checks':
+                self.assertEqual(settings[name], value, name)
+
+    def test_concurrency_limited_by_cpu_or_memory(self):
+        self.assertEqual(self.tune(10, 100)['max_concurrent_checks'], 128)
+        self.assertEqual(
+            self.tune(10, 100, ram=GIB)['max_concurrent_checks'], 32)
+        self.assertEqual(
+            self.tune(10, 100, ram=0)['max_concurrent_checks'], 1)
+
+    def test_large_installation_threshold(self):
+        below = self.tune(100, scheduler.LARGE_INSTALLATION_SERVICES - 1)
+        at = self.tune(100, scheduler.LARGE_INSTALLATION_SERVICES)
+        self.assertEqual(below['use_large_installation_tweaks'], 0)
+        self.assertEqual(at['use_large_installation_tweaks'], 1)
+
+    def test_environment_macros_stay_enabled(self):
+        for services in (0, 2000, 50000):
+            self.assertEqual(
+                self.tune(100, services)['enable_environment_macros'], 1)
+
+    def test_reaper_frequency_steps(self):
+        # 500 results per reaper run at one check per host every 300s
+        for checks, frequency in ((15000, 10), (15001, 5), (30000, 5),
+                                  (30001, 2)):
+            settings = self.tune(checks, 0)
+            self.assertEqual(settings['check_result_reaper_frequency'],
+                             frequency, checks)
+            self.assertEqual(settings['max_check_result_reaper_time'],
+                             frequency * 3, checks)
+
+    def test_status_update_interval_steps(self):
+        for checks, interval in ((4999, 10), (5000, 30), (19999, 30),
+                                 (20000, 60)):
+            self.assertEqual(
+                self.tune(checks, 0)['status_update_interval'], interval,
+                checks)
+
+    def test_check_spread(self):
+        # 128 checks at a time, 3 seconds each
+        self.assertEqual(self.tune(76800, 0)['max_service_check_spread'], 30)
+        self.assertEqual(self.tune(76801, 0)['max_service_check_spread'], 35)
+
+    def test_reasons_name_each_change(self):
+        settings, reasons = scheduler.auto_tune(1000, 30000, 4, 8 * GIB)
+        changed = [name for name, value in settings.items()
+                   if value != scheduler.SCHEDULER_DEFAULTS[name]]
+        for name in changed:
+            self.assertTrue(any(reason.startswith(name) or
+                                ', %s=' % name in reason
+                                for reason in reasons), name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'bench'))
+
+import run_bench  # noqa: E402
+from hook_python import HOOK_PYTHON, hook_python_has  # noqa: E402
+
+# Stands in for a hook: schedules the requested service actions, runs a
+# child hook with the deferral env for each of children, then runs its
+# own actions and prints which it ran instead of running them
+HOOK_SCRIPT = '''
+import json
+import subprocess
+import sys
+
+import common
+
+ran = []
+common.service_reload = lambda service: ran.append(['reload', service])
+common.service_restart = lambda service: ran.append(['restart', service])
+
+requests, children = json.loads(sys.argv[1])
+for service, action in requests:
+    common.schedule_service_action(service, action)
+child_results = [
+    json.loads(subprocess.check_output(
+        [sys.executable, sys.argv[0], json.dumps([child, []])],
+        env=common.defer_service_actions_env()).splitlines()[-1])
+    for child in children]
+common.run_service_actions()
+print(json.dumps({
+    'ran': ran,
+    'children': child_results,
+    'deferred': common.unitdata.kv().get(common.DEFERRED_ACTIONS_KEY)}))
+'''
+
+
+@unittest.skipUnless(hook_python_has('pynag', 'yaml'),
+                     'common needs pynag and yaml under %s' % HOOK_PYTHON)
+class ServiceActionsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='nagios-actions-')
+        self.addCleanup(shutil.rmtree, self.workdir)
+        run_bench.make_scratch(1, {}, self.workdir)
+        self.script = os.path.join(self.workdir, 'hook.py')
+        with open(self.script, 'w') as f:
+            f.write(HOOK_SCRIPT)
+
+    def run_hook(self, requests, children=()):
+        env = run_bench.hook_env(self.workdir, 'upgrade-charm')
+        env['PYTHONPATH'] = os.path.join(self.workdir, 'charm', 'hooks')
+        output = subprocess.check_output(
+            [HOOK_PYTHON, self.script,
+             json.dumps([requests, list(children)])],
+            cwd=os.path.join(self.workdir, 'charm'), env=env)
+        return json.loads(output.decode('utf-8').splitlines()[-1])
+
+    def test_repeated_reloads_run_once(self):
+        result = self.run_hook([['nagios3', 'reload']] * 3 +
+                               [['apache2', 'reload']])
+        self.assertEqual(result['ran'], [['reload', 'apache2'],
+                                         ['reload', 'nagios3']])
+        self.assertIsNone(result['deferred'])
+
+    def test_restart_wins_over_reload(self):
+        result = self.run_hook([['nagios3', 'reload'],
+                                ['nagios3', 'restart'],
+                                ['nagios3', 'reload']])
+        self.assertEqual(result['ran'], [['restart', 'nagios3']])
+
+    def test_deferred_child_leaves_its_actions_to_the_parent(self):
+        result = self.run_hook(
+            [['nagios3', 'reload']],
+            children=[[['nagios3', 'restart'], ['apache2', 'reload']],
+                      [['apache2', 'reload']]])
+        first, second = result['children']
+        self.assertEqual(first['ran'], [])
+        self.assertEqual(first['deferred'], {'nagios3': 'restart',
+                                             'apache2': 'reload',
+                                             '_requests': 2})
+        self.assertEqual(second['ran'], [])
+        self.assertEqual(second['deferred']['_requests'], 3)
+
+        self.assertEqual(result['ran'], [['reload', 'apache2'],
+                                         ['restart', 'nagios3']])
+        self.assertIsNone(result['deferred'])
+
+
+if __name__ == '__main__':
+    unittest.main()
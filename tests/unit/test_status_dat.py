@@ -0,0 +1,118 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..',
+                                'hooks'))
+
+import status_dat  # noqa: E402
+
+STATUS = '''info {
+\tcreated=1600000000
+\t}
+
+hoststatus {
+\thost_name=web-0
+\tcurrent_state=1
+\tlast_state_change=1599990000
+\tplugin_output=CRITICAL - Host Unreachable
+\t}
+
+servicestatus {
+\thost_name=web-0
+\tservice_description=check_http
+\tcurrent_state=2
+\tlast_state_change=1599999000
+\tplugin_output=HTTP CRITICAL: 503
+\tcheck_latency=0.25
+\t}
+
+servicestatus {
+\thost_name=db-0
+\tservice_description=check_disk
+\tcurrent_state=0
+\tlast_state_change=1500000000
+\tplugin_output=DISK OK
+\t}
+
+servicestatus {
+\thost_name=db-1
+\tservice_description=check_disk
+\tcurrent_state=2
+\tlast_state_change=1500000000
+\tplugin_output=DISK CRITICAL
+\t}
+'''
+OBJECTS = '''define hostgroup {
+\thostgroup_name\tmysql
+\talias\tmysql
+\tmembers\tdb-0,db-1
+\t}
+
+define host {
+\thost_name\tdb-0
+\t}
+'''
+
+
+class TestStatusDat(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.status = os.path.join(self.dir, 'status.dat')
+        self.objects = os.path.join(self.dir, 'objects.cache')
+        with open(self.status, 'w') as f:
+            f.write(STATUS)
+        with open(self.objects, 'w') as f:
+            f.write(OBJECTS)
+
+    def query(self, **filters):
+        return [record.name for record in status_dat.query(
+            path=self.status, objects_path=self.objects, now=1600000000,
+            **filters)]
+
+    def test_projection(self):
+        records = list(status_dat.iter_status(
+            'service', ('host_name', 'check_latency'), self.status))
+        self.assertEqual(records[0].as_dict(),
+                         {'host_name': 'web-0', 'check_latency': 0.25})
+        self.assertFalse(hasattr(records[0], 'plugin_output'))
+        self.assertFalse(hasattr(records[0], '__dict__'))
+
+    def test_every_field_defaults_to_none(self):
+        host, = status_dat.iter_status('host', path=self.status)
+        self.assertEqual(host.state, 'DOWN')
+        self.assertEqual(host.last_check, None)
+
+    def test_unknown_field(self):
+        self.assertRaises(ValueError, status_dat.record_class, 'host',
+                          ('no_such_field',))
+
+    def test_filters(self):
+        self.assertEqual(self.query(states=['critical']),
+                         ['web-0/check_http', 'db-1/check_disk'])
+        self.assertEqual(self.query(hosts=['db-*'], states=['OK']),
+                         ['db-0/check_disk'])
+        self.assertEqual(self.query(hostgroups=['mysql'], min_age=3600),
+                         ['db-0/check_disk', 'db-1/check_disk'])
+        self.assertEqual(self.query(kind='host'), ['web-0'])
+        self.assertEqual(self.query(services=['check_http'], min_age=3600),
+                         [])
+
+    def test_invalid_filters(self):
+        for filters in ({'kind': 'host', 'services': ['check_http']},
+                        {'kind': 'contact'},
+                        {'kind': 'host', 'states': ['CRITICAL']},
+                        {'states': ['broken']},
+                        {'fields': ['no_such_field']}):
+            # raised by the call itself, before iterating
+            self.assertRaises(ValueError, status_dat.query, path=self.status,
+                              objects_path=self.objects, **filters)
+        self.assertEqual(self.query(kind='host', states=['down']), ['web-0'])
+
+
+if __name__ == '__main__':
+    unittest.main()